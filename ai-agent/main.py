@@ -1,43 +1,100 @@
 import os
+import json
+import time
+import asyncio
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError, field_validator
+from typing import Optional, Dict, Any, List, Tuple
 from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from services.code_generator import CodeGenerator
-from services.artifact_manager import ArtifactManager
+from services.artifact_manager import ARTIFACT_COLUMNS, ArtifactManager, PreviewNotReady
+from services.artifact_editor import ArtifactEditor, ArtifactNotEditable, PatchError
+from services.image_store import ImageStore
+from services.job_queue import JobQueue, JobQueueFull
+from services.shared_state import SharedState
+from services.metrics import mark_worker_dead, metrics_registry
+from services.tracing import TracingMiddleware, setup_tracing
+from services.log_pipeline import RequestIdMiddleware, setup_logging
+from services.preview_renderer import PreviewTooLarge
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/app/logs/agent.log'),
-        logging.StreamHandler()
-    ]
-)
+# Logging goes through a queue to a background writer thread
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Browsers and the CDN may reuse previews, revalidating with the ETag
+PREVIEW_CACHE_CONTROL = os.getenv("PREVIEW_CACHE_CONTROL", "public, max-age=300")
+
+# Largest screenshot accepted as a multipart upload
+SCAFFOLD_MAX_IMAGE_BYTES = int(os.getenv("SCAFFOLD_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+
+# Fan-out limits for /scaffold/batch
+SCAFFOLD_BATCH_CONCURRENCY = int(os.getenv("SCAFFOLD_BATCH_CONCURRENCY", "4"))
+SCAFFOLD_BATCH_MAX_ITEMS = int(os.getenv("SCAFFOLD_BATCH_MAX_ITEMS", "20"))
+
+# Longest instruction accepted by /artifacts/{id}/edit
+EDIT_MAX_INSTRUCTION_CHARS = int(os.getenv("EDIT_MAX_INSTRUCTION_CHARS", "2000"))
+
+# "background" warms provider SDKs and worker pools after the port opens,
+# "eager" before it opens, "lazy" leaves them to the first request
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").lower()
+
 # Global services
 code_generator: Optional[CodeGenerator] = None
 artifact_manager: Optional[ArtifactManager] = None
+job_queue: Optional[JobQueue] = None
+artifact_editor: Optional[ArtifactEditor] = None
+services_ready = False
+
+async def warm_up_services() -> None:
+    """Load what the first generation would otherwise wait for, then report ready"""
+    global services_ready
+    
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(code_generator.warm_up(), artifact_manager.preview_renderer.warm_up())
+    except Exception as e:
+        # Everything warmed here also loads on first use
+        logger.warning(f"Warm-up failed, continuing lazily: {e}")
+    services_ready = True
+    logger.info(f"Services ready {time.perf_counter() - started:.2f}s after warm-up started")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize and cleanup services"""
-    global code_generator, artifact_manager
+    global code_generator, artifact_manager, job_queue, artifact_editor, services_ready
+    
+    tracer_provider = setup_tracing()
+    warm_up_task: Optional[asyncio.Task] = None
     
     try:
         # Initialize services
         logger.info("Initializing AI Agent services...")
         code_generator = CodeGenerator()
-        artifact_manager = ArtifactManager()
+        # Job status, counters and owner lookups shared across worker processes
+        shared_state = SharedState.from_env()
+        artifact_manager = ArtifactManager(shared_state)
+        await artifact_manager.start()
+        # Screenshots referenced by storage path are fetched over the Supabase pool
+        code_generator.image_store = ImageStore(artifact_manager.download_object, code_generator.image_preprocessor)
+        job_queue = JobQueue(code_generator, artifact_manager, shared_state)
+        await job_queue.start()
+        artifact_editor = ArtifactEditor(code_generator, artifact_manager)
+        
+        if STARTUP_WARMUP == "eager":
+            await warm_up_services()
+        elif STARTUP_WARMUP == "background":
+            warm_up_task = asyncio.create_task(warm_up_services())
+        else:
+            services_ready = True
         
         logger.info("AI Agent started successfully")
         yield
@@ -48,6 +105,19 @@ async def lifespan(app: FastAPI):
     finally:
         # Cleanup
         logger.info("Shutting down AI Agent services...")
+        services_ready = False
+        if warm_up_task:
+            warm_up_task.cancel()
+        if job_queue:
+            await job_queue.stop()
+        if artifact_manager:
+            await artifact_manager.close()
+        if code_generator:
+            code_generator.close()
+        if tracer_provider:
+            # Flush spans still buffered in the batch processor
+            tracer_provider.shutdown()
+        mark_worker_dead()
 
 # Create FastAPI app
 app = FastAPI(
@@ -66,13 +136,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# One server span per request, continuing the caller's traceparent
+app.add_middleware(TracingMiddleware)
+
+# Outermost, so the request id is bound before any other middleware logs
+app.add_middleware(RequestIdMiddleware)
+
 # Request/Response models
+def _check_image_path(value: Optional[str]) -> Optional[str]:
+    """Reject storage paths that climb out of the screenshots bucket"""
+    if value and ".." in value.split("/"):
+        raise ValueError("image_path must not contain '..'")
+    return value
+
 class ScaffoldRequest(BaseModel):
     prompt: str
     project_id: str
     image_url: Optional[str] = None  # Legacy param (data URI or http URL)
     image_base64: Optional[str] = None  # New param, preferred
     preferences: Optional[Dict[str, Any]] = None
+    bypass_cache: bool = False  # Force a fresh generation, e.g. on "regenerate"
+    user_id: Optional[str] = None  # Project owner already verified by the caller; skips the lookup
+    image_path: Optional[str] = None  # Screenshot path in the storage bucket, fetched and cached by the agent
+    
+    _validate_image_path = field_validator("image_path")(_check_image_path)
+
+class ScaffoldBatchItem(BaseModel):
+    prompt: str
+    image_url: Optional[str] = None
+    image_base64: Optional[str] = None
+    image_path: Optional[str] = None
+    preferences: Optional[Dict[str, Any]] = None
+    
+    _validate_image_path = field_validator("image_path")(_check_image_path)
+
+class ScaffoldBatchRequest(BaseModel):
+    project_id: str
+    user_id: Optional[str] = None
+    items: List[ScaffoldBatchItem]
+    preferences: Optional[Dict[str, Any]] = None  # Defaults for items without their own
+    bypass_cache: bool = False
+
+def _check_instruction(value: str) -> str:
+    """Reject blank and overlong edit instructions"""
+    value = value.strip()
+    if not value:
+        raise ValueError("instruction must not be empty")
+    if len(value) > EDIT_MAX_INSTRUCTION_CHARS:
+        raise ValueError(f"instruction must be at most {EDIT_MAX_INSTRUCTION_CHARS} characters")
+    return value
+
+class EditRequest(BaseModel):
+    instruction: str  # e.g. "Make the header sticky and the CTA button green"
+    
+    _validate_instruction = field_validator("instruction")(_check_instruction)
+
+class EditResponse(BaseModel):
+    artifact_id: str
+    parent_artifact_id: str
+    preview_url: str
+    changed_files: List[str]
+    edits: int
+    sanitized: Dict[str, str]  # Per file: reused, fragment or full
+    provider: str
+    model: str
+    usage: Dict[str, int]
+    context_chars: int
+    source_chars: int
 
 class ScaffoldResponse(BaseModel):
     artifact_id: str
@@ -80,6 +210,13 @@ class ScaffoldResponse(BaseModel):
     preview_url: str
     message: str
 
+class JobResponse(BaseModel):
+    job_id: str
+    artifact_id: str
+    status: str
+    status_url: str
+    preview_url: str
+
 class HealthResponse(BaseModel):
     status: str
     version: str
@@ -93,13 +230,98 @@ async def health_check():
         version="1.0.0",
         services={
             "code_generator": "ready" if code_generator else "not_ready",
-            "artifact_manager": "ready" if artifact_manager else "not_ready"
+            "artifact_manager": "ready" if artifact_manager else "not_ready",
+            "job_queue": "ready" if job_queue else "not_ready"
         }
     )
 
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: the process is up and serving HTTP"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: services are built and warmed, and the job queue accepts work"""
+    checks = {
+        "code_generator": code_generator is not None,
+        "artifact_manager": artifact_manager is not None,
+        "job_queue": job_queue is not None and job_queue.accepting,
+        "warmed_up": services_ready
+    }
+    status = "ready" if all(checks.values()) else "not_ready"
+    return JSONResponse(
+        status_code=200 if status == "ready" else 503,
+        content={"status": status, "checks": checks}
+    )
+
+@app.get("/stats")
+async def get_stats():
+    """Runtime metrics for connection pools and caches"""
+    if not artifact_manager or not code_generator:
+        raise HTTPException(status_code=503, detail="Services not ready")
+    
+    return {
+        "supabase_pool": artifact_manager.get_pool_stats(),
+        "preview_cache": artifact_manager.preview_cache.stats(),
+        "preview_renderer": artifact_manager.preview_renderer.stats(),
+        "project_owners": artifact_manager.get_project_owner_stats(),
+        "shared_state": artifact_manager.state.stats() if artifact_manager.state else None,
+        "job_queue": job_queue.stats() if job_queue else None,
+        "generation_cache": code_generator.generation_cache.stats() if code_generator.generation_cache else None,
+        "single_flight": code_generator.single_flight.stats(),
+        "hedging": code_generator.get_hedge_stats(),
+        "providers": code_generator.get_router_stats(),
+        "prompts": code_generator.get_prompt_stats(),
+        "image_preprocessing": code_generator.image_preprocessor.stats(),
+        "image_store": code_generator.image_store.stats() if code_generator.image_store else None,
+        "edits": artifact_editor.stats() if artifact_editor else None
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage latency histograms, tokens and cost per provider/model"""
+    return Response(content=generate_latest(metrics_registry()), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+async def _read_scaffold_request(raw_request: Request) -> Tuple[ScaffoldRequest, Optional[bytes], Optional[str]]:
+    """Parse a JSON scaffold request, or multipart/form-data with the screenshot as a binary "image" part
+    
+    Returns the request, the uploaded image bytes and their content type.
+    Uploads are spooled by the form parser and read once, so the image is
+    never base64-encoded or held as a JSON string on the way in.
+    """
+    content_type = raw_request.headers.get("content-type", "")
+    
+    try:
+        if not content_type.startswith("multipart/form-data"):
+            return ScaffoldRequest(**(await raw_request.json())), None, None
+        
+        form = await raw_request.form(max_files=1)
+        fields: Dict[str, Any] = {key: value for key, value in form.items() if isinstance(value, str)}
+        if fields.get("preferences"):
+            fields["preferences"] = json.loads(fields["preferences"])
+        request = ScaffoldRequest(**fields)
+        
+        upload = form.get("image")
+        if upload is None or isinstance(upload, str):
+            return request, None, None
+        
+        if upload.size is not None and upload.size > SCAFFOLD_MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {SCAFFOLD_MAX_IMAGE_BYTES} bytes")
+        
+        image_bytes = await upload.read()
+        await upload.close()
+        return request, image_bytes or None, upload.content_type
+        
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request body: {e}")
+
 @app.post("/scaffold", response_model=ScaffoldResponse)
-async def scaffold_code(request: ScaffoldRequest, background_tasks: BackgroundTasks):
-    """Generate code from prompt and create artifact"""
+async def scaffold_code(raw_request: Request):
+    """Generate code from prompt and create artifact; accepts JSON or multipart/form-data"""
+    request, image_bytes, image_mime_type = await _read_scaffold_request(raw_request)
     try:
         if not code_generator or not artifact_manager:
             raise HTTPException(status_code=503, detail="Services not ready")
@@ -113,7 +335,11 @@ async def scaffold_code(request: ScaffoldRequest, background_tasks: BackgroundTa
         generated_code = await code_generator.generate_from_prompt(
             prompt=request.prompt,
             image_url=image_param,
-            preferences=request.preferences or {}
+            preferences=request.preferences or {},
+            use_cache=not request.bypass_cache,
+            image_bytes=image_bytes,
+            image_mime_type=image_mime_type,
+            image_path=request.image_path
         )
         
         # Create artifact
@@ -121,7 +347,8 @@ async def scaffold_code(request: ScaffoldRequest, background_tasks: BackgroundTa
             project_id=request.project_id,
             html_content=generated_code["html"],
             css_content=generated_code["css"],
-            js_content=generated_code["js"]
+            js_content=generated_code["js"],
+            user_id=request.user_id
         )
         
         # Generate preview URL
@@ -136,22 +363,281 @@ async def scaffold_code(request: ScaffoldRequest, background_tasks: BackgroundTa
             message="Code generated successfully"
         )
         
+    except PreviewTooLarge as e:
+        logger.warning(f"Rejected oversized generation for project {request.project_id}: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Code generation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/scaffold/stream")
+async def scaffold_code_stream(raw_request: Request):
+    """Generate code and stream html/css/js deltas as Server-Sent Events; accepts JSON or multipart/form-data"""
+    request, image_bytes, image_mime_type = await _read_scaffold_request(raw_request)
+    if not code_generator or not artifact_manager:
+        raise HTTPException(status_code=503, detail="Services not ready")
+    
+    from fastapi.responses import StreamingResponse
+    
+    async def event_stream():
+        started = time.perf_counter()
+        first_token_at: Optional[float] = None
+        
+        # Flush headers and an initial event before the provider answers
+        yield _sse_event("start", {"project_id": request.project_id})
+        
+        try:
+            generated_code: Dict[str, str] = {}
+            async for event in code_generator.stream_from_prompt(
+                prompt=request.prompt,
+                image_url=request.image_base64 or request.image_url,
+                preferences=request.preferences or {},
+                use_cache=not request.bypass_cache,
+                image_bytes=image_bytes,
+                image_mime_type=image_mime_type,
+                image_path=request.image_path
+            ):
+                if event["type"] == "delta":
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        logger.info(f"First token for project {request.project_id} after {first_token_at - started:.2f}s")
+                    yield _sse_event("delta", {"field": event["field"], "text": event["text"]})
+                else:
+                    generated_code = event["code"]
+            
+            artifact_id = await artifact_manager.create_artifact(
+                project_id=request.project_id,
+                html_content=generated_code["html"],
+                css_content=generated_code["css"],
+                js_content=generated_code["js"],
+                user_id=request.user_id
+            )
+            
+            logger.info(f"Streamed code generation completed for project {request.project_id}")
+            yield _sse_event("complete", {
+                "artifact_id": artifact_id,
+                "status": "completed",
+                "preview_url": f"/preview/{artifact_id}",
+                "message": "Code generated successfully"
+            })
+        except Exception as e:
+            logger.error(f"Streamed code generation failed: {e}")
+            yield _sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/scaffold/batch")
+async def scaffold_code_batch(request: ScaffoldBatchRequest):
+    """Generate several screens for one project, streaming each item's result as Server-Sent Events"""
+    if not code_generator or not artifact_manager:
+        raise HTTPException(status_code=503, detail="Services not ready")
+    if not request.items:
+        raise HTTPException(status_code=400, detail="At least one item is required")
+    if len(request.items) > SCAFFOLD_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {SCAFFOLD_BATCH_MAX_ITEMS} items per batch")
+    
+    from fastapi.responses import StreamingResponse
+    
+    async def generate_item(index: int, item: ScaffoldBatchItem, user_id: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                generated_code = await code_generator.generate_from_prompt(
+                    prompt=item.prompt,
+                    image_url=item.image_base64 or item.image_url,
+                    preferences=item.preferences or request.preferences or {},
+                    use_cache=not request.bypass_cache,
+                    image_path=item.image_path
+                )
+                row = await artifact_manager.prepare_artifact(
+                    request.project_id,
+                    user_id,
+                    generated_code["html"],
+                    generated_code["css"],
+                    generated_code["js"]
+                )
+                return index, row, None
+            except Exception as e:
+                logger.error(f"Batch item {index} for project {request.project_id} failed: {e}")
+                return index, None, str(e)
+    
+    async def event_stream():
+        yield _sse_event("start", {"project_id": request.project_id, "items": len(request.items)})
+        
+        try:
+            # One project lookup for the whole batch
+            user_id = await artifact_manager.resolve_user_id(request.project_id, request.user_id)
+        except Exception as e:
+            logger.error(f"Batch generation failed for project {request.project_id}: {e}")
+            yield _sse_event("error", {"detail": str(e)})
+            return
+        
+        semaphore = asyncio.Semaphore(SCAFFOLD_BATCH_CONCURRENCY)
+        tasks = [
+            asyncio.ensure_future(generate_item(index, item, user_id, semaphore))
+            for index, item in enumerate(request.items)
+        ]
+        
+        try:
+            generated = []
+            for next_done in asyncio.as_completed(tasks):
+                index, row, error = await next_done
+                if error is not None:
+                    yield _sse_event("item", {"index": index, "status": "failed", "error": error})
+                    continue
+                
+                # No id yet: the row does not exist until the bulk insert below
+                generated.append((index, row))
+                yield _sse_event("item", {"index": index, "status": "generated"})
+            
+            # Every successful item is stored with one bulk insert, then announced
+            stored = []
+            if generated:
+                try:
+                    await artifact_manager.insert_artifacts([row for _, row in generated])
+                    stored = generated
+                except Exception as e:
+                    logger.error(f"Storing batch for project {request.project_id} failed: {e}")
+                    for index, _ in generated:
+                        yield _sse_event("item", {"index": index, "status": "failed", "error": str(e)})
+            
+            for index, row in stored:
+                yield _sse_event("item", {
+                    "index": index,
+                    "status": "stored",
+                    "artifact_id": row["id"],
+                    "preview_url": row["preview_url"]
+                })
+            
+            rows = [row for _, row in stored]
+            logger.info(f"Batch generation for project {request.project_id}: {len(rows)}/{len(tasks)} items stored")
+            yield _sse_event("complete", {
+                "status": "completed" if len(rows) == len(tasks) else "partial",
+                "artifact_ids": [row["id"] for row in rows],
+                "succeeded": len(rows),
+                "failed": len(tasks) - len(rows)
+            })
+        except Exception as e:
+            logger.error(f"Batch generation failed for project {request.project_id}: {e}")
+            yield _sse_event("error", {"detail": str(e)})
+        finally:
+            # Stop outstanding generations if the client went away
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_scaffold_job(raw_request: Request):
+    """Queue a code generation and return immediately with its job/artifact id; accepts JSON or multipart/form-data"""
+    request, image_bytes, image_mime_type = await _read_scaffold_request(raw_request)
+    if not job_queue:
+        raise HTTPException(status_code=503, detail="Job queue not ready")
+    
+    try:
+        job = await job_queue.submit(
+            project_id=request.project_id,
+            prompt=request.prompt,
+            image_url=request.image_base64 or request.image_url,
+            preferences=request.preferences or {},
+            use_cache=not request.bypass_cache,
+            user_id=request.user_id,
+            image_bytes=image_bytes,
+            image_mime_type=image_mime_type,
+            image_path=request.image_path
+        )
+    except JobQueueFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many generations in progress, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+    except Exception as e:
+        logger.error(f"Failed to queue scaffold job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return JobResponse(
+        job_id=job.id,
+        artifact_id=job.id,
+        status=job.status,
+        status_url=f"/jobs/{job.id}",
+        preview_url=f"/preview/{job.id}"
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Report progress of a queued code generation"""
+    if not job_queue or not artifact_manager:
+        raise HTTPException(status_code=503, detail="Job queue not ready")
+    
+    # Tracked by this worker or published by another one
+    job = await job_queue.lookup(job_id)
+    if job:
+        return job
+    
+    # Jobs are forgotten after their retention window; the artifact row keeps the outcome
+    try:
+        artifact = await artifact_manager.get_artifact_metadata(job_id)
+    except RuntimeError as e:
+        if "Artifact not found" in str(e):
+            raise HTTPException(status_code=404, detail="Job not found")
+        logger.error(f"Failed to get job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "job_id": job_id,
+        "artifact_id": job_id,
+        "project_id": artifact.get("project_id"),
+        "status": artifact.get("status"),
+        "error": None,
+        "preview_url": artifact.get("preview_url")
+    }
+
+def _preview_response(html_content: str, etag: str, request: Request, headers: Optional[Dict[str, str]] = None) -> Response:
+    """HTML response with an ETag, or 304 when the client already has this version"""
+    cache_headers = {"ETag": etag, "Cache-Control": PREVIEW_CACHE_CONTROL, **(headers or {})}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=cache_headers)
+    
+    from fastapi.responses import HTMLResponse
+    return HTMLResponse(content=html_content, headers=cache_headers)
+
+def _preview_not_ready(error: PreviewNotReady) -> JSONResponse:
+    """202 while the artifact is still being generated, 404 once it has failed; never cached"""
+    in_progress = error.status in ("pending", "processing")
+    return JSONResponse(
+        status_code=202 if in_progress else 404,
+        content={"status": error.status, "detail": str(error) if in_progress else "Artifact not found"},
+        headers={"Cache-Control": "no-store"}
+    )
+
 @app.get("/preview/{artifact_id}")
-async def preview_artifact(artifact_id: str):
+async def preview_artifact(artifact_id: str, request: Request):
     """Serve preview of generated code"""
     try:
         if not artifact_manager:
             raise HTTPException(status_code=503, detail="Artifact manager not ready")
         
-        html_content = await artifact_manager.get_preview_html(artifact_id)
-        
-        from fastapi.responses import HTMLResponse
-        return HTMLResponse(content=html_content)
+        html_content, etag = await artifact_manager.get_preview(artifact_id)
+        return _preview_response(html_content, etag, request)
         
+    except HTTPException:
+        raise
+    except PreviewNotReady as e:
+        return _preview_not_ready(e)
     except RuntimeError as e:
         if "Artifact not found" in str(e):
             raise HTTPException(status_code=404, detail="Artifact not found")
@@ -162,30 +648,139 @@ async def preview_artifact(artifact_id: str):
         logger.error(f"Preview generation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/preview/{artifact_id}/frame")
+async def preview_artifact_frame(artifact_id: str, request: Request):
+    """Serve the generated page loaded by the preview wrapper's iframe"""
+    try:
+        if not artifact_manager:
+            raise HTTPException(status_code=503, detail="Artifact manager not ready")
+        
+        html_content, etag = await artifact_manager.get_preview_frame(artifact_id)
+        
+        # Sandbox the document even when it is opened directly rather than through the wrapper
+        return _preview_response(html_content, etag, request, {
+            "Content-Security-Policy": "sandbox allow-scripts allow-forms"
+        })
+        
+    except HTTPException:
+        raise
+    except PreviewNotReady as e:
+        return _preview_not_ready(e)
+    except RuntimeError as e:
+        if "Artifact not found" in str(e):
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        else:
+            logger.error(f"Preview frame failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logger.error(f"Preview frame failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/artifacts/{artifact_id}")
-async def get_artifact(artifact_id: str):
-    """Get artifact data"""
+async def get_artifact(artifact_id: str, fields: Optional[str] = None):
+    """Get artifact data, optionally limited to a comma-separated list of fields"""
     try:
         if not artifact_manager:
             raise HTTPException(status_code=503, detail="Artifact manager not ready")
         
-        artifact = await artifact_manager.get_artifact(artifact_id)
+        selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        unknown = [field for field in selected or [] if field not in ARTIFACT_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown artifact fields: {', '.join(unknown)}")
+        
+        artifact = await artifact_manager.get_artifact(artifact_id, selected)
         return artifact
         
+    except HTTPException:
+        raise
+    except RuntimeError as e:
+        if "Artifact not found" in str(e):
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        logger.error(f"Failed to get artifact: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to get artifact: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/artifacts/{artifact_id}/metadata")
+async def get_artifact_metadata(artifact_id: str):
+    """Get artifact status and identifiers without the generated code, for polling"""
+    try:
+        if not artifact_manager:
+            raise HTTPException(status_code=503, detail="Artifact manager not ready")
+        
+        return await artifact_manager.get_artifact_metadata(artifact_id)
+        
+    except HTTPException:
+        raise
+    except RuntimeError as e:
+        if "Artifact not found" in str(e):
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        logger.error(f"Failed to get artifact metadata: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to get artifact metadata: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/artifacts/{artifact_id}/edit", response_model=EditResponse)
+async def edit_artifact(artifact_id: str, request: EditRequest):
+    """Refine a completed artifact from an instruction, storing the result as a new version
+    
+    Only the parts of the page relevant to the instruction are sent to the
+    model, which answers with find/replace edits instead of a whole page.
+    """
+    try:
+        if not artifact_editor:
+            raise HTTPException(status_code=503, detail="Artifact editor not ready")
+        
+        result = await artifact_editor.edit(artifact_id, request.instruction)
+        return EditResponse(**result)
+        
+    except HTTPException:
+        raise
+    except ArtifactNotEditable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except PreviewTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RuntimeError as e:
+        if "Artifact not found" in str(e):
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        logger.error(f"Failed to edit artifact: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to edit artifact: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
+    import shutil
     import uvicorn
     
-    # Create logs directory if it doesn't exist
-    os.makedirs("/app/logs", exist_ok=True)
+    workers = int(os.getenv("AGENT_WORKERS", "1"))
+    if workers > 1:
+        # Worker processes share job state, counters and caches through host-local files
+        os.environ.setdefault("STATE_BACKEND", "sqlite")
+        os.environ.setdefault("GENERATION_CACHE_BACKEND", "sqlite")
+        # RotatingFileHandler cannot rotate one file shared by several processes
+        os.environ.setdefault("LOG_FILE", "/app/logs/agent.{pid}.log")
+        metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/app/temp/prometheus")
+        # Stale files from a previous run would be summed into the new totals
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
     
+    # On SIGTERM uvicorn stops accepting connections, waits for in-flight
+    # requests, then the lifespan drains the job queue
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=os.getenv("AGENT_HOST", "0.0.0.0"),
+        port=int(os.getenv("AGENT_PORT", "8000")),
+        workers=workers,
+        loop=os.getenv("AGENT_LOOP", "uvloop"),
+        http=os.getenv("AGENT_HTTP", "httptools"),
+        timeout_graceful_shutdown=int(os.getenv("AGENT_GRACEFUL_TIMEOUT", "30")),
         reload=False,
-        log_level="info"
+        log_level="info",
+        # Leave uvicorn's loggers unconfigured so they propagate into the queue-based pipeline
+        log_config=None
     )
\ No newline at end of file
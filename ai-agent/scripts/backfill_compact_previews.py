@@ -0,0 +1,114 @@
+"""Rewrite artifacts stored with a rendered preview_html into compact preview columns
+
+Requires the 20251017090000_compact_artifact_previews migration. Reports row
+sizes before and after; use --dry-run to only measure.
+
+Each rewritten row gets a new shared preview version, so running workers
+drop their cached copy. That reaches them through the state store selected
+by STATE_BACKEND/STATE_PATH, so run with the same settings as the agent.
+With the in-memory backend the script cannot reach them: stop the workers
+first, or expect cached previews to be served until PREVIEW_CACHE_TTL.
+
+Usage: python scripts/backfill_compact_previews.py [--batch-size 100] [--limit N] [--dry-run]
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.artifact_manager import ArtifactManager  # noqa: E402
+from services.preview_renderer import PREVIEW_FIELDS, sanitize_preview  # noqa: E402
+from services.shared_state import SharedState  # noqa: E402
+
+load_dotenv()
+
+CODE_FIELDS = ("html_content", "css_content", "js_content")
+
+
+def _size(row: dict, fields: tuple) -> int:
+    return sum(len((row.get(field) or "").encode("utf-8")) for field in fields)
+
+
+async def backfill(batch_size: int, limit: int, dry_run: bool) -> None:
+    manager = ArtifactManager(SharedState.from_env())
+    await manager.start()
+
+    loop = asyncio.get_running_loop()
+    last_id = ""
+    rows_seen = 0
+    bytes_before = 0
+    bytes_after = 0
+
+    try:
+        while not limit or rows_seen < limit:
+            params = {
+                "select": "id," + ",".join(CODE_FIELDS) + ",preview_html",
+                "preview_html": "not.is.null",
+                "preview_body": "is.null",
+                "order": "id",
+                "limit": str(min(batch_size, limit - rows_seen) if limit else batch_size)
+            }
+            if last_id:
+                params["id"] = f"gt.{last_id}"
+
+            response = await manager._request("GET", "/rest/v1/artifacts", params=params)
+            if response.status_code != 200:
+                raise RuntimeError(f"Failed to list artifacts: {response.status_code} {response.text}")
+
+            rows = response.json()
+            if not rows:
+                break
+
+            for row in rows:
+                parts = await loop.run_in_executor(
+                    None, sanitize_preview, *(row.get(field) or "" for field in CODE_FIELDS)
+                )
+
+                code_bytes = _size(row, CODE_FIELDS)
+                bytes_before += code_bytes + _size(row, ("preview_html",))
+                bytes_after += code_bytes + _size(parts, PREVIEW_FIELDS)
+
+                if not dry_run:
+                    update = await manager._request(
+                        "PATCH",
+                        "/rest/v1/artifacts",
+                        params={"id": f"eq.{row['id']}"},
+                        json={**parts, "preview_html": None}
+                    )
+                    if update.status_code not in [200, 204]:
+                        raise RuntimeError(f"Failed to rewrite artifact {row['id']}: {update.status_code}")
+                    await manager._invalidate_preview(row["id"])
+
+            rows_seen += len(rows)
+            last_id = rows[-1]["id"]
+            print(f"{'Measured' if dry_run else 'Rewrote'} {rows_seen} artifacts")
+    finally:
+        await manager.close()
+
+    if rows_seen:
+        print(
+            f"Row content: {bytes_before} -> {bytes_after} bytes "
+            f"({bytes_before / rows_seen:.0f} -> {bytes_after / rows_seen:.0f} per artifact, "
+            f"{100 * (1 - bytes_after / bytes_before):.1f}% smaller)"
+        )
+    else:
+        print("No artifacts with a legacy preview_html")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.batch_size, args.limit, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Throughput of the preview sanitizers against the BeautifulSoup/str.replace implementation
+
+Usage: python scripts/benchmark_sanitizer.py [--size-kb 256] [--repeat 5]
+
+Needs beautifulsoup4 from requirements-dev.txt; the service itself no longer uses it.
+"""
+
+import os
+import re
+import sys
+import html
+import time
+import argparse
+
+from bs4 import BeautifulSoup, Comment
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from services.sanitizer import (  # noqa: E402
+    CSS_BLOCKED_PATTERNS,
+    JS_BLOCKED_PATTERNS,
+    sanitize_css,
+    sanitize_html_body,
+    sanitize_javascript
+)
+
+
+def legacy_sanitize_html(html_content: str) -> str:
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for tag in soup(['script', 'object', 'embed', 'applet', 'meta', 'link']):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    dangerous_attrs = ['onload', 'onclick', 'onmouseover', 'onerror', 'onabort',
+                       'onchange', 'onfocus', 'onblur', 'onsubmit', 'onreset']
+    for tag in soup.find_all():
+        for attr in dangerous_attrs:
+            if tag.has_attr(attr):
+                del tag[attr]
+        if tag.has_attr('href'):
+            href = tag['href']
+            if href.startswith('javascript:') or href.startswith('data:'):
+                del tag['href']
+        if tag.has_attr('src'):
+            if tag['src'].startswith('javascript:'):
+                del tag['src']
+    sanitized = str(soup)
+    body_match = re.search(r'<body[^>]*>(.*?)</body>', sanitized, re.DOTALL | re.IGNORECASE)
+    return body_match.group(1).strip() if body_match else sanitized
+
+
+def legacy_sanitize_css(css_content: str) -> str:
+    sanitized = html.escape(css_content, quote=False)
+    for pattern in CSS_BLOCKED_PATTERNS:
+        sanitized = sanitized.replace(pattern, '')
+    return sanitized
+
+
+def legacy_sanitize_javascript(js_content: str) -> str:
+    sanitized = html.escape(js_content, quote=False)
+    for pattern in JS_BLOCKED_PATTERNS:
+        sanitized = sanitized.replace(pattern, f'/* BLOCKED: {pattern} */')
+    return sanitized
+
+
+def sample_html(size: int) -> str:
+    card = (
+        '<div class="card p-4 rounded-lg shadow" data-id="7" onclick="open()">'
+        '<!-- card --><h2 class="text-xl font-bold">Feature &amp; benefit</h2>'
+        '<p class="text-gray-600">Fast, secure &lt;and&gt; simple.</p>'
+        '<a href="javascript:alert(1)" class="btn">Learn more</a>'
+        '<img src="/img/hero.png" alt="Hero" onerror="x()">'
+        '<script>steal()</script></div>\n'
+    )
+    body = card * (size // len(card) + 1)
+    return f'<!DOCTYPE html><html><head><title>t</title><meta charset="utf-8"></head><body>{body}</body></html>'
+
+
+def sample_css(size: int) -> str:
+    rules = "".join(
+        f".card-{index} > h2 {{ color: #333; margin: 0 auto; padding: {index}px; transition: all .2s; }}\n"
+        for index in range(40)
+    )
+    rules += ".hero { background: url(data:image/png;base64,AAAA); }\n"
+    return rules * (size // len(rules) + 1)
+
+
+def sample_js(size: int) -> str:
+    lines = "".join(
+        f"document.querySelectorAll('.card-{index}').forEach((el) => {{ if (el.offsetTop < {index} && ready) el.classList.add('in'); }});\n"
+        for index in range(30)
+    )
+    lines += "menu.innerHTML = render(items);\n"
+    return lines * (size // len(lines) + 1)
+
+
+def throughput(func, data: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - started)
+    return len(data.encode("utf-8")) / best / (1024 * 1024)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    size = args.size_kb * 1024
+    cases = [
+        ("html", sample_html(size), legacy_sanitize_html, sanitize_html_body),
+        ("css", sample_css(size), legacy_sanitize_css, sanitize_css),
+        ("js", sample_js(size), legacy_sanitize_javascript, sanitize_javascript)
+    ]
+
+    print(f"{'input':<6}{'legacy MB/s':>14}{'current MB/s':>14}{'speedup':>10}  output")
+    for name, data, legacy, current in cases:
+        legacy_rate = throughput(legacy, data, args.repeat)
+        current_rate = throughput(current, data, args.repeat)
+        same = "identical" if legacy(data) == current(data) else "differs"
+        print(f"{name:<6}{legacy_rate:>14.2f}{current_rate:>14.2f}{current_rate / legacy_rate:>9.1f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
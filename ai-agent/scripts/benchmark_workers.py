@@ -0,0 +1,194 @@
+"""Throughput of the agent with 1 vs N uvicorn workers on the preview and scaffold paths
+
+Starts the agent (python main.py) once per worker count, pointed at a
+Supabase instance and at a stub OpenAI-compatible endpoint served by this
+script, then drives concurrent load and reports requests/s and latency.
+
+Usage: python scripts/benchmark_workers.py [--workers 1 4] [--duration 10] [--concurrency 32]
+       [--provider-latency 0.5] [--supabase-url http://127.0.0.1:54321]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+GENERATED = {
+    "html": "<!DOCTYPE html><html><body>" + "<section class=\"p-4\"><h2>Card</h2><p>Body text</p></section>" * 200 + "</body></html>",
+    "css": ".card { color: #333; }\n" * 50,
+    "js": "document.querySelectorAll('section').forEach(function (el) { el.dataset.ready = '1'; });\n" * 20
+}
+
+
+def stub_provider(latency: float) -> FastAPI:
+    """OpenAI chat completions stand-in that answers after a fixed delay"""
+
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def completions(body: Dict):
+        await asyncio.sleep(latency)
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(GENERATED)},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 1200, "completion_tokens": 3000, "total_tokens": 4200}
+        }
+
+    return app
+
+
+def start_stub(port: int, latency: float) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(stub_provider(latency), port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def start_agent(workers: int, port: int, stub_port: int, supabase_url: str, workdir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "AGENT_WORKERS": str(workers),
+        "AGENT_PORT": str(port),
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_SERVICE_ROLE_KEY": os.getenv("SUPABASE_SERVICE_ROLE_KEY", "benchmark"),
+        "STATE_PATH": os.path.join(workdir, "shared_state.sqlite3"),
+        "GENERATION_CACHE_PATH": os.path.join(workdir, "generation_cache.sqlite3"),
+        "IMAGE_STORE_PATH": os.path.join(workdir, "image_store"),
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(workdir, f"prometheus-{workers}")
+    }
+    env.pop("ANTHROPIC_API_KEY", None)
+    if workers == 1:
+        env.pop("PROMETHEUS_MULTIPROC_DIR")
+
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=AGENT_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Agent with {workers} workers did not become healthy")
+
+
+def stop_agent(process: subprocess.Popen) -> float:
+    """SIGTERM the agent and return how long the graceful shutdown took"""
+
+    started = time.perf_counter()
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=120)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    return time.perf_counter() - started
+
+
+async def drive(url: str, method: str, body: Dict, duration: float, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def loop() -> None:
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, url, json=body or None)
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95)
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 2])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--provider-latency", type=float, default=0.5)
+    parser.add_argument("--supabase-url", default=os.getenv("SUPABASE_URL", "http://127.0.0.1:54321"))
+    parser.add_argument("--project-id", default=os.getenv("BENCHMARK_PROJECT_ID", "p1"))
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--stub-port", type=int, default=8199)
+    args = parser.parse_args()
+
+    start_stub(args.stub_port, args.provider_latency)
+    workdir = tempfile.mkdtemp(prefix="agent-bench-")
+    base = f"http://127.0.0.1:{args.port}"
+    scaffold_body = {"prompt": "A pricing page with three cards", "project_id": args.project_id, "bypass_cache": True}
+
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} concurrent clients, {args.duration:.0f}s per path, "
+          f"provider latency {args.provider_latency * 1000:.0f} ms")
+    print(f"{'workers':>7}  {'path':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+
+    for workers in args.workers:
+        process = start_agent(workers, args.port, args.stub_port, args.supabase_url, workdir)
+        try:
+            seed = httpx.post(f"{base}/scaffold", json=scaffold_body, timeout=60)
+            seed.raise_for_status()
+            artifact_id = seed.json()["artifact_id"]
+
+            paths = [
+                ("GET /preview/{id}/frame", "GET", f"{base}/preview/{artifact_id}/frame", {}),
+                ("POST /scaffold", "POST", f"{base}/scaffold", scaffold_body)
+            ]
+            for label, method, url, body in paths:
+                result = asyncio.run(drive(url, method, body, args.duration, args.concurrency))
+                print(f"{workers:>7}  {label:<22} {result['rps']:>9.1f} {result['p50_ms']:>9.1f} "
+                      f"{result['p95_ms']:>9.1f} {result['errors']:>7}")
+        finally:
+            shutdown = stop_agent(process)
+            print(f"{workers:>7}  graceful shutdown took {shutdown:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Cold-start budget check: fails when importing the app (or getting it live) gets too slow
+
+Runs `python -X importtime -c "import main"` a few times and compares the
+best cumulative import time of main against the budget. It also fails if a
+module that should load lazily (the provider SDKs) is imported at startup.
+With --serve it also starts the agent and times /health/live and
+/health/ready.
+
+Usage: python scripts/check_import_time.py [--budget-ms 1500] [--runs 3] [--top 10]
+       [--forbid openai anthropic bs4] [--serve] [--live-budget-s 5]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+import httpx
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_imports() -> Tuple[float, Dict[str, float], List[str]]:
+    """One cold interpreter: (cumulative ms for main, self ms per top-level package, modules imported)"""
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=AGENT_DIR, capture_output=True, text=True, check=True
+    )
+
+    main_ms = 0.0
+    packages: Dict[str, float] = {}
+    modules: List[str] = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, _, module = match.groups()
+        modules.append(module)
+        package = module.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+        if module == "main":
+            main_ms = int(cumulative_us) / 1000
+    return main_ms, packages, modules
+
+
+def measure_serve(port: int) -> Tuple[float, float]:
+    """Seconds from process start until /health/live, then /health/ready, answer 200"""
+
+    env = {
+        "OPENAI_API_KEY": "import-budget",
+        "SUPABASE_SERVICE_ROLE_KEY": "import-budget",
+        **os.environ,
+        "AGENT_PORT": str(port),
+        "AGENT_WORKERS": "1"
+    }
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=AGENT_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    timings = {}
+    try:
+        deadline = started + 120
+        for probe in ("live", "ready"):
+            while time.perf_counter() < deadline and process.poll() is None:
+                try:
+                    if httpx.get(f"http://127.0.0.1:{port}/health/{probe}", timeout=1).status_code == 200:
+                        timings[probe] = time.perf_counter() - started
+                        break
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.05)
+            if probe not in timings:
+                raise RuntimeError(f"Agent never reported /health/{probe}")
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+    return timings["live"], timings["ready"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500")))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--forbid", nargs="*", default=["openai", "anthropic", "bs4"])
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--live-budget-s", type=float, default=float(os.getenv("LIVE_TIME_BUDGET_S", "5")))
+    parser.add_argument("--port", type=int, default=8150)
+    args = parser.parse_args()
+
+    # The first run also compiles bytecode, so keep the best of several
+    runs = [measure_imports() for _ in range(args.runs)]
+    main_ms, packages, modules = min(runs, key=lambda run: run[0])
+    failures = []
+
+    print(f"import main: {main_ms:.0f} ms (budget {args.budget_ms:.0f} ms, best of {args.runs})")
+    for package, self_ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {package:<28} {self_ms:>8.1f} ms")
+    if main_ms > args.budget_ms:
+        failures.append(f"import main took {main_ms:.0f} ms, above the {args.budget_ms:.0f} ms budget")
+
+    imported = {module.split(".")[0] for module in modules}
+    for module in args.forbid:
+        if module in imported:
+            failures.append(f"{module} is imported at startup; it should load on first use")
+
+    if args.serve:
+        live, ready = measure_serve(args.port)
+        print(f"/health/live after {live:.2f}s (budget {args.live_budget_s:.1f}s), /health/ready after {ready:.2f}s")
+        if live > args.live_budget_s:
+            failures.append(f"/health/live took {live:.2f}s, above the {args.live_budget_s:.1f}s budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,494 @@
+import os
+import re
+import math
+import json
+import time
+import logging
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+
+from services.code_generator import CodeGenerator
+from services.artifact_manager import ArtifactManager
+from services.preview_renderer import PREVIEW_FIELDS
+from services.sanitizer import VOID_TAGS
+from services.metrics import EDITS, STAGE_SECONDS
+from services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+FILES = ("html", "css", "js")
+
+# Columns an edit reads from the version it starts from
+EDIT_SOURCE_COLUMNS = (
+    "id", "project_id", "user_id", "status", "html_content", "css_content", "js_content"
+) + PREVIEW_FIELDS
+
+_TAG = re.compile(r"<!--.*?-->|<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*>", re.DOTALL)
+_WORD = re.compile(r"[a-z0-9][a-z0-9-]*")
+_QUOTED = re.compile(r"[\"“]([^\"”]{3,})[\"”]")
+_NAMES = re.compile(r"\b(?:id|class)=[\"']([^\"']+)[\"']")
+_BLANK_LINES = re.compile(r"\n[ \t]*\n")
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+_STOPWORDS = frozenset(
+    "the and for with that this make change add remove set use into from all its our your their "
+    "more less each should please instead also".split()
+)
+
+# Words people use for a part of the page, and the markup it is usually written as
+_ALIASES = {
+    "navbar": ("nav",),
+    "navigation": ("nav",),
+    "menu": ("nav",),
+    "top": ("header", "nav"),
+    "bottom": ("footer",),
+    "title": ("h1", "title"),
+    "heading": ("h1", "h2"),
+    "headline": ("h1",),
+    "image": ("img",),
+    "images": ("img",),
+    "photo": ("img",),
+    "picture": ("img",),
+    "link": ("href",),
+    "links": ("href",),
+    "buttons": ("button",),
+    "cta": ("button",),
+    "form": ("input", "form"),
+    "font": ("font", "family"),
+    "colors": ("color", "bg-"),
+    "background": ("bg-",)
+}
+
+
+class PatchError(ValueError):
+    """Raised when the model's patch cannot be applied to the artifact"""
+
+
+class ArtifactNotEditable(RuntimeError):
+    """Raised when the artifact has no completed code to edit"""
+
+
+def instruction_terms(instruction: str) -> Tuple[Set[str], List[str]]:
+    """Words (with their markup aliases) and quoted phrases to look for in the page"""
+
+    tokens = [token for token in _WORD.findall(instruction.lower()) if token not in _STOPWORDS]
+    terms = {token for token in tokens if len(token) > 2}
+    for token in tokens:
+        terms.update(_ALIASES.get(token, ()))
+    # Word pairs find numbered or named parts: "feature 7" matches id="feature-7"
+    for first, second in zip(tokens, tokens[1:]):
+        terms.update((f"{first} {second}", f"{first}-{second}"))
+    phrases = [phrase.lower() for phrase in _QUOTED.findall(instruction)]
+    return terms, phrases
+
+
+def _scores(texts: Sequence[str], terms: Iterable[str], phrases: Iterable[str] = ()) -> List[float]:
+    """Score texts by the terms they contain, weighting each term by how few of the texts contain it
+
+    Words found everywhere (``text`` in every Tailwind class list) count for
+    next to nothing; quoted phrases count three times as much as words.
+    """
+
+    lowered = [text.lower() for text in texts]
+    weights: Dict[str, float] = {}
+    for needles, factor in ((terms, 1.0), (phrases, 3.0)):
+        for needle in needles:
+            found = sum(1 for text in lowered if needle in text)
+            if found:
+                weights[needle] = weights.get(needle, 0.0) + factor * math.log((len(texts) + 1) / found)
+    return [sum(weight for needle, weight in weights.items() if needle in text) for text in lowered]
+
+
+def _element_children(html: str, start: int, end: int) -> List[Tuple[int, int]]:
+    """Spans of the elements directly inside html[start:end]; loose text between them is left out"""
+
+    spans: List[Tuple[int, int]] = []
+    stack: List[str] = []
+    block_start = start
+    position = start
+    while True:
+        match = _TAG.search(html, position, end)
+        if not match:
+            break
+        position = match.end()
+        closing, name = match.group(1), (match.group(2) or "").lower()
+        if not name:
+            continue
+
+        if closing:
+            if name in stack:
+                while stack.pop() != name:
+                    pass
+                if not stack:
+                    spans.append((block_start, match.end()))
+            continue
+
+        if name in ("script", "style"):
+            # Raw text: skip to the end tag without looking for tags inside it
+            close = html.lower().find(f"</{name}", position, end)
+            position = end if close == -1 else html.find(">", close, end) + 1 or end
+            if not stack:
+                spans.append((match.start(), position))
+            continue
+
+        if name in VOID_TAGS or match.group(0).endswith("/>"):
+            if not stack:
+                spans.append((match.start(), match.end()))
+            continue
+
+        if not stack:
+            block_start = match.start()
+        stack.append(name)
+
+    if stack:
+        spans.append((block_start, end))
+    return spans
+
+
+def html_blocks(html: str, max_chars: int) -> List[Tuple[int, int]]:
+    """Spans of the page's head and body elements, split into their children while larger than max_chars
+
+    A split element keeps its start tag as a block of its own, so edits to
+    its attributes still have the text they need to match.
+    """
+
+    lower = html.lower()
+    ranges = [(0, len(html))]
+    if re.search(r"<body[\s>]", lower):
+        ranges = []
+        for tag in ("head", "body"):
+            opening = re.search(rf"<{tag}[\s>]", lower)
+            if opening:
+                inner = lower.find(">", opening.start()) + 1
+                close = lower.find(f"</{tag}", inner)
+                ranges.append((inner, len(html) if close == -1 else close))
+
+    blocks: List[Tuple[int, int]] = []
+    pending = [span for start, end in ranges for span in _element_children(html, start, end)]
+    pending.reverse()
+    while pending:
+        start, end = pending.pop()
+        opening = _TAG.match(html, start)
+        if end - start <= max_chars or not opening or not opening.group(2):
+            blocks.append((start, end))
+            continue
+        children = _element_children(html, opening.end(), end)
+        if not children:
+            blocks.append((start, end))
+            continue
+        blocks.append((start, opening.end()))
+        pending.extend(reversed(children))
+    return blocks
+
+
+def css_blocks(css: str) -> List[Tuple[int, int]]:
+    """Spans of the top-level rules and at-rule blocks of a stylesheet"""
+
+    spans = []
+    depth = 0
+    block_start = 0
+    for index, char in enumerate(css):
+        if char == "{":
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if not depth:
+                spans.append((block_start, index + 1))
+                block_start = index + 1
+    if css[block_start:].strip():
+        spans.append((block_start, len(css)))
+    return spans
+
+
+def js_blocks(js: str) -> List[Tuple[int, int]]:
+    """Spans of a script split at blank lines, which usually fall between statements"""
+
+    spans = []
+    block_start = 0
+    for match in _BLANK_LINES.finditer(js):
+        spans.append((block_start, match.start()))
+        block_start = match.end()
+    spans.append((block_start, len(js)))
+    return spans
+
+
+def _select(spans: Sequence[Tuple[int, int]], scores: Sequence[float], budget: int) -> List[Tuple[int, int]]:
+    """Spans scoring at least half the best score that fit the budget, best first, returned in document order"""
+
+    chosen = []
+    used = 0
+    threshold = max(scores, default=0.0) / 2
+    for index in sorted(range(len(spans)), key=lambda index: -scores[index]):
+        if scores[index] <= 0 or scores[index] < threshold:
+            break
+        start, end = spans[index]
+        if used + end - start > budget:
+            continue
+        chosen.append(spans[index])
+        used += end - start
+    return sorted(chosen)
+
+
+def build_context(
+    files: Dict[str, str],
+    instruction: str,
+    budget: int,
+    full_file_chars: int
+) -> Tuple[str, int]:
+    """Excerpts of the files relevant to the instruction, and how many characters of code they hold
+
+    Files up to ``full_file_chars`` are sent whole. Larger HTML is split into
+    element blocks scored by the words of the instruction; CSS rules and
+    script blocks are scored by those words and the ids and classes of the
+    chosen HTML. HTML gets ``budget`` characters and CSS and JS a quarter of
+    it each.
+    """
+
+    terms, phrases = instruction_terms(instruction)
+    sections = []
+    sent = 0
+    names: Set[str] = set()
+
+    for name in FILES:
+        content = files[name]
+        file_budget = budget if name == "html" else budget // 4
+        if not content.strip():
+            sections.append(f"### {name}: (empty file)")
+            continue
+        if len(content) <= full_file_chars:
+            sections.append(f"### {name} (complete file):\n{content}")
+            sent += len(content)
+            names.update(token for match in _NAMES.findall(content) for token in match.split())
+            continue
+
+        if name == "html":
+            spans = html_blocks(content, file_budget // 2)
+            scores = _scores([content[start:end] for start, end in spans], terms, phrases)
+            chosen = _select(spans, scores, file_budget)
+            if not chosen:
+                # Nothing matched (e.g. "make it darker"): send the page from the top
+                chosen = _select(spans, [1] * len(spans), file_budget)
+            names.update(
+                token for start, end in chosen
+                for match in _NAMES.findall(content[start:end]) for token in match.split()
+            )
+        else:
+            spans = css_blocks(content) if name == "css" else js_blocks(content)
+            related = {token for token in names if len(token) > 2}
+            texts = [content[start:end] for start, end in spans]
+            scores = [
+                2 * direct + indirect
+                for direct, indirect in zip(_scores(texts, terms, phrases), _scores(texts, related))
+            ]
+            chosen = _select(spans, scores, file_budget)
+
+        if not chosen:
+            sections.append(
+                f"### {name}: {len(content)} characters, none relevant to the instruction "
+                f"(use an empty find to append to it)"
+            )
+            continue
+        excerpts = [content[start:end].strip("\n") for start, end in chosen]
+        sent += sum(len(excerpt) for excerpt in excerpts)
+        sections.append(
+            f"### {name} ({len(excerpts)} excerpts of a {len(content)} character file; the rest is not shown):\n"
+            + "\n[...]\n".join(excerpts)
+        )
+
+    return "\n\n".join(sections), sent
+
+
+def parse_patch(content: str) -> List[Dict[str, str]]:
+    """Validate the model's reply and return its list of edits"""
+
+    try:
+        data = json.loads(_FENCE.sub("", content.strip()))
+    except json.JSONDecodeError as e:
+        raise PatchError(f"The model's patch is not valid JSON: {e}")
+
+    edits = data.get("edits") if isinstance(data, dict) else None
+    if not isinstance(edits, list) or not edits:
+        raise PatchError("The model returned no edits")
+
+    for index, edit in enumerate(edits, 1):
+        if not isinstance(edit, dict) or edit.get("file") not in FILES:
+            raise PatchError(f"Edit {index} does not name a file (html, css or js)")
+        if not isinstance(edit.get("find", ""), str) or not isinstance(edit.get("replace"), str):
+            raise PatchError(f"Edit {index} needs find and replace strings")
+    return [{"file": edit["file"], "find": edit.get("find", ""), "replace": edit["replace"]} for edit in edits]
+
+
+def _locate(content: str, find: str, label: str) -> Tuple[int, str]:
+    """Position and exact text of ``find`` in ``content``, which must occur exactly once"""
+
+    count = content.count(find)
+    if count == 1:
+        return content.index(find), find
+    if count > 1:
+        raise PatchError(f"{label}: the text to replace occurs {count} times")
+
+    # Models often re-indent or re-wrap what they copy; match whitespace loosely
+    pattern = r"\s+".join(re.escape(part) for part in find.split())
+    matches = list(re.finditer(pattern, content)) if pattern else []
+    if len(matches) == 1:
+        return matches[0].start(), matches[0].group(0)
+    if matches:
+        raise PatchError(f"{label}: the text to replace occurs {len(matches)} times")
+    raise PatchError(f"{label}: the text to replace was not found")
+
+
+def apply_patch(
+    files: Dict[str, str],
+    edits: List[Dict[str, str]]
+) -> Tuple[Dict[str, str], List[Tuple[int, str, str]], List[str]]:
+    """Apply edits in order; returns the new files, the HTML replacements made and the files changed
+
+    Each HTML replacement is (position, old text, new text) in the HTML as it
+    was just before it, so the preview can be patched step by step.
+    """
+
+    files = dict(files)
+    html_edits: List[Tuple[int, str, str]] = []
+    changed: List[str] = []
+
+    for index, edit in enumerate(edits, 1):
+        name, find, replace = edit["file"], edit["find"], edit["replace"]
+        content = files[name]
+        label = f"Edit {index} ({name})"
+
+        if find.strip():
+            position, find = _locate(content, find, label)
+        elif name == "html":
+            raise PatchError(f"{label}: html edits must say which text to replace")
+        else:
+            # Append new rules or code to the end of the file
+            position = len(content)
+            if content and not content.endswith("\n"):
+                replace = "\n" + replace
+
+        if find == replace:
+            continue
+        files[name] = content[:position] + replace + content[position + len(find):]
+        if name == "html":
+            html_edits.append((position, find, replace))
+        if name not in changed:
+            changed.append(name)
+
+    if not changed:
+        raise PatchError("The patch does not change anything")
+    return files, html_edits, changed
+
+
+class ArtifactEditor:
+    """Refines a completed artifact from an instruction by asking the model for a patch instead of a new page"""
+
+    def __init__(self, code_generator: CodeGenerator, artifact_manager: ArtifactManager):
+        self.code_generator = code_generator
+        self.artifact_manager = artifact_manager
+
+        # Characters of HTML excerpts sent with an edit; CSS and JS get a quarter each
+        self.context_chars = int(os.getenv("EDIT_CONTEXT_CHARS", "8000"))
+        # Files up to this size are sent whole
+        self.full_file_chars = int(os.getenv("EDIT_FULL_FILE_CHARS", "2000"))
+
+        self._stats = {
+            "completed": 0,
+            "invalid_patch": 0,
+            "failed": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "context_chars": 0,
+            "source_chars": 0,
+            "seconds_total": 0.0
+        }
+
+    async def edit(self, artifact_id: str, instruction: str) -> Dict[str, Any]:
+        """Apply an instruction to an artifact and store the result as a new version of it"""
+
+        started = time.perf_counter()
+        with tracer.start_as_current_span(
+            "artifact.edit",
+            attributes={"artifact.id": artifact_id, "instruction.length": len(instruction)}
+        ) as span:
+            source = await self.artifact_manager.get_artifact(artifact_id, EDIT_SOURCE_COLUMNS)
+            if source.get("status") != "completed":
+                raise ArtifactNotEditable(f"Artifact is {source.get('status')}, only completed artifacts can be edited")
+
+            files = {name: source.get(f"{name}_content") or "" for name in FILES}
+            source_chars = sum(len(content) for content in files.values())
+
+            try:
+                with STAGE_SECONDS.labels("edit_context").time():
+                    context, context_chars = build_context(
+                        files, instruction, self.context_chars, self.full_file_chars
+                    )
+                span.set_attributes({"edit.context_chars": context_chars, "edit.source_chars": source_chars})
+
+                reply = await self.code_generator.generate_edit(instruction, context)
+                if reply["truncated"]:
+                    raise PatchError("The change is too large for an edit; regenerate the page instead")
+
+                edits = parse_patch(reply["content"])
+                edited, html_edits, changed = apply_patch(files, edits)
+
+                preview_columns, sanitized = await self.artifact_manager.preview_renderer.render_edit(
+                    source, files["html"], edited["html"], edited["css"], edited["js"], html_edits, changed
+                )
+                new_id = await self.artifact_manager.create_edited_artifact(
+                    source, edited["html"], edited["css"], edited["js"], preview_columns, instruction
+                )
+            except PatchError as e:
+                self._stats["invalid_patch"] += 1
+                EDITS.labels("invalid_patch").inc()
+                logger.warning(f"Edit of artifact {artifact_id} produced an unusable patch: {e}")
+                raise
+            except Exception:
+                self._stats["failed"] += 1
+                EDITS.labels("failed").inc()
+                raise
+
+            elapsed = time.perf_counter() - started
+            self._stats["completed"] += 1
+            self._stats["input_tokens"] += reply["input_tokens"]
+            self._stats["output_tokens"] += reply["output_tokens"]
+            self._stats["context_chars"] += context_chars
+            self._stats["source_chars"] += source_chars
+            self._stats["seconds_total"] += elapsed
+            EDITS.labels("completed").inc()
+            span.set_attributes({f"sanitize.{name}": mode for name, mode in sanitized.items()})
+
+            logger.info(
+                f"Edited artifact {artifact_id} into {new_id} with {len(edits)} edits to {', '.join(changed)} "
+                f"({context_chars} of {source_chars} chars sent, {reply['output_tokens']} output tokens, {elapsed:.2f}s)"
+            )
+            return {
+                "artifact_id": new_id,
+                "parent_artifact_id": artifact_id,
+                "preview_url": f"/preview/{new_id}",
+                "changed_files": changed,
+                "edits": len(edits),
+                "sanitized": sanitized,
+                "provider": reply["provider"],
+                "model": reply["model"],
+                "usage": {"input_tokens": reply["input_tokens"], "output_tokens": reply["output_tokens"]},
+                "context_chars": context_chars,
+                "source_chars": source_chars
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        """Edit outcomes, average tokens and latency, and the share of the code sent to the model"""
+
+        completed = self._stats["completed"]
+        return {
+            "completed": completed,
+            "invalid_patch": self._stats["invalid_patch"],
+            "failed": self._stats["failed"],
+            "avg_input_tokens": self._stats["input_tokens"] / completed if completed else 0.0,
+            "avg_output_tokens": self._stats["output_tokens"] / completed if completed else 0.0,
+            "avg_seconds": self._stats["seconds_total"] / completed if completed else 0.0,
+            "context_ratio": (
+                self._stats["context_chars"] / self._stats["source_chars"] if self._stats["source_chars"] else 0.0
+            ),
+            "context_chars": self.context_chars,
+            "full_file_chars": self.full_file_chars,
+            "sanitize": self.artifact_manager.preview_renderer.stats()["edit_sanitize"]
+        }
@@ -1,19 +1,47 @@
 import os
 import uuid
 import logging
-import html
-import base64
-from typing import Dict, Optional, Any
+import time
+import hashlib
+from typing import Dict, List, Optional, Any, Sequence, Tuple
 from datetime import datetime
 import httpx
-from bs4 import BeautifulSoup, Comment
+from urllib.parse import quote
+from opentelemetry import trace as otel_trace
+
+from services.cache import LRUCache
+from services.metrics import STAGE_SECONDS
+from services.tracing import tracer
+from services.shared_state import SharedState
+from services.preview_renderer import PREVIEW_FIELDS, PreviewRenderer, render_frame, render_wrapper
 
 logger = logging.getLogger(__name__)
 
+# Columns callers may project with get_artifact(fields=...)
+ARTIFACT_COLUMNS = (
+    "id", "project_id", "prompt_id", "user_id", "artifact_type", "status",
+    "file_url", "file_name", "file_size", "preview_url", "created_at",
+    "html_content", "css_content", "js_content", "preview_html",
+    "parent_artifact_id", "edit_instruction"
+) + PREVIEW_FIELDS
+
+# Small columns for status polling, without any generated content
+METADATA_COLUMNS = ("id", "project_id", "user_id", "artifact_type", "status", "preview_url", "created_at")
+
+# Everything needed to serve a preview, compact or inline
+PREVIEW_COLUMNS = ("status", "preview_html") + PREVIEW_FIELDS
+
+class PreviewNotReady(RuntimeError):
+    """Raised for a preview of an artifact that is not completed (pending, processing or failed)"""
+    
+    def __init__(self, status: Optional[str]):
+        super().__init__(f"Artifact is {status}")
+        self.status = status
+
 class ArtifactManager:
     """Manages generated code artifacts and previews"""
     
-    def __init__(self):
+    def __init__(self, state: Optional[SharedState] = None):
         self.supabase_url = os.getenv("SUPABASE_URL", "http://127.0.0.1:54321")
         self.supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
         
@@ -26,44 +54,178 @@ class ArtifactManager:
             "Content-Type": "application/json"
         }
         
+        # Connection pool settings for the shared Supabase REST client
+        self.http2 = os.getenv("SUPABASE_HTTP2", "true").lower() == "true"
+        self.pool_limits = httpx.Limits(
+            max_connections=int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("SUPABASE_POOL_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=float(os.getenv("SUPABASE_POOL_KEEPALIVE_EXPIRY", "30"))
+        )
+        self.timeout = httpx.Timeout(
+            float(os.getenv("SUPABASE_REQUEST_TIMEOUT", "15")),
+            connect=float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5")),
+            pool=float(os.getenv("SUPABASE_POOL_TIMEOUT", "5"))
+        )
+        
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pool_stats = {
+            "requests_total": 0,
+            "in_flight": 0,
+            "pool_timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0
+        }
+        
+        # Rendered preview documents keyed by artifact_id, bounded by total size in bytes.
+        # Each entry keeps the artifact's shared preview version it was rendered at, so a
+        # change made through another worker is seen on the next hit
+        self.preview_cache = LRUCache(
+            max_entries=int(os.getenv("PREVIEW_CACHE_MAX_ENTRIES", "1000")),
+            max_bytes=int(os.getenv("PREVIEW_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv("PREVIEW_CACHE_TTL", "3600")),
+            sizeof=lambda entry: entry[2]
+        )
+        
+        # project_id -> owning user_id; ownership never changes, misses are kept briefly
+        self.project_owner_cache = LRUCache(
+            max_entries=int(os.getenv("PROJECT_OWNER_CACHE_MAX_ENTRIES", "10000")),
+            ttl_seconds=float(os.getenv("PROJECT_OWNER_CACHE_TTL", "3600"))
+        )
+        self.project_owner_negative_ttl = float(os.getenv("PROJECT_OWNER_NEGATIVE_TTL", "30"))
+        self._owner_stats = {"passthrough": 0, "lookups": 0, "negative_hits": 0, "shared_hits": 0}
+        
+        # Second-level owner cache and preview versions shared with the other worker processes
+        self.state = state
+        
+        # Sanitization and preview rendering run on a worker pool, off the event loop
+        self.preview_renderer = PreviewRenderer()
+        
         logger.info("Artifact manager initialized")
     
+    async def start(self) -> None:
+        """Open the shared pooled HTTP client"""
+        
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.supabase_url,
+                headers=self.headers,
+                http2=self.http2,
+                limits=self.pool_limits,
+                timeout=self.timeout
+            )
+            logger.info(
+                f"Supabase client pool opened (http2={self.http2}, "
+                f"max_connections={self.pool_limits.max_connections})"
+            )
+    
+    async def close(self) -> None:
+        """Close the shared pooled HTTP client"""
+        
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Supabase client pool closed")
+        
+        self.preview_renderer.shutdown()
+    
+    async def _request(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        """Send a request to Supabase over the shared pooled client"""
+        
+        if self._client is None:
+            await self.start()
+        
+        started = time.perf_counter()
+        waited: Dict[str, float] = {}
+        
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            # Time until the request is written is the time spent acquiring a
+            # usable connection (idle reuse, or a fresh TCP/TLS handshake)
+            if event_name.endswith("send_request_headers.started") and "wait" not in waited:
+                waited["wait"] = time.perf_counter() - started
+        
+        # Storage paths carry object names; keep span names to the endpoint
+        endpoint = path if path.startswith("/rest/") else "/storage/v1/object"
+        
+        self._pool_stats["requests_total"] += 1
+        self._pool_stats["in_flight"] += 1
+        try:
+            with tracer.start_as_current_span(f"supabase {method} {endpoint}") as span:
+                span.set_attribute("http.method", method)
+                span.set_attribute("supabase.path", path)
+                response = await self._client.request(method, path, extensions={"trace": trace}, **kwargs)
+                span.set_attribute("http.status_code", response.status_code)
+                span.set_attribute("http.request_content_length", int(response.request.headers.get("content-length", 0)))
+                span.set_attribute("http.response_content_length", len(response.content))
+                span.set_attribute("pool.wait_seconds", waited.get("wait", 0.0))
+                return response
+        except httpx.PoolTimeout:
+            self._pool_stats["pool_timeouts"] += 1
+            raise
+        finally:
+            STAGE_SECONDS.labels("db_read" if method == "GET" else "db_write").observe(time.perf_counter() - started)
+            self._pool_stats["in_flight"] -= 1
+            wait = waited.get("wait", 0.0)
+            self._pool_stats["wait_seconds_total"] += wait
+            self._pool_stats["wait_seconds_max"] = max(self._pool_stats["wait_seconds_max"], wait)
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Return connection pool usage metrics"""
+        
+        # httpx does not expose pool state publicly; read it from the transport
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        
+        requests_total = self._pool_stats["requests_total"]
+        return {
+            "open": self._client is not None,
+            "http2": self.http2,
+            "max_connections": self.pool_limits.max_connections,
+            "max_keepalive_connections": self.pool_limits.max_keepalive_connections,
+            "idle_connections": idle,
+            "active_connections": len(connections) - idle,
+            "requests_total": requests_total,
+            "in_flight": self._pool_stats["in_flight"],
+            "pool_timeouts": self._pool_stats["pool_timeouts"],
+            "wait_seconds_avg": self._pool_stats["wait_seconds_total"] / requests_total if requests_total else 0.0,
+            "wait_seconds_max": self._pool_stats["wait_seconds_max"]
+        }
+    
     async def create_artifact(
         self, 
         project_id: str, 
         html_content: str, 
         css_content: str, 
-        js_content: str
+        js_content: str,
+        user_id: Optional[str] = None
     ) -> str:
         """Create a new artifact in the database"""
         
-        artifact_id = str(uuid.uuid4())
+        # Get project details to retrieve user_id, unless the caller already knows it
+        user_id = await self.resolve_user_id(project_id, user_id)
         
-        # Get project details to retrieve user_id
-        try:
-            project_data = await self._get_project_details(project_id)
-            logger.info(f"Retrieved project_data: {project_data}")
-            
-            if not project_data:
-                logger.error(f"Project {project_id} not found")
-                raise RuntimeError(f"Project {project_id} not found")
-            
-            user_id = project_data.get("user_id")
-            logger.info(f"Extracted user_id: {user_id}")
-            
-            if not user_id:
-                logger.error(f"User ID not found for project {project_id}")
-                raise RuntimeError(f"User ID not found for project {project_id}")
-                
-        except Exception as e:
-            logger.error(f"Exception during project lookup: {e}")
-            raise
+        artifact_data = await self.prepare_artifact(project_id, user_id, html_content, css_content, js_content)
+        await self.insert_artifacts([artifact_data])
+        
+        logger.info(f"Created artifact {artifact_data['id']} for project {project_id}")
+        return artifact_data["id"]
+    
+    async def prepare_artifact(
+        self,
+        project_id: str,
+        user_id: str,
+        html_content: str,
+        css_content: str,
+        js_content: str
+    ) -> Dict[str, Any]:
+        """Build a completed artifact row, sanitizing its preview, without storing it"""
+        
+        artifact_id = str(uuid.uuid4())
         
-        # Generate preview HTML
-        preview_html = self._generate_preview_html(html_content, css_content, js_content)
+        # Sanitize for the preview; compact storage keeps only the sanitized parts
+        preview_columns = await self.preview_renderer.render(html_content, css_content, js_content)
         
-        # Store artifact in database
-        artifact_data = {
+        return {
             "id": artifact_id,
             "project_id": project_id,
             "user_id": user_id,
@@ -71,320 +233,313 @@ class ArtifactManager:
             "html_content": html_content,
             "css_content": css_content,
             "js_content": js_content,
-            "preview_html": preview_html,
+            **preview_columns,
             "preview_url": f"/preview/{artifact_id}",
             "status": "completed"
         }
+    
+    async def insert_artifacts(self, rows: List[Dict[str, Any]]) -> None:
+        """Store prepared artifact rows with a single bulk insert"""
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.supabase_url}/rest/v1/artifacts",
-                headers=self.headers,
-                json=artifact_data
-            )
-            
-            if response.status_code not in [200, 201]:
-                logger.error(f"Failed to create artifact: {response.text}")
-                raise RuntimeError(f"Failed to create artifact: {response.status_code}")
+        response = await self._request("POST", "/rest/v1/artifacts", json=rows)
         
-        logger.info(f"Created artifact {artifact_id} for project {project_id}")
-        return artifact_id
-    
-    async def get_artifact(self, artifact_id: str) -> Dict[str, Any]:
-        """Retrieve artifact by ID"""
+        if response.status_code not in [200, 201]:
+            logger.error(f"Failed to create artifact: {response.text}")
+            raise RuntimeError(f"Failed to create artifact: {response.status_code}")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/artifacts",
-                headers=self.headers,
-                params={"id": f"eq.{artifact_id}"}
-            )
-            
-            if response.status_code != 200:
-                raise RuntimeError(f"Failed to get artifact: {response.status_code}")
-            
-            data = response.json()
-            if not data:
-                raise RuntimeError("Artifact not found")
-            
-            return data[0]
+        for row in rows:
+            self._cache_preview(row["id"], row)
     
-    async def get_preview_html(self, artifact_id: str) -> str:
-        """Get preview HTML for artifact"""
+    async def create_edited_artifact(
+        self,
+        parent: Dict[str, Any],
+        html_content: str,
+        css_content: str,
+        js_content: str,
+        preview_columns: Dict[str, Optional[str]],
+        instruction: str
+    ) -> str:
+        """Store an edited copy of an artifact as a new completed version linked to it"""
         
-        artifact = await self.get_artifact(artifact_id)
-        return artifact.get("preview_html", "")
-    
-    def _generate_preview_html(self, html: str, css: str, js: str) -> str:
-        """Generate a secure sandboxed HTML preview"""
-        
-        # Sanitize all inputs first
-        sanitized_html = self._sanitize_html(html)
-        sanitized_css = self._sanitize_css(css)
-        sanitized_js = self._sanitize_javascript(js)
-        
-        # Extract body content from HTML if it's a complete document
-        body_content = self._extract_body_content(sanitized_html)
-        
-        # Create the preview content in a sandboxed iframe
-        inner_html = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>MockCodes Preview</title>
-    <meta http-equiv="Content-Security-Policy" content="default-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com; script-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com; style-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com;">
-    <script src="https://cdn.tailwindcss.com"></script>
-    <style>
-        /* Custom CSS */
-        {sanitized_css}
-        
-        /* Preview-specific styles */
-        body {{
-            margin: 0;
-            padding: 0;
-        }}
-        
-        /* Smooth animations */
-        * {{
-            transition: all 0.2s ease-in-out;
-        }}
-    </style>
-</head>
-<body>
-    {body_content}
-    
-    <script>
-        // Custom JavaScript (sanitized)
-        {sanitized_js}
-        
-        // Preview enhancements
-        document.addEventListener('DOMContentLoaded', function() {{
-            console.log('MockCodes preview loaded');
-        }});
-    </script>
-</body>
-</html>"""
-        
-        # Encode the content as base64 for safe data URL
-        encoded_content = base64.b64encode(inner_html.encode('utf-8')).decode('utf-8')
-        
-        # Create wrapper HTML with sandboxed iframe
-        wrapper_template = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>MockCodes Preview - Secure</title>
-    <meta http-equiv="Content-Security-Policy" content="default-src 'self'; frame-src data:; style-src 'self' 'unsafe-inline';">
-    <style>
-        body {{
-            margin: 0;
-            padding: 0;
-            font-family: system-ui, -apple-system, sans-serif;
-        }}
-        .preview-container {{
-            width: 100%;
-            height: 100vh;
-            border: none;
-        }}
-        .security-notice {{
-            background: #fef3c7;
-            color: #92400e;
-            padding: 8px 16px;
-            font-size: 12px;
-            text-align: center;
-            border-bottom: 1px solid #f59e0b;
-        }}
-    </style>
-</head>
-<body>
-    <div class="security-notice">
-        🔒 This preview is running in a secure sandboxed environment
-    </div>
-    <iframe 
-        class="preview-container"
-        src="data:text/html;base64,{encoded_content}"
-        sandbox="allow-scripts allow-same-origin allow-forms"
-        title="Secure Preview">
-    </iframe>
-</body>
-</html>"""
-        
-        return wrapper_template
-    
-    def _sanitize_html(self, html_content: str) -> str:
-        """Sanitize HTML content to prevent XSS"""
-        if not html_content:
-            return ""
-        
-        # Parse HTML with BeautifulSoup
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Remove dangerous tags
-        dangerous_tags = ['script', 'object', 'embed', 'applet', 'meta', 'link']
-        for tag in soup(dangerous_tags):
-            tag.decompose()
-        
-        # Remove comments that might contain malicious code
-        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-            comment.extract()
-        
-        # Remove dangerous attributes
-        dangerous_attrs = ['onload', 'onclick', 'onmouseover', 'onerror', 'onabort', 
-                          'onchange', 'onfocus', 'onblur', 'onsubmit', 'onreset']
-        
-        for tag in soup.find_all():
-            for attr in dangerous_attrs:
-                if tag.has_attr(attr):
-                    del tag[attr]
-            
-            # Sanitize href and src attributes
-            if tag.has_attr('href'):
-                href = tag['href']
-                if href.startswith('javascript:') or href.startswith('data:'):
-                    del tag['href']
-            
-            if tag.has_attr('src'):
-                src = tag['src']
-                if src.startswith('javascript:'):
-                    del tag['src']
-        
-        return str(soup)
+        artifact_id = str(uuid.uuid4())
+        await self.insert_artifacts([{
+            "id": artifact_id,
+            "project_id": parent["project_id"],
+            "user_id": parent["user_id"],
+            "artifact_type": "preview",
+            "html_content": html_content,
+            "css_content": css_content,
+            "js_content": js_content,
+            **preview_columns,
+            "preview_url": f"/preview/{artifact_id}",
+            "status": "completed",
+            "parent_artifact_id": parent["id"],
+            "edit_instruction": instruction
+        }])
+        
+        logger.info(f"Created artifact {artifact_id} as an edit of {parent['id']}")
+        return artifact_id
     
-    def _sanitize_css(self, css_content: str) -> str:
-        """Sanitize CSS content to prevent XSS"""
-        if not css_content:
-            return ""
-        
-        # Escape the CSS content to prevent injection
-        sanitized = html.escape(css_content, quote=False)
-        
-        # Remove dangerous CSS properties and values
-        dangerous_patterns = [
-            'javascript:',
-            'expression(',
-            'behavior:',
-            'binding:',
-            '-moz-binding:',
-            'data:',
-            'vbscript:',
-            '@import'
-        ]
-        
-        for pattern in dangerous_patterns:
-            sanitized = sanitized.replace(pattern, '')
-        
-        return sanitized
+    async def create_pending_artifact(self, project_id: str, user_id: Optional[str] = None) -> str:
+        """Create an empty artifact row in pending state for a queued generation"""
+        
+        artifact_id = str(uuid.uuid4())
+        user_id = await self.resolve_user_id(project_id, user_id)
+        
+        artifact_data = {
+            "id": artifact_id,
+            "project_id": project_id,
+            "user_id": user_id,
+            "artifact_type": "preview",
+            "preview_url": f"/preview/{artifact_id}",
+            "status": "pending"
+        }
+        
+        response = await self._request("POST", "/rest/v1/artifacts", json=artifact_data)
+        
+        if response.status_code not in [200, 201]:
+            logger.error(f"Failed to create pending artifact: {response.text}")
+            raise RuntimeError(f"Failed to create artifact: {response.status_code}")
+        
+        logger.info(f"Created pending artifact {artifact_id} for project {project_id}")
+        return artifact_id
     
-    def _sanitize_javascript(self, js_content: str) -> str:
-        """Sanitize JavaScript content to prevent XSS"""
-        if not js_content:
-            return ""
-        
-        # Basic sanitization - escape dangerous characters
-        sanitized = html.escape(js_content, quote=False)
-        
-        # Remove dangerous JavaScript patterns
-        dangerous_patterns = [
-            'eval(',
-            'Function(',
-            'setTimeout(',
-            'setInterval(',
-            'document.write(',
-            'document.writeln(',
-            'innerHTML',
-            'outerHTML',
-            'document.cookie',
-            'localStorage',
-            'sessionStorage',
-            'window.location',
-            'location.href',
-            'location.replace',
-            'location.assign'
-        ]
-        
-        # Note: This is basic sanitization. For production, consider using a proper JS sanitizer
-        # or running JS in a more restricted environment
-        for pattern in dangerous_patterns:
-            sanitized = sanitized.replace(pattern, f'/* BLOCKED: {pattern} */')
-        
-        return sanitized
+    async def complete_artifact(
+        self,
+        artifact_id: str,
+        html_content: str,
+        css_content: str,
+        js_content: str
+    ) -> None:
+        """Store generated code on a pending artifact and mark it completed"""
+        
+        preview_columns = await self.preview_renderer.render(html_content, css_content, js_content)
+        
+        await self.update_artifact_status(artifact_id, "completed", {
+            "html_content": html_content,
+            "css_content": css_content,
+            "js_content": js_content,
+            **preview_columns
+        })
+        
+        self._cache_preview(artifact_id, preview_columns, await self._preview_version(artifact_id))
     
-    def _extract_body_content(self, html: str) -> str:
-        """Extract content from body tag or return full HTML if no body tag"""
+    async def get_artifact(self, artifact_id: str, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Retrieve artifact by ID, projected to the given columns (all of them by default)"""
         
-        import re
+        response = await self._request(
+            "GET",
+            "/rest/v1/artifacts",
+            params={"id": f"eq.{artifact_id}", "select": ",".join(fields) if fields else "*"}
+        )
         
-        # Try to extract body content
-        body_match = re.search(r'<body[^>]*>(.*?)</body>', html, re.DOTALL | re.IGNORECASE)
+        if response.status_code != 200:
+            raise RuntimeError(f"Failed to get artifact: {response.status_code}")
         
-        if body_match:
-            return body_match.group(1).strip()
+        data = response.json()
+        if not data:
+            raise RuntimeError("Artifact not found")
         
-        # If no body tag found, check if it's a complete HTML document
-        if html.strip().startswith('<!DOCTYPE') or html.strip().startswith('<html'):
-            # Return as-is if it's a complete document
-            return html
+        return data[0]
+    
+    async def get_artifact_metadata(self, artifact_id: str) -> Dict[str, Any]:
+        """Retrieve artifact status and identifiers without its content columns"""
         
-        # Otherwise, assume it's just content
-        return html
+        return await self.get_artifact(artifact_id, METADATA_COLUMNS)
     
-    async def update_artifact_status(self, artifact_id: str, status: str) -> None:
-        """Update artifact status"""
+    async def get_preview_html(self, artifact_id: str) -> str:
+        """Get preview HTML for artifact"""
         
-        async with httpx.AsyncClient() as client:
-            response = await client.patch(
-                f"{self.supabase_url}/rest/v1/artifacts",
-                headers=self.headers,
-                params={"id": f"eq.{artifact_id}"},
-                json={"status": status}
+        preview_html, _ = await self.get_preview(artifact_id)
+        return preview_html
+    
+    async def get_preview(self, artifact_id: str) -> Tuple[str, str]:
+        """Get preview HTML and its ETag, served from the preview cache when possible"""
+        
+        document, etag, _, compact = await self._load_preview(artifact_id)
+        if not compact:
+            return document, etag
+        
+        # Compact previews load their frame separately, so the wrapper only depends on the id
+        wrapper = render_wrapper(artifact_id)
+        return wrapper, f'"{hashlib.sha256(wrapper.encode("utf-8")).hexdigest()[:32]}"'
+    
+    async def get_preview_frame(self, artifact_id: str) -> Tuple[str, str]:
+        """Get the framed preview document of a compact artifact and its ETag"""
+        
+        document, etag, _, compact = await self._load_preview(artifact_id)
+        if not compact:
+            # Inline previews carry their frame as a data URL
+            raise RuntimeError("Artifact not found")
+        return document, etag
+    
+    async def _load_preview(self, artifact_id: str) -> Tuple[str, str, int, bool]:
+        # Read before the row so a change landing during the fetch still invalidates the entry
+        version = await self._preview_version(artifact_id)
+        
+        cached = self.preview_cache.get(artifact_id)
+        if cached is not None:
+            if cached[4] == version:
+                return cached[:4]
+            self.preview_cache.invalidate(artifact_id)
+        
+        artifact = await self.get_artifact(artifact_id, PREVIEW_COLUMNS)
+        # Only completed rows have a preview; anything else would be cached as an empty page
+        if artifact.get("status") != "completed":
+            raise PreviewNotReady(artifact.get("status"))
+        return self._cache_preview(artifact_id, artifact, version)
+    
+    def _cache_preview(
+        self,
+        artifact_id: str,
+        columns: Dict[str, Any],
+        version: Optional[str] = None
+    ) -> Tuple[str, str, int, bool]:
+        """Render a preview document from its stored columns, cache it and return the cache entry"""
+        
+        compact = columns.get("preview_body") is not None
+        document = render_frame(columns) if compact else columns.get("preview_html") or ""
+        
+        encoded = document.encode("utf-8")
+        etag = f'"{hashlib.sha256(encoded).hexdigest()[:32]}"'
+        entry = (document, etag, len(encoded), compact)
+        self.preview_cache.set(artifact_id, entry + (version,))
+        return entry
+    
+    async def _preview_version(self, artifact_id: str) -> Optional[str]:
+        if self.state is None:
+            return None
+        return await self.state.get(f"preview_version:{artifact_id}")
+    
+    async def _invalidate_preview(self, artifact_id: str) -> None:
+        """Drop the cached preview here and, through a new shared version, on every other worker"""
+        
+        self.preview_cache.invalidate(artifact_id)
+        if self.state is not None:
+            # A fresh token rather than a counter, so an expired key can never come back to a cached value
+            await self.state.set(
+                f"preview_version:{artifact_id}",
+                uuid.uuid4().hex,
+                ttl_seconds=self.preview_cache.ttl_seconds
             )
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to update artifact status: {response.text}")
-                raise RuntimeError(f"Failed to update artifact status: {response.status_code}")
+    
+    async def update_artifact_status(
+        self,
+        artifact_id: str,
+        status: str,
+        fields: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """Update artifact status, optionally writing other columns in the same request"""
+        
+        response = await self._request(
+            "PATCH",
+            "/rest/v1/artifacts",
+            params={"id": f"eq.{artifact_id}"},
+            json={**(fields or {}), "status": status}
+        )
+        
+        # PostgREST answers 204 unless asked to return the row
+        if response.status_code not in [200, 204]:
+            logger.error(f"Failed to update artifact status: {response.text}")
+            raise RuntimeError(f"Failed to update artifact status: {response.status_code}")
+        
+        await self._invalidate_preview(artifact_id)
         
         logger.info(f"Updated artifact {artifact_id} status to {status}")
     
     async def delete_artifact(self, artifact_id: str) -> None:
         """Delete artifact"""
         
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{self.supabase_url}/rest/v1/artifacts",
-                headers=self.headers,
-                params={"id": f"eq.{artifact_id}"}
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to delete artifact: {response.text}")
-                raise RuntimeError(f"Failed to delete artifact: {response.status_code}")
+        response = await self._request(
+            "DELETE",
+            "/rest/v1/artifacts",
+            params={"id": f"eq.{artifact_id}"}
+        )
+        
+        # PostgREST answers 204 unless asked to return the row
+        if response.status_code not in [200, 204]:
+            logger.error(f"Failed to delete artifact: {response.text}")
+            raise RuntimeError(f"Failed to delete artifact: {response.status_code}")
+        
+        await self._invalidate_preview(artifact_id)
         
         logger.info(f"Deleted artifact {artifact_id}")
     
+    async def resolve_user_id(self, project_id: str, user_id: Optional[str] = None) -> str:
+        """Resolve the owning user_id for a project, from the caller, the cache or the database"""
+        
+        span = otel_trace.get_current_span()
+        if user_id:
+            self._owner_stats["passthrough"] += 1
+            span.set_attribute("project_owner.source", "caller")
+            return user_id
+        
+        cached = self.project_owner_cache.get(project_id)
+        if cached is not None:
+            if not cached:
+                self._owner_stats["negative_hits"] += 1
+                raise RuntimeError(f"Project {project_id} not found")
+            span.set_attribute("project_owner.source", "cache")
+            return cached
+        
+        if self.state:
+            shared = await self.state.get(f"project_owner:{project_id}")
+            if shared:
+                self._owner_stats["shared_hits"] += 1
+                self.project_owner_cache.set(project_id, shared)
+                span.set_attribute("project_owner.source", "shared")
+                return shared
+        
+        self._owner_stats["lookups"] += 1
+        span.set_attribute("project_owner.source", "database")
+        with tracer.start_as_current_span("get_project_details", attributes={"project_id": project_id}):
+            project_data = await self._get_project_details(project_id)
+        
+        if not project_data or not project_data.get("user_id"):
+            logger.error(f"Project {project_id} not found or has no owner")
+            # An empty string marks a known miss until the short negative TTL expires
+            self.project_owner_cache.set(project_id, "", ttl_seconds=self.project_owner_negative_ttl)
+            raise RuntimeError(f"Project {project_id} not found")
+        
+        user_id = project_data["user_id"]
+        self.project_owner_cache.set(project_id, user_id)
+        if self.state:
+            await self.state.set(f"project_owner:{project_id}", user_id, ttl_seconds=self.project_owner_cache.ttl_seconds)
+        return user_id
+    
+    def get_project_owner_stats(self) -> Dict[str, Any]:
+        """Counters for the project -> user_id cache and caller-supplied owners"""
+        
+        return {**self.project_owner_cache.stats(), **self._owner_stats}
+    
+    async def download_object(self, bucket: str, path: str, etag: Optional[str] = None) -> httpx.Response:
+        """Fetch an object from Supabase Storage, revalidating against ``etag`` when given"""
+        
+        headers = {"If-None-Match": etag} if etag else {}
+        return await self._request(
+            "GET",
+            f"/storage/v1/object/{bucket}/{quote(path)}",
+            headers=headers
+        )
+    
     async def _get_project_details(self, project_id: str) -> Optional[Dict[str, Any]]:
         """Get project details from database"""
         
-        logger.info(f"Looking up project details for {project_id}")
+        response = await self._request(
+            "GET",
+            "/rest/v1/projects",
+            params={"id": f"eq.{project_id}", "select": "id,user_id,name"}
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.supabase_url}/rest/v1/projects",
-                headers=self.headers,
-                params={"id": f"eq.{project_id}", "select": "id,user_id,name"}
-            )
-            
-            logger.info(f"Project lookup response: {response.status_code} - {response.text}")
-            
-            if response.status_code != 200:
-                logger.error(f"Failed to get project details: {response.text}")
-                return None
-            
-            data = response.json()
-            if not data:
-                logger.error(f"Project {project_id} not found")
-                return None
-            
-            logger.info(f"Found project data: {data[0]}")
-            return data[0]
\ No newline at end of file
+        logger.debug(f"Project lookup for {project_id}: {response.status_code}")
+        
+        if response.status_code != 200:
+            # Not a definite miss, so it must not be cached as one
+            logger.error(f"Failed to get project details: {response.status_code}")
+            raise RuntimeError(f"Failed to get project details: {response.status_code}")
+        
+        data = response.json()
+        if not data:
+            return None
+        
+        return data[0]
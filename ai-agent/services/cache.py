@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """In-process LRU cache bounded by entry count and total byte size, with optional TTL"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sizeof = sizeof or (lambda value: 1)
+
+        # key -> (value, size, expires_at)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, Optional[float]]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key, count=False) is not None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a cached value and mark it most recently used"""
+
+        entry = self._lookup(key, count=True)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        """Store a value, evicting least recently used entries to stay within bounds"""
+
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Never cache a single value larger than the whole budget
+            self.invalidate(key)
+            return
+
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        self.invalidate(key)
+        self._entries[key] = (value, size, expires_at)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self._bytes > self.max_bytes
+        ):
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Drop a key; returns True if it was present"""
+
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[1]
+        return True
+
+    def clear(self) -> None:
+        """Drop every entry"""
+
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss/eviction counters and current size"""
+
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def _lookup(self, key: Hashable, count: bool) -> Optional[Tuple[Any, int, Optional[float]]]:
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+            self.invalidate(key)
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry
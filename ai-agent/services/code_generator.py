@@ -1,106 +1,753 @@
 import os
+import sys
+import time
+import base64
+import random
+import hashlib
+import asyncio
 import logging
-from typing import Dict, Optional, Any
-import openai
-import anthropic
-from openai import AsyncOpenAI
-from anthropic import Anthropic
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Any, Tuple
+from opentelemetry import trace
+
+from services.json_stream import IncrementalJSONParser, join_continuation, salvage_fields
+from services.generation_cache import GenerationCache, decode_image_bytes, generation_fingerprint
+from services.single_flight import SingleFlight
+from services.image_processor import ImagePreprocessor, sniff_image_mime_type
+from services.image_store import ImageStore
+from services.prompt_templates import EDIT_PROMPTS, PROMPTS
+from services.tracing import tracer
+from services.metrics import (
+    CONTINUATIONS,
+    GENERATIONS,
+    PARSE_OUTCOMES,
+    PROVIDER_REQUESTS,
+    PROVIDER_SECONDS,
+    STAGE_SECONDS,
+    record_tokens
+)
 
 logger = logging.getLogger(__name__)
 
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Retry-After hint from a provider error response, in seconds"""
+    
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """Whether retrying the same provider/model might succeed"""
+    
+    # Provider SDKs are imported lazily; an SDK that is not loaded cannot have raised
+    connection_errors = tuple(
+        sys.modules[sdk].APIConnectionError for sdk in ("openai", "anthropic") if sdk in sys.modules
+    )
+    if isinstance(error, (asyncio.TimeoutError, *connection_errors)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code in (408, 409, 429) or (status_code is not None and status_code >= 500)
+
+
+def _is_provider_failure(error: BaseException) -> bool:
+    """Whether an error counts against the model's circuit breaker, rather than against the request"""
+    
+    status_code = getattr(error, "status_code", None)
+    if status_code is None or _is_retryable(error):
+        return True
+    # On a completion call a 404 means the model does not exist or is not available to this key
+    return status_code == 404
+
+
+class CircuitBreaker:
+    """Failure tracking for one provider+model
+    
+    Opens after ``failure_threshold`` consecutive failures and skips the model
+    for ``cooldown_seconds``; then lets a single trial request through
+    (half-open) and closes again on success. Also keeps EWMA latency and
+    error rate for routing.
+    """
+    
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        failure_threshold: int,
+        cooldown_seconds: float,
+        alpha: float,
+        error_half_life: float
+    ):
+        self.provider = provider
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.alpha = alpha
+        self.error_half_life = error_half_life
+        
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.last_outcome_at: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.rejections = 0
+        self._trial_in_flight = False
+    
+    def allow(self) -> bool:
+        """Whether a request may be sent to this model now"""
+        
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                return False
+            self.state = "half_open"
+            self._trial_in_flight = False
+        
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        
+        return True
+    
+    def record_success(self, latency: Optional[float]) -> None:
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self._trial_in_flight = False
+        self.ewma_error_rate = (1 - self.alpha) * self.error_rate()
+        self.last_outcome_at = time.monotonic()
+        if latency is not None:
+            self.ewma_latency = latency if self.ewma_latency is None else (
+                self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+            )
+    
+    def release(self) -> None:
+        """Give back a half-open trial slot without recording an outcome"""
+        
+        self._trial_in_flight = False
+    
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        self.ewma_error_rate = self.alpha + (1 - self.alpha) * self.error_rate()
+        self.last_outcome_at = time.monotonic()
+        
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit opened for {self.provider}:{self.model} for {self.cooldown_seconds}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+    
+    def error_rate(self) -> float:
+        """EWMA error rate, decayed by time since the last outcome so idle models get retried"""
+        
+        if self.last_outcome_at is None:
+            return self.ewma_error_rate
+        idle = time.monotonic() - self.last_outcome_at
+        return self.ewma_error_rate * 0.5 ** (idle / self.error_half_life)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "model": self.model,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "ewma_latency_seconds": self.ewma_latency,
+            "ewma_error_rate": self.error_rate(),
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejections": self.rejections
+        }
+
+
+class RetryBudget:
+    """Caps retries to a fraction of recent requests so retries cannot snowball"""
+    
+    def __init__(self, ratio: float, min_reserve: float, max_reserve: float):
+        self.ratio = ratio
+        self.max_reserve = max_reserve
+        self.balance = min_reserve
+        self.exhausted = 0
+    
+    def deposit(self) -> None:
+        self.balance = min(self.max_reserve, self.balance + self.ratio)
+    
+    def withdraw(self) -> bool:
+        if self.balance < 1:
+            self.exhausted += 1
+            return False
+        self.balance -= 1
+        return True
+
+
+class ProviderRouter:
+    """Orders provider+model candidates by health, EWMA latency and configured priority"""
+    
+    def __init__(self, candidates: List[Tuple[str, str]]):
+        self.fallback_penalty = float(os.getenv("ROUTER_FALLBACK_PENALTY", "4.0"))
+        self.default_latency = float(os.getenv("ROUTER_DEFAULT_LATENCY", "30"))
+        self.max_retries = int(os.getenv("ROUTER_MAX_RETRIES", "2"))
+        self.backoff_base = float(os.getenv("ROUTER_BACKOFF_BASE", "0.5"))
+        self.backoff_max = float(os.getenv("ROUTER_BACKOFF_MAX", "8"))
+        
+        failure_threshold = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+        cooldown_seconds = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "60"))
+        alpha = float(os.getenv("ROUTER_EWMA_ALPHA", "0.3"))
+        error_half_life = float(os.getenv("ROUTER_ERROR_HALF_LIFE", "60"))
+        
+        self.candidates = candidates
+        self.breakers = {
+            candidate: CircuitBreaker(
+                candidate[0], candidate[1], failure_threshold, cooldown_seconds, alpha, error_half_life
+            )
+            for candidate in candidates
+        }
+        self.retry_budget = RetryBudget(
+            ratio=float(os.getenv("RETRY_BUDGET_RATIO", "0.2")),
+            min_reserve=float(os.getenv("RETRY_BUDGET_MIN", "3")),
+            max_reserve=float(os.getenv("RETRY_BUDGET_MAX", "20"))
+        )
+    
+    def order(self) -> List[Tuple[str, str]]:
+        """Candidates whose breakers are not open, best score first
+        
+        Score is EWMA latency inflated by the error rate, multiplied by
+        ``fallback_penalty`` per rank, so a fallback only jumps ahead when
+        the primary is much slower or failing.
+        """
+        
+        # Unmeasured candidates are assumed as fast as the best measured one, so they get tried
+        measured = [b.ewma_latency for b in self.breakers.values() if b.ewma_latency is not None]
+        unknown_latency = min(measured) if measured else self.default_latency
+        
+        def score(item: Tuple[int, Tuple[str, str]]) -> float:
+            rank, candidate = item
+            breaker = self.breakers[candidate]
+            latency = breaker.ewma_latency if breaker.ewma_latency is not None else unknown_latency
+            return latency * (1 + 4 * breaker.error_rate()) * (self.fallback_penalty ** rank)
+        
+        ranked = sorted(enumerate(self.candidates), key=score)
+        return [
+            candidate for _, candidate in ranked
+            if self.breakers[candidate].state != "open"
+            or time.monotonic() - self.breakers[candidate].opened_at >= self.breakers[candidate].cooldown_seconds
+        ]
+    
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        """Exponential backoff with full jitter, never shorter than Retry-After"""
+        
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max * 4))
+        return delay
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "retry_budget_balance": self.retry_budget.balance,
+            "retry_budget_exhausted": self.retry_budget.exhausted,
+            "breakers": [breaker.snapshot() for breaker in self.breakers.values()]
+        }
+
+
 class CodeGenerator:
     """AI-powered code generation service"""
     
     def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
+        # Clients (and their SDKs, the slowest imports in the agent) are
+        # created on first use or by warm_up(), not at startup
+        self.openai_api_key = os.getenv("OPENAI_API_KEY")
+        self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
+        self._openai_client: Optional[Any] = None
+        self._anthropic_client: Optional[Any] = None
+        
+        if not self.openai_api_key and not self.anthropic_api_key:
+            raise ValueError("At least one AI provider (OpenAI or Anthropic) must be configured")
+        
+        # Candidates in priority order; retries and model fallback are handled by the router
+        candidates: List[Tuple[str, str]] = []
+        if self.openai_api_key:
+            primary_model = os.getenv("OPENAI_GPT_MODEL", "gpt-4o-preview")
+            candidates.append(("openai", primary_model))
+            if primary_model != "gpt-4o-mini":
+                candidates.append(("openai", "gpt-4o-mini"))
+        if self.anthropic_api_key:
+            candidates.append(("anthropic", os.getenv("ANTHROPIC_MODEL", "claude-3-sonnet-20240229")))
+        self.router = ProviderRouter(candidates)
+        
+        # Hedged mode: if the primary has not answered within this budget, race another provider against it
+        self.hedge_after_seconds = float(os.getenv("HEDGE_AFTER_SECONDS", "0"))
+        self._hedge_stats = {"hedged": 0, "primary_wins": 0, "secondary_wins": 0, "both_failed": 0}
+        
+        # Mark the static system prompt (and screenshot) as cacheable on Anthropic
+        self.anthropic_prompt_cache = os.getenv("ANTHROPIC_PROMPT_CACHE", "true").lower() == "true"
+        self._token_stats: Dict[str, Dict[str, int]] = {}
+        
+        # Follow-up requests that resume output cut off by max_tokens, instead of regenerating it
+        self.max_continuations = int(os.getenv("GENERATION_MAX_CONTINUATIONS", "2"))
+        
+        # Output cap for artifact edits, which return a patch rather than whole files
+        self.edit_max_tokens = int(os.getenv("EDIT_MAX_TOKENS", "2000"))
+        
+        self.generation_cache = GenerationCache.from_env()
+        self.single_flight = SingleFlight()
+        self.image_preprocessor = ImagePreprocessor()
+        
+        # "sha256" keys the cache on exact image bytes; "phash" also matches re-encoded copies
+        self.image_cache_key = os.getenv("GENERATION_CACHE_IMAGE_KEY", "sha256").lower()
+        
+        # Resolves screenshot storage paths; attached at startup once the Supabase pool exists
+        self.image_store: Optional[ImageStore] = None
+    
+    @property
+    def openai_client(self) -> Optional[Any]:
+        """AsyncOpenAI client, importing the SDK on first use"""
         
-        # Initialize OpenAI client
-        if os.getenv("OPENAI_API_KEY"):
-            self.openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        if self._openai_client is None and self.openai_api_key:
+            from openai import AsyncOpenAI
+            self._openai_client = AsyncOpenAI(api_key=self.openai_api_key, max_retries=0)
             logger.info("OpenAI client initialized")
+        return self._openai_client
+    
+    @property
+    def anthropic_client(self) -> Optional[Any]:
+        """AsyncAnthropic client, importing the SDK on first use"""
         
-        # Initialize Anthropic client
-        if os.getenv("ANTHROPIC_API_KEY"):
-            self.anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        if self._anthropic_client is None and self.anthropic_api_key:
+            from anthropic import AsyncAnthropic
+            self._anthropic_client = AsyncAnthropic(api_key=self.anthropic_api_key, max_retries=0)
             logger.info("Anthropic client initialized")
+        return self._anthropic_client
+    
+    async def warm_up(self) -> None:
+        """Import the provider SDKs and build their clients in a thread, off the event loop"""
         
-        if not self.openai_client and not self.anthropic_client:
-            raise ValueError("At least one AI provider (OpenAI or Anthropic) must be configured")
+        started = time.perf_counter()
+        await asyncio.to_thread(lambda: (self.openai_client, self.anthropic_client))
+        logger.info(f"Provider clients ready in {time.perf_counter() - started:.2f}s")
     
     async def generate_from_prompt(
         self, 
         prompt: str, 
         image_url: Optional[str] = None,
+        preferences: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+        image_bytes: Optional[bytes] = None,
+        image_mime_type: Optional[str] = None,
+        image_path: Optional[str] = None
+    ) -> Dict[str, str]:
+        """Generate HTML, CSS, and JavaScript from a prompt and an optional image URL, uploaded bytes or storage path"""
+        
+        with tracer.start_as_current_span("generate") as span:
+            span.set_attribute("prompt.length", len(prompt))
+            
+            with STAGE_SECONDS.labels("image_prep").time():
+                images, image_digest = await self._prepare_images(image_url, image_bytes, image_mime_type, image_path)
+            cache_key = self.cache_key(prompt, image_digest, preferences)
+            cached = await self._cache_lookup(cache_key, use_cache)
+            span.set_attribute("generation_cache.hit", cached is not None)
+            if cached is not None:
+                return cached
+            
+            # Identical concurrent requests (double-clicks, client retries) share one provider call
+            result = await self.single_flight.do(
+                cache_key,
+                lambda: self._generate_and_cache(cache_key, prompt, images, preferences)
+            )
+            span.set_attribute("response.bytes", sum(len(result.get(field) or "") for field in ("html", "css", "js")))
+            return dict(result)
+    
+    async def _generate_and_cache(
+        self,
+        cache_key: str,
+        prompt: str,
+        images: Optional[List[str]] = None,
         preferences: Optional[Dict[str, Any]] = None
     ) -> Dict[str, str]:
-        """Generate HTML, CSS, and JavaScript from a prompt"""
+        """Generate code and store it, even if every waiting caller has gone away"""
+        
+        result, complete = await self._generate(prompt, images, preferences)
+        
+        # Repaired or cut-off output is served once but never replayed from the cache
+        if self.generation_cache and complete:
+            await self.generation_cache.set(cache_key, result)
+        
+        return result
+    
+    def cache_key(
+        self,
+        prompt: str,
+        image_digest: Optional[str] = None,
+        preferences: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Fingerprint of a generation request: prompt, image digest, model, preferences and prompt templates"""
+        
+        return generation_fingerprint(
+            prompt,
+            image_digest,
+            self._active_model(),
+            preferences,
+            PROMPTS.fingerprint
+        )
+    
+    async def _prepare_images(
+        self,
+        image_url: Optional[str] = None,
+        image_bytes: Optional[bytes] = None,
+        image_mime_type: Optional[str] = None,
+        image_path: Optional[str] = None
+    ) -> Tuple[List[str], Optional[str]]:
+        """Preprocess an inline, uploaded or stored screenshot and return the image URLs to send plus its cache digest"""
+        
+        with tracer.start_as_current_span("prepare_images") as span:
+            if image_bytes is not None:
+                span.set_attribute("image.source", "upload")
+                span.set_attribute("image.bytes_in", len(image_bytes))
+            elif image_path:
+                span.set_attribute("image.source", "storage")
+            elif image_url:
+                span.set_attribute("image.source", "data_uri" if image_url.startswith("data:") else "url")
+                span.set_attribute("image.bytes_in", len(image_url))
+            
+            images, digest = await self._resolve_images(image_url, image_bytes, image_mime_type, image_path)
+            span.set_attribute("image.count", len(images))
+            span.set_attribute("image.bytes_out", sum(len(image) for image in images))
+            return images, digest
+    
+    async def _resolve_images(
+        self,
+        image_url: Optional[str] = None,
+        image_bytes: Optional[bytes] = None,
+        image_mime_type: Optional[str] = None,
+        image_path: Optional[str] = None
+    ) -> Tuple[List[str], Optional[str]]:
+        if image_bytes is None and image_path and self.image_store:
+            stored = await self.image_store.resolve(image_path)
+            if stored is not None:
+                if self.image_cache_key == "phash" and stored.perceptual_hash:
+                    return stored.images, f"phash:{stored.perceptual_hash}"
+                return stored.images, stored.sha256
+        
+        if image_bytes is None:
+            if not image_url:
+                return [], None
+            
+            image_bytes = decode_image_bytes(image_url)
+            if not image_url.startswith("data:"):
+                # Remote URLs are fetched by the provider; key on the URL itself
+                return [image_url], hashlib.sha256(image_bytes).hexdigest()
+        
+        processed = await self.image_preprocessor.process(image_bytes)
+        if processed is None:
+            if not image_url:
+                # Uploaded bytes are base64-encoded once, here, for the provider
+                mime_type = image_mime_type or sniff_image_mime_type(image_bytes)
+                image_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+            return [image_url], hashlib.sha256(image_bytes).hexdigest()
+        
+        if self.image_cache_key == "phash":
+            return processed.data_uris, f"phash:{processed.perceptual_hash}"
+        return processed.data_uris, hashlib.sha256(image_bytes).hexdigest()
+    
+    def _active_model(self) -> str:
+        """Provider and model that will serve the next generation"""
+        
+        provider, model = self.router.candidates[0]
+        return f"{provider}:{model}"
+    
+    async def _cache_lookup(self, cache_key: str, use_cache: bool) -> Optional[Dict[str, str]]:
+        """Return cached code for a request unless the caller bypassed the cache"""
+        
+        if not self.generation_cache:
+            return None
+        
+        if not use_cache:
+            self.generation_cache.record_bypass()
+            return None
+        
+        cached = await self.generation_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Generation cache hit for {cache_key[:12]}")
+        return cached
+    
+    async def _generate(
+        self,
+        prompt: str,
+        images: Optional[List[str]] = None,
+        preferences: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, str], bool]:
+        """Run a generation against the configured providers; returns the code and whether it parsed cleanly"""
         
         try:
-            # Use OpenAI GPT-4o as primary generator
-            if self.openai_client:
-                return await self._generate_with_openai(prompt, image_url, preferences)
+            order = self.router.order()
+            if not order:
+                raise RuntimeError("No AI providers available (all circuits open)")
             
-            # Fallback to Anthropic Claude
-            elif self.anthropic_client:
-                return self._generate_with_anthropic(prompt, preferences)
+            # Race a second provider once the primary exceeds its latency budget
+            if self.hedge_after_seconds > 0 and len(order) > 1:
+                return await self._generate_hedged(order, prompt, images, preferences)
             
-            else:
-                raise RuntimeError("No AI providers available")
+            return await self._generate_routed(order, prompt, images, preferences)
                 
         except Exception as e:
             logger.error(f"Code generation failed: {e}")
             raise
     
+    async def _generate_routed(
+        self,
+        candidates: List[Tuple[str, str]],
+        prompt: str,
+        images: Optional[List[str]] = None,
+        preferences: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, str], bool]:
+        """Try candidates in order, retrying transient errors within the retry budget"""
+        
+        async def call(provider: str, model: str) -> Tuple[Dict[str, str], bool]:
+            if provider == "openai":
+                return await self._generate_with_openai(prompt, images, preferences, model=model)
+            return await self._generate_with_anthropic(prompt, images, preferences, model=model)
+        
+        return await self._call_with_router(candidates, call)
+    
+    async def _call_with_router(
+        self,
+        candidates: List[Tuple[str, str]],
+        call: Callable[[str, str], Awaitable[Any]],
+        record_latency: bool = True
+    ) -> Any:
+        """Run ``call(provider, model)`` against candidates with breakers, retries and backoff"""
+        
+        self.router.retry_budget.deposit()
+        last_error: Optional[BaseException] = None
+        
+        for candidate in candidates:
+            breaker = self.router.breakers[candidate]
+            provider, model = candidate
+            attempt = 0
+            
+            while True:
+                if not breaker.allow():
+                    breaker.rejections += 1
+                    PROVIDER_REQUESTS.labels(provider, model, "rejected").inc()
+                    break
+                
+                started = time.perf_counter()
+                try:
+                    with tracer.start_as_current_span(
+                        "provider.call",
+                        attributes={"provider": provider, "model": model, "attempt": attempt}
+                    ):
+                        result = await call(provider, model)
+                except asyncio.CancelledError:
+                    # Cancelled by a caller or a hedge; not the model's fault
+                    breaker.release()
+                    raise
+                except Exception as e:
+                    PROVIDER_REQUESTS.labels(provider, model, "error").inc()
+                    if not _is_provider_failure(e):
+                        # Bad input, auth or policy rejections say nothing about the model's health
+                        breaker.release()
+                        raise
+                    breaker.record_failure()
+                    last_error = e
+                    
+                    if not _is_retryable(e) or attempt >= self.router.max_retries or not self.router.retry_budget.withdraw():
+                        logger.warning(f"{provider}:{model} failed ({e}), moving to next candidate")
+                        break
+                    
+                    delay = self.router.backoff(attempt, e)
+                    attempt += 1
+                    logger.warning(f"{provider}:{model} failed ({e}), retry {attempt} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                
+                # Stream opens only measure time to first byte, so keep them out of the EWMA
+                breaker.record_success(time.perf_counter() - started if record_latency else None)
+                PROVIDER_REQUESTS.labels(provider, model, "success").inc()
+                GENERATIONS.labels(provider, model).inc()
+                return result
+        
+        raise last_error or RuntimeError("No AI providers available (all circuits open)")
+    
+    async def _generate_hedged(
+        self,
+        order: List[Tuple[str, str]],
+        prompt: str,
+        images: Optional[List[str]] = None,
+        preferences: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, str], bool]:
+        """Start the best candidate, add another provider after the hedge delay, and keep the first success"""
+        
+        # Prefer hedging onto a different provider, since a degraded provider tends to be degraded for all models
+        hedge = next((candidate for candidate in order if candidate[0] != order[0][0]), order[1])
+        primary_candidates = [candidate for candidate in order if candidate != hedge]
+        
+        primary = asyncio.create_task(self._generate_routed(primary_candidates, prompt, images, preferences))
+        pending = {primary}
+        secondary: Optional[asyncio.Task] = None
+        primary_error: Optional[BaseException] = None
+        
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after_seconds)
+            if primary in done and primary.exception() is None:
+                self._hedge_stats["primary_wins"] += 1
+                return primary.result()
+            
+            if primary in done:
+                # Primary failed inside the budget; let the secondary take over
+                primary_error = primary.exception()
+                pending.discard(primary)
+                logger.warning(f"Primary provider failed ({primary_error}), trying {hedge[0]}:{hedge[1]}")
+            else:
+                logger.info(f"Primary provider exceeded {self.hedge_after_seconds}s, hedging with {hedge[0]}:{hedge[1]}")
+            
+            self._hedge_stats["hedged"] += 1
+            secondary = asyncio.create_task(self._generate_routed([hedge], prompt, images, preferences))
+            pending.add(secondary)
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._hedge_stats["primary_wins" if task is primary else "secondary_wins"] += 1
+                        return task.result()
+                    if task is primary:
+                        primary_error = task.exception()
+                    logger.warning(f"Hedged request failed: {task.exception()}")
+            
+            self._hedge_stats["both_failed"] += 1
+            raise primary_error or secondary.exception()
+        finally:
+            # Cancel the loser (or everything, if our caller was cancelled)
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        """Hedged request counters"""
+        
+        return {"hedge_after_seconds": self.hedge_after_seconds, **self._hedge_stats}
+    
+    def close(self) -> None:
+        """Release worker pools and the image store index"""
+        
+        self.image_preprocessor.shutdown()
+        if self.image_store:
+            self.image_store.close()
+    
+    def get_router_stats(self) -> Dict[str, Any]:
+        """Circuit breaker state, EWMA latency/error rate and retry budget per provider+model"""
+        
+        return self.router.snapshot()
+    
+    def _record_openai_usage(self, model: str, usage: Any) -> None:
+        """Record prompt tokens served from OpenAI's prefix cache"""
+        
+        if usage is None:
+            return
+        
+        # prompt_tokens includes the cached part
+        details = getattr(usage, "prompt_tokens_details", None)
+        if isinstance(details, dict):
+            cached = details.get("cached_tokens") or 0
+        else:
+            cached = getattr(details, "cached_tokens", None) or 0
+        self._record_usage(
+            "openai",
+            model,
+            uncached=usage.prompt_tokens - cached,
+            cache_read=cached,
+            cache_write=0,
+            output=usage.completion_tokens or 0
+        )
+    
+    def _record_anthropic_usage(self, model: str, usage: Any) -> None:
+        """Record prompt tokens read from and written to Anthropic's prompt cache"""
+        
+        # input_tokens excludes both cache reads and cache writes
+        self._record_usage(
+            "anthropic",
+            model,
+            uncached=usage.input_tokens,
+            cache_read=getattr(usage, "cache_read_input_tokens", None) or 0,
+            cache_write=getattr(usage, "cache_creation_input_tokens", None) or 0,
+            output=usage.output_tokens or 0
+        )
+    
+    def _record_usage(self, provider: str, model: str, uncached: int, cache_read: int, cache_write: int, output: int) -> None:
+        cost = record_tokens(provider, model, uncached, cache_read, cache_write, output)
+        trace.get_current_span().set_attributes({
+            "response.model": model,
+            "tokens.input_uncached": uncached,
+            "tokens.input_cache_read": cache_read,
+            "tokens.input_cache_write": cache_write,
+            "tokens.output": output
+        })
+        logger.info(
+            f"{provider}:{model} input tokens: {uncached} uncached, {cache_read} cache read, "
+            f"{cache_write} cache write; {output} output; ~${cost:.4f}"
+        )
+        
+        totals = self._token_stats.setdefault(provider, {
+            "requests": 0,
+            "uncached_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_write_input_tokens": 0,
+            "output_tokens": 0
+        })
+        totals["requests"] += 1
+        totals["uncached_input_tokens"] += uncached
+        totals["cache_read_input_tokens"] += cache_read
+        totals["cache_write_input_tokens"] += cache_write
+        totals["output_tokens"] += output
+    
+    def get_prompt_stats(self) -> Dict[str, Any]:
+        """Prompt template versions and cached vs uncached input tokens per provider"""
+        
+        providers = {}
+        for provider, totals in self._token_stats.items():
+            input_tokens = totals["uncached_input_tokens"] + totals["cache_read_input_tokens"] + totals["cache_write_input_tokens"]
+            providers[provider] = {
+                **totals,
+                "cached_ratio": totals["cache_read_input_tokens"] / input_tokens if input_tokens else 0.0
+            }
+        
+        return {
+            "templates": PROMPTS.versions(),
+            "fingerprint": PROMPTS.fingerprint,
+            "edit_templates": EDIT_PROMPTS.versions(),
+            "anthropic_prompt_cache": self.anthropic_prompt_cache,
+            "providers": providers
+        }
+    
     async def _generate_with_openai(
         self, 
         prompt: str, 
-        image_url: Optional[str] = None,
-        preferences: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, str]:
-        """Generate code using OpenAI GPT-4o"""
-        
-        system_prompt = """You are an expert frontend developer specializing in creating pixel-perfect HTML, CSS, and JavaScript implementations from design prompts.
-
-Your task is to generate clean, modern, and responsive code using:
-- Semantic HTML5
-- Tailwind CSS for styling (CDN version)
-- Vanilla JavaScript for interactivity
-- Modern web standards and best practices
-
-Requirements:
-1. Create a complete, self-contained HTML page
-2. Use Tailwind CSS classes for all styling
-3. Ensure responsive design (mobile-first approach)
-4. Add smooth animations and hover effects
-5. Include proper accessibility attributes
-6. Use modern JavaScript (ES6+)
-7. Ensure cross-browser compatibility
-
-Return your response as a JSON object with this exact structure:
-{
-  "html": "complete HTML document",
-  "css": "additional custom CSS if needed (prefer Tailwind)",
-  "js": "JavaScript for interactivity"
-}
-
-Make the code production-ready and visually appealing."""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Create a website based on this prompt: {prompt}"}
-        ]
+        images: Optional[List[str]] = None,
+        preferences: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None
+    ) -> Tuple[Dict[str, str], bool]:
+        """Generate code using OpenAI GPT-4o; returns the code and whether it parsed cleanly from a finished reply"""
         
-        # Add image if provided
-        if image_url:
-            messages[-1]["content"] = [
-                {"type": "text", "text": f"Create a website that matches this design: {prompt}"},
-                {"type": "image_url", "image_url": {"url": image_url, "detail": "high"}}
-            ]
-        
-        model_name = os.getenv("OPENAI_GPT_MODEL", "gpt-4o-preview")
+        messages = self._build_openai_messages(prompt, images)
+        model_name = model or os.getenv("OPENAI_GPT_MODEL", "gpt-4o-preview")
 
-        try:
+        with PROVIDER_SECONDS.labels("openai", model_name).time():
             response = await self.openai_client.chat.completions.create(
                 model=model_name,
                 messages=messages,
@@ -108,39 +755,74 @@ Make the code production-ready and visually appealing."""
                 temperature=0.1,
                 response_format={"type": "json_object"}
             )
-        except Exception as e:  # Fallback on model errors or invalid request
-            logger.warning(f"Model {model_name} unavailable ({e}). Falling back to gpt-4o-mini.")
-            response = await self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=8000,
-                temperature=0.1,
-                response_format={"type": "json_object"}
-            )
+        
+        self._record_openai_usage(model_name, response.usage)
         
         content = response.choices[0].message.content
         if not content:
             raise RuntimeError("Empty response from OpenAI")
+        truncated = response.choices[0].finish_reason == "length"
+        if truncated:
+            content, truncated = await self._continue_truncated("openai", model_name, prompt, images, content)
         
         logger.info(f"OpenAI response length: {len(content)}")
-        logger.debug(f"OpenAI response preview: {content[:200]}...")
+        logger.debug("OpenAI response preview: %s...", content[:200])
+        
+        with STAGE_SECONDS.labels("parse").time(), tracer.start_as_current_span("parse", attributes={"response.length": len(content)}):
+            result, clean = self._parse_openai_content(content)
+        return result, clean and not truncated
+    
+    def _build_openai_messages(self, prompt: str, images: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Build the chat messages for an OpenAI generation request"""
+        
+        # The static system prompt goes first and the screenshot before the
+        # per-request text, so regenerations share the longest possible
+        # prefix for OpenAI's automatic prompt caching
+        messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": PROMPTS.get("openai_system").text},
+            {"role": "user", "content": PROMPTS.render("user_prompt", prompt=prompt)}
+        ]
+        
+        # Add image if provided (tall screenshots may arrive as several tiles)
+        if images:
+            messages[-1]["content"] = [
+                {"type": "image_url", "image_url": {"url": image, "detail": "high"}}
+                for image in images
+            ] + [
+                {"type": "text", "text": PROMPTS.render("user_image_prompt", prompt=prompt)}
+            ]
+        
+        return messages
+    
+    def _parse_openai_content(self, content: str) -> Tuple[Dict[str, str], bool]:
+        """Parse the JSON code payload returned by OpenAI; the flag is False when it had to be repaired"""
         
         import json, re
         try:
             result = json.loads(content)
+            outcome = "json"
         except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse OpenAI response as JSON: {e}")
-            logger.error(f"Response content: {content}")
+            logger.warning(f"Failed to parse OpenAI response as JSON: {e}")
+            # Only the ends: replies run to megabytes and may echo user content
+            logger.debug("Response content (%s chars): %r ... %r", len(content), content[:200], content[-200:])
+            result = None
             # Attempt to extract JSON enclosed in triple backtick code fences
             match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", content, re.DOTALL | re.IGNORECASE)
             if match:
                 try:
                     result = json.loads(match.group(1))
+                    outcome = "fenced"
                     logger.info("Successfully parsed JSON extracted from code block")
                 except json.JSONDecodeError:
-                    raise RuntimeError(f"Invalid JSON response from OpenAI: {e}")
-            else:
+                    pass
+            if result is None:
+                # Cut off or malformed: keep every field that can still be decoded
+                result = self._salvage("openai", content)
+                outcome = "repaired"
+            if result is None:
+                PARSE_OUTCOMES.labels("openai", "failed").inc()
                 raise RuntimeError(f"Invalid JSON response from OpenAI: {e}")
+        PARSE_OUTCOMES.labels("openai", outcome).inc()
         
         # Validate response structure
         required_keys = ["html", "css", "js"]
@@ -148,45 +830,430 @@ Make the code production-ready and visually appealing."""
             if key not in result:
                 result[key] = ""
 
-        return result
+        return result, outcome != "repaired"
 
-    def _generate_with_anthropic(
+    async def _generate_with_anthropic(
         self, 
         prompt: str, 
-        preferences: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, str]:
-        """Generate code using Anthropic Claude"""
+        images: Optional[List[str]] = None,
+        preferences: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None
+    ) -> Tuple[Dict[str, str], bool]:
+        """Generate code using Anthropic Claude; returns the code and whether it parsed cleanly from a finished reply"""
         
-        system_prompt = """You are an expert frontend developer. Generate clean, modern HTML, CSS, and JavaScript code based on the user's prompt.
-
-Use Tailwind CSS for styling and create responsive, accessible designs.
-
-Return your response as JSON with keys: html, css, js"""
+        request = self._build_anthropic_request(prompt, images, model)
+        with PROVIDER_SECONDS.labels("anthropic", request["model"]).time():
+            message = await self.anthropic_client.messages.create(**request)
         
-        message = self.anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=4000,
-            temperature=0.1,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": f"Create a website based on this prompt: {prompt}"}
-            ]
-        )
+        self._record_anthropic_usage(message.model, message.usage)
         
         content = message.content[0].text
+        truncated = message.stop_reason == "max_tokens"
+        if truncated:
+            content, truncated = await self._continue_truncated("anthropic", request["model"], prompt, images, content)
+        
+        with STAGE_SECONDS.labels("parse").time(), tracer.start_as_current_span("parse", attributes={"response.length": len(content)}):
+            result, clean = self._parse_anthropic_content(content)
+        return result, clean and not truncated
+    
+    def _build_anthropic_request(
+        self,
+        prompt: str,
+        images: Optional[List[str]] = None,
+        model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Build the messages.create arguments for an Anthropic generation request"""
+        
+        system: Any = PROMPTS.get("anthropic_system").text
+        if self.anthropic_prompt_cache:
+            system = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        
+        content: Any = PROMPTS.render("user_prompt", prompt=prompt)
+        
+        # Anthropic takes inline base64 images only; remote URLs are sent as text-only prompts
+        image_blocks = []
+        for image in images or []:
+            if image.startswith("data:") and ";base64," in image:
+                header, _, data = image.partition(",")
+                image_blocks.append({
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": header[len("data:"):].split(";")[0],
+                        "data": data
+                    }
+                })
+        
+        if image_blocks:
+            # A second breakpoint after the screenshot lets regenerations of
+            # the same design reuse it with a different prompt
+            if self.anthropic_prompt_cache:
+                image_blocks[-1]["cache_control"] = {"type": "ephemeral"}
+            content = image_blocks + [
+                {"type": "text", "text": PROMPTS.render("user_image_prompt", prompt=prompt)}
+            ]
+        
+        return {
+            "model": model or os.getenv("ANTHROPIC_MODEL", "claude-3-sonnet-20240229"),
+            "max_tokens": 4000,
+            "temperature": 0.1,
+            "system": system,
+            "messages": [
+                {"role": "user", "content": content}
+            ]
+        }
+    
+    def _parse_anthropic_content(self, content: str) -> Tuple[Dict[str, str], bool]:
+        """Parse the code payload returned by Anthropic; the flag is False unless it was valid JSON"""
         
         import json
         try:
             result = json.loads(content)
+            outcome = "json"
         except json.JSONDecodeError:
-            # Fallback parsing if JSON is malformed
-            result = {
-                "html": self._extract_code_block(content, "html"),
-                "css": self._extract_code_block(content, "css"),
-                "js": self._extract_code_block(content, "javascript")
-            }
+            result = self._salvage("anthropic", content)
+            outcome = "repaired"
+            if result is None:
+                # Fallback parsing if the reply is not JSON at all
+                result = {
+                    "html": self._extract_code_block(content, "html"),
+                    "css": self._extract_code_block(content, "css"),
+                    "js": self._extract_code_block(content, "javascript")
+                }
+                outcome = "code_blocks"
+        PARSE_OUTCOMES.labels("anthropic", outcome).inc()
         
-        return result
+        return result, outcome == "json"
+    
+    def _salvage(self, provider: str, content: str) -> Optional[Dict[str, str]]:
+        """Code recovered from a cut-off or malformed JSON reply, or None when it holds no HTML"""
+        
+        values, completed = salvage_fields(content)
+        if not values.get("html"):
+            return None
+        
+        incomplete = sorted(set(values) - completed)
+        logger.warning(
+            f"Recovered {provider} output from invalid JSON "
+            f"(complete: {', '.join(sorted(completed)) or 'none'}; cut off: {', '.join(incomplete) or 'none'})"
+        )
+        return {key: values.get(key, "") for key in ("html", "css", "js")}
+    
+    async def _continue_truncated(
+        self,
+        provider: str,
+        model: str,
+        prompt: str,
+        images: Optional[List[str]],
+        content: str
+    ) -> Tuple[str, bool]:
+        """Resume output that hit the token limit instead of regenerating it
+        
+        Each continuation resends the same prompt (so prompt caching still
+        applies) with the partial reply, and appends what comes back. Output
+        still cut off after ``max_continuations`` requests is left to the
+        JSON repair in the parsers. Returns the content and whether it is
+        still cut off.
+        """
+        
+        truncated = True
+
+        for attempt in range(1, self.max_continuations + 1):
+            logger.warning(
+                f"{provider}:{model} output hit the token limit at {len(content)} chars; "
+                f"continuation {attempt}/{self.max_continuations}"
+            )
+            try:
+                with tracer.start_as_current_span(
+                    "provider.continuation",
+                    attributes={"provider": provider, "model": model, "attempt": attempt, "content.length": len(content)}
+                ), PROVIDER_SECONDS.labels(provider, model).time():
+                    if provider == "openai":
+                        continuation, truncated = await self._continue_openai(model, prompt, images, content)
+                    else:
+                        continuation, truncated = await self._continue_anthropic(model, prompt, images, content)
+            except Exception as e:
+                # Keep what we have; the parser salvages the complete fields
+                CONTINUATIONS.labels(provider, model, "failed").inc()
+                logger.warning(f"Continuation request to {provider}:{model} failed: {e}")
+                break
+            
+            # Prefilled Claude replies resume exactly; OpenAI may echo the tail or add a fence
+            content = join_continuation(content, continuation) if provider == "openai" else content + continuation
+            CONTINUATIONS.labels(provider, model, "truncated" if truncated else "completed").inc()
+            if not truncated:
+                break
+        
+        return content, truncated
+    
+    async def _continue_openai(
+        self,
+        model: str,
+        prompt: str,
+        images: Optional[List[str]],
+        content: str
+    ) -> Tuple[str, bool]:
+        """Ask OpenAI to carry on from its cut-off reply; returns the new text and whether it was cut off again"""
+        
+        messages = self._build_openai_messages(prompt, images) + [
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": PROMPTS.get("continuation").text}
+        ]
+        # No JSON mode: the continuation is the rest of an object, not a new one
+        response = await self.openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=8000,
+            temperature=0.1
+        )
+        self._record_openai_usage(model, response.usage)
+        
+        choice = response.choices[0]
+        return choice.message.content or "", choice.finish_reason == "length"
+    
+    async def _continue_anthropic(
+        self,
+        model: str,
+        prompt: str,
+        images: Optional[List[str]],
+        content: str
+    ) -> Tuple[str, bool]:
+        """Prefill Claude's reply with the cut-off output so it resumes mid-object"""
+        
+        request = self._build_anthropic_request(prompt, images, model)
+        # Anthropic rejects assistant prefill that ends in whitespace; at worst
+        # the model repeats that whitespace, which is harmless in html/css/js
+        request["messages"].append({"role": "assistant", "content": content.rstrip()})
+        message = await self.anthropic_client.messages.create(**request)
+        self._record_anthropic_usage(message.model, message.usage)
+        
+        text = message.content[0].text if message.content else ""
+        return text, message.stop_reason == "max_tokens"
+    
+    async def generate_edit(self, instruction: str, excerpts: str) -> Dict[str, Any]:
+        """Ask the providers for a find/replace patch to an existing page
+        
+        Returns the raw reply, the provider and model that wrote it, its
+        token counts and whether it hit the output cap. Edits bypass the
+        generation cache and hedging; each one targets a single version.
+        """
+        
+        order = self.router.order()
+        if not order:
+            raise RuntimeError("No AI providers available (all circuits open)")
+        user_prompt = EDIT_PROMPTS.render("edit_user", instruction=instruction, excerpts=excerpts)
+        
+        async def call(provider: str, model: str) -> Dict[str, Any]:
+            if provider == "openai":
+                return await self._edit_with_openai(model, user_prompt)
+            return await self._edit_with_anthropic(model, user_prompt)
+        
+        return await self._call_with_router(order, call)
+    
+    async def _edit_with_openai(self, model: str, user_prompt: str) -> Dict[str, Any]:
+        with PROVIDER_SECONDS.labels("openai", model).time():
+            response = await self.openai_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": EDIT_PROMPTS.get("edit_system").text},
+                    {"role": "user", "content": user_prompt}
+                ],
+                max_tokens=self.edit_max_tokens,
+                temperature=0.1,
+                response_format={"type": "json_object"}
+            )
+        self._record_openai_usage(model, response.usage)
+        
+        choice = response.choices[0]
+        if not choice.message.content:
+            raise RuntimeError("Empty response from OpenAI")
+        return {
+            "content": choice.message.content,
+            "provider": "openai",
+            "model": model,
+            "input_tokens": response.usage.prompt_tokens if response.usage else 0,
+            "output_tokens": response.usage.completion_tokens if response.usage else 0,
+            "truncated": choice.finish_reason == "length"
+        }
+    
+    async def _edit_with_anthropic(self, model: str, user_prompt: str) -> Dict[str, Any]:
+        with PROVIDER_SECONDS.labels("anthropic", model).time():
+            message = await self.anthropic_client.messages.create(
+                model=model,
+                max_tokens=self.edit_max_tokens,
+                temperature=0.1,
+                system=EDIT_PROMPTS.get("edit_system").text,
+                messages=[{"role": "user", "content": user_prompt}]
+            )
+        self._record_anthropic_usage(message.model, message.usage)
+        
+        usage = message.usage
+        return {
+            "content": message.content[0].text if message.content else "",
+            "provider": "anthropic",
+            "model": model,
+            "input_tokens": usage.input_tokens
+            + (getattr(usage, "cache_read_input_tokens", None) or 0)
+            + (getattr(usage, "cache_creation_input_tokens", None) or 0),
+            "output_tokens": usage.output_tokens or 0,
+            "truncated": message.stop_reason == "max_tokens"
+        }
+    
+    async def stream_from_prompt(
+        self,
+        prompt: str,
+        image_url: Optional[str] = None,
+        preferences: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+        image_bytes: Optional[bytes] = None,
+        image_mime_type: Optional[str] = None,
+        image_path: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Generate code, yielding html/css/js deltas as the provider streams tokens
+        
+        Yields ``{"type": "delta", "field": ..., "text": ...}`` events while the
+        model is writing, then one ``{"type": "result", "code": {...}}`` event
+        with the complete parsed code.
+        """
+        
+        with STAGE_SECONDS.labels("image_prep").time():
+            images, image_digest = await self._prepare_images(image_url, image_bytes, image_mime_type, image_path)
+        cache_key = self.cache_key(prompt, image_digest, preferences)
+        cached = await self._cache_lookup(cache_key, use_cache)
+        if cached is not None:
+            for field in ["html", "css", "js"]:
+                if cached.get(field):
+                    yield {"type": "delta", "field": field, "text": cached[field]}
+            yield {"type": "result", "code": cached}
+            return
+        
+        order = self.router.order()
+        if not order:
+            raise RuntimeError("No AI providers available (all circuits open)")
+        
+        # Errors surface when the stream is opened, so route and retry that step
+        opened: Dict[str, str] = {}
+        
+        async def open_stream(provider: str, model: str) -> Any:
+            opened["provider"] = provider
+            opened["model"] = model
+            if provider == "openai":
+                return await self._open_openai_stream(prompt, images, model)
+            return await self._open_anthropic_stream(prompt, images, model)
+        
+        opened_at = time.perf_counter()
+        stream = await self._call_with_router(order, open_stream, record_latency=False)
+        # Set by the iterators from the final chunk: "length"/"max_tokens" means the output was cut off
+        finish: Dict[str, str] = {}
+        if opened["provider"] == "openai":
+            chunks = self._iter_openai_stream(stream, opened["model"], finish)
+        else:
+            chunks = self._iter_anthropic_stream(stream, finish)
+        
+        parser = IncrementalJSONParser()
+        content_parts: List[str] = []
+        
+        async for text in chunks:
+            content_parts.append(text)
+            for field, delta in parser.feed(text):
+                yield {"type": "delta", "field": field, "text": delta}
+        
+        PROVIDER_SECONDS.labels(opened["provider"], opened["model"]).observe(time.perf_counter() - opened_at)
+        
+        content = "".join(content_parts)
+        if not content:
+            raise RuntimeError("Empty response from AI provider")
+        
+        truncated = finish.get("reason") in ("length", "max_tokens")
+        if truncated and not parser.done:
+            # The continuation is not streamed; its text arrives as one delta per field
+            continued, truncated = await self._continue_truncated(opened["provider"], opened["model"], prompt, images, content)
+            for field, delta in parser.feed(continued[len(content):]):
+                yield {"type": "delta", "field": field, "text": delta}
+            content = continued
+        
+        logger.info(f"Streamed response length: {len(content)}")
+        
+        parse_started = time.perf_counter()
+        if parser.done:
+            result = parser.result()
+            for key in ["html", "css", "js"]:
+                result.setdefault(key, "")
+            PARSE_OUTCOMES.labels(opened["provider"], "json").inc()
+            clean = True
+        elif opened["provider"] == "openai":
+            result, clean = self._parse_openai_content(content)
+        else:
+            result, clean = self._parse_anthropic_content(content)
+        STAGE_SECONDS.labels("parse").observe(time.perf_counter() - parse_started)
+        
+        # Repaired or cut-off output is served once but never replayed from the cache
+        if self.generation_cache and clean and not truncated:
+            await self.generation_cache.set(cache_key, result)
+        
+        yield {"type": "result", "code": result}
+    
+    async def _open_openai_stream(
+        self,
+        prompt: str,
+        images: Optional[List[str]] = None,
+        model: Optional[str] = None
+    ) -> Any:
+        """Start a streamed OpenAI completion"""
+        
+        return await self.openai_client.chat.completions.create(
+            model=model or os.getenv("OPENAI_GPT_MODEL", "gpt-4o-preview"),
+            messages=self._build_openai_messages(prompt, images),
+            max_tokens=8000,
+            temperature=0.1,
+            response_format={"type": "json_object"},
+            stream=True,
+            # Final chunk carries token usage, including cached prompt tokens
+            extra_body={"stream_options": {"include_usage": True}}
+        )
+    
+    async def _iter_openai_stream(self, stream: Any, model: str, finish: Dict[str, str]) -> AsyncIterator[str]:
+        """Yield raw completion text from an OpenAI stream"""
+        
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                self._record_openai_usage(model, chunk.usage)
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finish["reason"] = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    async def _open_anthropic_stream(
+        self,
+        prompt: str,
+        images: Optional[List[str]] = None,
+        model: Optional[str] = None
+    ) -> Any:
+        """Start a streamed Anthropic message"""
+        
+        return await self.anthropic_client.messages.create(
+            stream=True,
+            **self._build_anthropic_request(prompt, images, model)
+        )
+    
+    async def _iter_anthropic_stream(self, stream: Any, finish: Dict[str, str]) -> AsyncIterator[str]:
+        """Yield raw completion text from an Anthropic stream"""
+        
+        model = ""
+        usage: Any = None
+        async for event in stream:
+            if event.type == "message_start":
+                model, usage = event.message.model, event.message.usage
+            elif event.type == "message_delta":
+                if event.delta.stop_reason:
+                    finish["reason"] = event.delta.stop_reason
+                if usage is not None:
+                    usage.output_tokens = event.usage.output_tokens
+            elif event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                yield event.delta.text
+        
+        if usage is not None:
+            self._record_anthropic_usage(model, usage)
     
     def _extract_code_block(self, content: str, language: str) -> str:
         """Extract code block from markdown-style response"""
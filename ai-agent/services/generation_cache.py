@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import time
+import base64
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def decode_image_bytes(image_url: Optional[str]) -> Optional[bytes]:
+    """Return the raw bytes behind a data URI, or the URL itself for remote images"""
+
+    if not image_url:
+        return None
+
+    if image_url.startswith("data:") and "," in image_url:
+        header, _, payload = image_url.partition(",")
+        if header.endswith(";base64"):
+            try:
+                return base64.b64decode(payload)
+            except ValueError:
+                pass
+        return payload.encode("utf-8")
+
+    return image_url.encode("utf-8")
+
+
+def generation_fingerprint(
+    prompt: str,
+    image_digest: Optional[str],
+    model: str,
+    preferences: Optional[Dict[str, Any]] = None,
+    prompt_version: Optional[str] = None
+) -> str:
+    """Content-addressed key for a generation request
+
+    ``image_digest`` identifies the screenshot: the sha256 of its decoded
+    bytes, or a perceptual hash when near-identical copies should share
+    an entry. ``prompt_version`` ties the entry to the prompt templates
+    that produced it.
+    """
+
+    normalized_prompt = re.sub(r"\s+", " ", prompt).strip()
+    material = json.dumps(
+        {
+            "prompt": normalized_prompt,
+            "image": image_digest or "",
+            "model": model,
+            "preferences": preferences or {},
+            "prompts": prompt_version or ""
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """Per-process LRU backend"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self._cache = LRUCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            ttl_seconds=ttl_seconds,
+            sizeof=len
+        )
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        self._cache.set(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class SQLiteCacheBackend:
+    """On-disk backend shared by every worker process on the host"""
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS generation_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_generation_cache_last_access "
+                "ON generation_cache(last_access)"
+            )
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_cache"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM generation_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM generation_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE generation_cache SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def _set(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generation_cache (key, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl_seconds, now)
+            )
+            self._conn.execute("DELETE FROM generation_cache WHERE expires_at <= ?", (now,))
+
+            # Evict least recently used rows until both bounds hold
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generation_cache"
+            ).fetchone()
+            while entries > self.max_entries or total_bytes > self.max_bytes:
+                row = self._conn.execute(
+                    "SELECT key, size FROM generation_cache ORDER BY last_access LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                self._conn.execute("DELETE FROM generation_cache WHERE key = ?", (row[0],))
+                entries -= 1
+                total_bytes -= row[1]
+                self.evictions += 1
+
+            self._conn.commit()
+
+
+class GenerationCache:
+    """Cache of generated code keyed by a fingerprint of the request"""
+
+    def __init__(self, backend: Any):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["GenerationCache"]:
+        """Build the cache selected by GENERATION_CACHE_BACKEND (memory, sqlite or off)"""
+
+        kind = os.getenv("GENERATION_CACHE_BACKEND", "memory").lower()
+        max_entries = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "500"))
+        max_bytes = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+        ttl_seconds = float(os.getenv("GENERATION_CACHE_TTL", "86400"))
+
+        if kind == "off":
+            return None
+        if kind == "sqlite":
+            path = os.getenv("GENERATION_CACHE_PATH", "/app/temp/generation_cache.sqlite3")
+            backend = SQLiteCacheBackend(path, max_entries, max_bytes, ttl_seconds)
+        else:
+            backend = MemoryCacheBackend(max_entries, max_bytes, ttl_seconds)
+
+        logger.info(f"Generation cache enabled ({kind})")
+        return cls(backend)
+
+    async def get(self, key: str) -> Optional[Dict[str, str]]:
+        """Return cached code for a fingerprint, or None"""
+
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            # A broken cache must never fail a generation
+            self.errors += 1
+            logger.warning(f"Generation cache read failed: {e}")
+            value = None
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, key: str, code: Dict[str, str]) -> None:
+        """Store generated code under a fingerprint"""
+
+        try:
+            await self.backend.set(key, json.dumps(code))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Generation cache write failed: {e}")
+
+    def record_bypass(self) -> None:
+        self.bypassed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit-rate counters plus backend size"""
+
+        lookups = self.hits + self.misses
+        return {
+            **self.backend.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
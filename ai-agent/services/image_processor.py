@@ -0,0 +1,243 @@
+import io
+import os
+import math
+import base64
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageChops, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProcessedImage:
+    """A screenshot prepared for a vision request"""
+
+    tiles: List[bytes]
+    mime_type: str
+    width: int
+    height: int
+    perceptual_hash: str
+    original_bytes: int
+    processed_bytes: int
+    original_tokens: int
+    processed_tokens: int
+    data_uris: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.data_uris:
+            self.data_uris = [
+                f"data:{self.mime_type};base64,{base64.b64encode(tile).decode('ascii')}"
+                for tile in self.tiles
+            ]
+
+
+def sniff_image_mime_type(data: bytes) -> str:
+    """MIME type from the file signature; PNG when unrecognised"""
+
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/png"
+
+
+def estimate_vision_tokens(width: int, height: int) -> int:
+    """OpenAI high-detail token cost: fit in 2048x2048, shortest side to 768, 170 per 512px tile plus 85"""
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def perceptual_hash(image: Image.Image, size: int = 16) -> str:
+    """Difference hash (dHash) of the image, as hex"""
+
+    gray = image.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def _crop_uniform_border(image: Image.Image, tolerance: int = 24) -> Image.Image:
+    """Trim margins that match the top-left pixel colour"""
+
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    diff = ImageChops.difference(image, background).convert("L")
+    bbox = diff.point(lambda value: 255 if value > tolerance else 0).getbbox()
+    if bbox and (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) < image.width * image.height:
+        return image.crop(bbox)
+    return image
+
+
+def _fit(image: Image.Image, max_long_side: int, max_short_side: int) -> Image.Image:
+    """Downscale so the image fits both side limits; never upscale"""
+
+    width, height = image.size
+    scale = min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+    if scale < 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    return image
+
+
+def preprocess_image(
+    data: bytes,
+    max_long_side: int = 2048,
+    max_short_side: int = 768,
+    output_format: str = "WEBP",
+    quality: int = 80,
+    crop_whitespace: bool = True,
+    tile_tall_pages: bool = False,
+    tile_max_aspect: float = 3.0,
+    max_tiles: int = 4
+) -> ProcessedImage:
+    """Decode, trim, tile and re-encode a screenshot for the vision model
+
+    Runs in a worker thread or process; everything here is CPU bound.
+    """
+
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("RGB")
+    original_tokens = estimate_vision_tokens(*image.size)
+
+    if crop_whitespace:
+        image = _crop_uniform_border(image)
+
+    phash = perceptual_hash(image)
+
+    # Very tall pages can become several tiles so each stays legible after
+    # scaling; this costs more vision tokens than one squeezed image
+    width, height = image.size
+    tile_height = height
+    tile_count = 1
+    if tile_tall_pages and height > width * tile_max_aspect:
+        tile_height = max(1, int(width * tile_max_aspect))
+        tile_count = math.ceil(height / tile_height)
+    if tile_count > max_tiles:
+        tile_count = max_tiles
+        tile_height = math.ceil(height / max_tiles)
+
+    tiles: List[bytes] = []
+    processed_tokens = 0
+    for index in range(tile_count):
+        top = index * tile_height
+        tile = image.crop((0, top, width, min(height, top + tile_height)))
+        tile = _fit(tile, max_long_side, max_short_side)
+        processed_tokens += estimate_vision_tokens(*tile.size)
+
+        buffer = io.BytesIO()
+        save_args: Dict[str, Any] = {"quality": quality}
+        if output_format == "JPEG":
+            save_args["optimize"] = True
+        elif output_format == "WEBP":
+            save_args["method"] = 4
+        tile.save(buffer, format=output_format, **save_args)
+        tiles.append(buffer.getvalue())
+
+    return ProcessedImage(
+        tiles=tiles,
+        mime_type=f"image/{output_format.lower()}",
+        width=width,
+        height=height,
+        perceptual_hash=phash,
+        original_bytes=len(data),
+        processed_bytes=sum(len(tile) for tile in tiles),
+        original_tokens=original_tokens,
+        processed_tokens=processed_tokens
+    )
+
+
+class ImagePreprocessor:
+    """Runs screenshot preprocessing on a thread or process pool, off the event loop"""
+
+    def __init__(self):
+        self.enabled = os.getenv("IMAGE_PREPROCESS", "true").lower() == "true"
+        self.options = {
+            "max_long_side": int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048")),
+            "max_short_side": int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768")),
+            "output_format": os.getenv("IMAGE_FORMAT", "WEBP").upper(),
+            "quality": int(os.getenv("IMAGE_QUALITY", "80")),
+            "crop_whitespace": os.getenv("IMAGE_CROP_WHITESPACE", "true").lower() == "true",
+            "tile_tall_pages": os.getenv("IMAGE_TILE_TALL_PAGES", "false").lower() == "true",
+            "tile_max_aspect": float(os.getenv("IMAGE_TILE_MAX_ASPECT", "3.0")),
+            "max_tiles": int(os.getenv("IMAGE_MAX_TILES", "4"))
+        }
+
+        workers = int(os.getenv("IMAGE_WORKERS", "2"))
+        self.executor_kind = os.getenv("IMAGE_EXECUTOR", "thread").lower()
+        self._executor: Executor = (
+            # Spawned, like the preview pool: a fork would copy the server's event loop, threads and sockets
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            if self.executor_kind == "process"
+            else ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        )
+
+        self._stats = {
+            "processed": 0,
+            "failed": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "tokens_before": 0,
+            "tokens_after": 0
+        }
+
+    async def process(self, data: bytes) -> Optional[ProcessedImage]:
+        """Preprocess raw image bytes; returns None if disabled or the image cannot be decoded"""
+
+        if not self.enabled:
+            return None
+
+        loop = asyncio.get_running_loop()
+        try:
+            processed = await loop.run_in_executor(
+                self._executor, _preprocess_with_options, data, self.options
+            )
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.warning(f"Image preprocessing failed, sending original: {e}")
+            return None
+
+        self._stats["processed"] += 1
+        self._stats["bytes_in"] += processed.original_bytes
+        self._stats["bytes_out"] += processed.processed_bytes
+        self._stats["tokens_before"] += processed.original_tokens
+        self._stats["tokens_after"] += processed.processed_tokens
+
+        logger.info(
+            f"Preprocessed image {processed.width}x{processed.height} into {len(processed.tiles)} tile(s): "
+            f"{processed.original_bytes - processed.processed_bytes} bytes and "
+            f"~{processed.original_tokens - processed.processed_tokens} vision tokens saved"
+        )
+        return processed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "executor": self.executor_kind,
+            **self._stats,
+            "bytes_saved": self._stats["bytes_in"] - self._stats["bytes_out"],
+            "tokens_saved": self._stats["tokens_before"] - self._stats["tokens_after"]
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _preprocess_with_options(data: bytes, options: Dict[str, Any]) -> ProcessedImage:
+    # Module-level so it can be pickled into a process pool
+    return preprocess_image(data, **options)
@@ -0,0 +1,239 @@
+import os
+import json
+import base64
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from services.image_processor import ImagePreprocessor, sniff_image_mime_type
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoredImage:
+    """A screenshot resolved from storage, ready for a vision request"""
+
+    sha256: str
+    images: List[str]
+    perceptual_hash: Optional[str] = None
+
+
+class ImageStore:
+    """Resolves screenshot paths in Supabase Storage through a local blob cache
+
+    Blobs are content-addressed: each file under ``path`` is named by the
+    sha256 of the original upload and holds the preprocessed image exactly
+    as it is sent to the provider. A small SQLite index maps storage paths
+    to the ETag and sha256 last seen for them, and tracks blob sizes for
+    LRU eviction. Known paths are revalidated with a conditional GET, so a
+    repeat generation downloads nothing when the object has not changed.
+    """
+
+    def __init__(
+        self,
+        download: Callable[[str, str, Optional[str]], Awaitable[httpx.Response]],
+        preprocessor: ImagePreprocessor
+    ):
+        self.download = download
+        self.preprocessor = preprocessor
+        self.bucket = os.getenv("SCREENSHOT_BUCKET", "screenshots")
+        self.path = os.getenv("IMAGE_STORE_PATH", "/app/temp/image_store")
+        self.max_bytes = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.max_entries = int(os.getenv("IMAGE_STORE_MAX_ENTRIES", "5000"))
+        self.max_object_bytes = int(os.getenv("IMAGE_STORE_MAX_OBJECT_BYTES", str(20 * 1024 * 1024)))
+        # Paths checked this recently are used without asking storage at all
+        self.revalidate_after = float(os.getenv("IMAGE_STORE_REVALIDATE_AFTER", "60"))
+
+        self.single_flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._stats = {
+            "fresh_hits": 0,
+            "not_modified": 0,
+            "downloads": 0,
+            "bytes_downloaded": 0,
+            "deduplicated": 0,
+            "evictions": 0,
+            "failed": 0
+        }
+
+        os.makedirs(self.path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.path, "index.sqlite3"), check_same_thread=False, timeout=5)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_last_access ON blobs(last_access)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS refs ("
+                "path TEXT PRIMARY KEY, etag TEXT, sha256 TEXT NOT NULL, checked_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    async def resolve(self, storage_path: str) -> Optional[StoredImage]:
+        """Return the preprocessed screenshot at a bucket path, or None if it cannot be fetched"""
+
+        storage_path = storage_path.lstrip("/")
+        if not storage_path or ".." in storage_path.split("/"):
+            raise ValueError(f"Unsafe image path: {storage_path}")
+
+        # Concurrent generations for the same screenshot share one fetch
+        try:
+            return await self.single_flight.do(storage_path, lambda: self._resolve(storage_path))
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.warning(f"Failed to resolve image {storage_path}: {e}")
+            return None
+
+    async def _resolve(self, storage_path: str) -> Optional[StoredImage]:
+        ref = await asyncio.to_thread(self._get_ref, storage_path)
+        stored = await asyncio.to_thread(self._read_blob, ref["sha256"]) if ref else None
+
+        if stored is not None and time.time() - ref["checked_at"] < self.revalidate_after:
+            self._stats["fresh_hits"] += 1
+            return stored
+
+        response = await self.download(self.bucket, storage_path, ref["etag"] if stored else None)
+
+        if response.status_code == 304 and stored is not None:
+            self._stats["not_modified"] += 1
+            await asyncio.to_thread(self._put_ref, storage_path, ref["etag"], stored.sha256)
+            return stored
+
+        if response.status_code != 200:
+            logger.warning(f"Image download for {storage_path} failed: {response.status_code}")
+            return None
+
+        data = response.content
+        if len(data) > self.max_object_bytes:
+            raise ValueError(f"Image is {len(data)} bytes, above the {self.max_object_bytes} byte limit")
+
+        self._stats["downloads"] += 1
+        self._stats["bytes_downloaded"] += len(data)
+        sha256 = hashlib.sha256(data).hexdigest()
+        etag = response.headers.get("etag")
+
+        # The same bytes may already be cached under another path
+        stored = await asyncio.to_thread(self._read_blob, sha256)
+        if stored is not None:
+            self._stats["deduplicated"] += 1
+        else:
+            stored = await self._preprocess(sha256, data)
+            await asyncio.to_thread(self._write_blob, stored)
+
+        await asyncio.to_thread(self._put_ref, storage_path, etag, sha256)
+        return stored
+
+    async def _preprocess(self, sha256: str, data: bytes) -> StoredImage:
+        processed = await self.preprocessor.process(data)
+        if processed is None:
+            encoded = base64.b64encode(data).decode("ascii")
+            return StoredImage(sha256=sha256, images=[f"data:{sniff_image_mime_type(data)};base64,{encoded}"])
+        return StoredImage(sha256=sha256, images=processed.data_uris, perceptual_hash=processed.perceptual_hash)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+        return {
+            "bucket": self.bucket,
+            "path": self.path,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            **self._stats
+        }
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.path, sha256[:2], f"{sha256}.json")
+
+    def _get_ref(self, storage_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, sha256, checked_at FROM refs WHERE path = ?", (storage_path,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "sha256": row[1], "checked_at": row[2]}
+
+    def _put_ref(self, storage_path: str, etag: Optional[str], sha256: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refs (path, etag, sha256, checked_at) VALUES (?, ?, ?, ?)",
+                (storage_path, etag, sha256, time.time())
+            )
+            self._conn.commit()
+
+    def _read_blob(self, sha256: str) -> Optional[StoredImage]:
+        try:
+            with open(self._blob_path(sha256), "r", encoding="utf-8") as f:
+                stored = StoredImage(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._conn.commit()
+        return stored
+
+    def _write_blob(self, stored: StoredImage) -> None:
+        payload = json.dumps({
+            "sha256": stored.sha256,
+            "images": stored.images,
+            "perceptual_hash": stored.perceptual_hash
+        })
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+
+        # Write to a temporary name first so readers never see a partial blob
+        blob_path = self._blob_path(stored.sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        temp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(temp_path, blob_path)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (sha256, size, last_access) VALUES (?, ?, ?)",
+                (stored.sha256, size, time.time())
+            )
+
+            # Evict least recently used blobs until both bounds hold
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+            while entries > self.max_entries or total_bytes > self.max_bytes:
+                row = self._conn.execute(
+                    "SELECT sha256, size FROM blobs ORDER BY last_access LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                self._conn.execute("DELETE FROM blobs WHERE sha256 = ?", (row[0],))
+                self._conn.execute("DELETE FROM refs WHERE sha256 = ?", (row[0],))
+                try:
+                    os.remove(self._blob_path(row[0]))
+                except OSError:
+                    pass
+                entries -= 1
+                total_bytes -= row[1]
+                self._stats["evictions"] += 1
+
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
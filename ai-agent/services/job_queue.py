@@ -0,0 +1,340 @@
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from opentelemetry import context as otel_context
+from opentelemetry.trace import Status, StatusCode
+from typing import Dict, Optional, Any, List
+
+from services.code_generator import CodeGenerator
+from services.artifact_manager import ArtifactManager
+from services.shared_state import SharedState
+from services.metrics import JOB_QUEUE_DEPTH, JOB_QUEUE_PROCESSING, STAGE_SECONDS
+from services.tracing import tracer
+from services.log_pipeline import request_id_var
+
+logger = logging.getLogger(__name__)
+
+
+# Shared counter of jobs queued or running across every worker process
+ACTIVE_JOBS_KEY = "jobs:active"
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when the scaffold queue has no room for another job"""
+
+
+@dataclass
+class ScaffoldJob:
+    """A queued code generation, identified by the artifact it will fill in"""
+
+    id: str
+    project_id: str
+    prompt: str
+    image_url: Optional[str] = None
+    image_bytes: Optional[bytes] = None
+    image_mime_type: Optional[str] = None
+    image_path: Optional[str] = None
+    preferences: Dict[str, Any] = field(default_factory=dict)
+    use_cache: bool = True
+    status: str = "pending"
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Trace context and request id of the submitting request, so the job's spans and logs join it
+    trace_context: Any = None
+    request_id: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Public view of the job, without the prompt and image payload"""
+
+        return {
+            "job_id": self.id,
+            "artifact_id": self.id,
+            "project_id": self.project_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "preview_url": f"/preview/{self.id}"
+        }
+
+
+class JobQueue:
+    """Bounded queue of scaffold jobs drained by a fixed-size worker pool"""
+
+    def __init__(self, code_generator: CodeGenerator, artifact_manager: ArtifactManager, state: SharedState):
+        self.code_generator = code_generator
+        self.artifact_manager = artifact_manager
+        # Job status is published here so any worker process can answer /jobs/{id}
+        self.state = state
+
+        self.concurrency = int(os.getenv("SCAFFOLD_WORKERS", "4"))
+        self.max_queue_size = int(os.getenv("SCAFFOLD_QUEUE_SIZE", "32"))
+        self.job_ttl = float(os.getenv("SCAFFOLD_JOB_TTL", "3600"))
+        # Cap on queued + running jobs across all worker processes (0 disables it)
+        self.global_max_active = int(os.getenv("SCAFFOLD_GLOBAL_MAX_ACTIVE", "0"))
+        # On shutdown, time allowed for queued and running jobs to finish
+        self.drain_timeout = float(os.getenv("SCAFFOLD_DRAIN_TIMEOUT", "45"))
+        self._accepting = True
+
+        self._queue: "asyncio.Queue[ScaffoldJob]" = asyncio.Queue(maxsize=self.max_queue_size)
+        self._jobs: Dict[str, ScaffoldJob] = {}
+        self._workers: List[asyncio.Task] = []
+        self._stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    @property
+    def accepting(self) -> bool:
+        """False once shutdown has started draining the queue"""
+
+        return self._accepting
+
+    async def start(self) -> None:
+        """Spawn the worker tasks"""
+
+        for index in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker(index)))
+        logger.info(f"Job queue started with {self.concurrency} workers (queue size {self.max_queue_size})")
+
+    async def stop(self) -> None:
+        """Stop accepting jobs, let queued ones finish within the drain timeout, then cancel the rest"""
+
+        self._accepting = False
+        processing = self.stats()["processing"]
+        if self._workers and (self._queue.qsize() or processing):
+            logger.info(
+                f"Draining job queue ({self._queue.qsize()} queued, {processing} processing, "
+                f"up to {self.drain_timeout}s)"
+            )
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Job queue drain timed out; cancelling unfinished jobs")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+        # Anything left would otherwise look pending to pollers until they time out
+        for job in self._jobs.values():
+            if job.status in ("pending", "processing"):
+                # Cancelled jobs already released their slot on the way out
+                held_slot = job.finished_at is None
+                job.status = "failed"
+                job.error = "Agent shut down before the job finished"
+                job.finished_at = time.time()
+                await self._mark_failed(job)
+                try:
+                    await self._publish(job)
+                except Exception as e:
+                    logger.warning(f"Failed to publish status of job {job.id}: {e}")
+                finally:
+                    if held_slot:
+                        await self._release_slot()
+        logger.info("Job queue stopped")
+
+    async def submit(
+        self,
+        project_id: str,
+        prompt: str,
+        image_url: Optional[str] = None,
+        preferences: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+        user_id: Optional[str] = None,
+        image_bytes: Optional[bytes] = None,
+        image_mime_type: Optional[str] = None,
+        image_path: Optional[str] = None
+    ) -> ScaffoldJob:
+        """Create a pending artifact and enqueue its generation"""
+
+        self._prune()
+
+        # Reject before touching the database so a full queue costs nothing
+        if self._queue.full() or not self._accepting:
+            self._stats["rejected"] += 1
+            raise JobQueueFull("Scaffold queue is full" if self._accepting else "Agent is shutting down")
+
+        await self._claim_slot()
+        try:
+            artifact_id = await self.artifact_manager.create_pending_artifact(project_id, user_id)
+        except Exception:
+            await self._release_slot()
+            raise
+        job = ScaffoldJob(
+            id=artifact_id,
+            project_id=project_id,
+            prompt=prompt,
+            image_url=image_url,
+            image_bytes=image_bytes,
+            image_mime_type=image_mime_type,
+            image_path=image_path,
+            preferences=preferences or {},
+            use_cache=use_cache,
+            trace_context=otel_context.get_current(),
+            request_id=request_id_var.get()
+        )
+
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            # Lost the race for the last slot while creating the row
+            self._stats["rejected"] += 1
+            await self._release_slot()
+            await self.artifact_manager.update_artifact_status(artifact_id, "failed")
+            raise JobQueueFull("Scaffold queue is full")
+
+        self._jobs[job.id] = job
+        JOB_QUEUE_DEPTH.set(self._queue.qsize())
+        await self._publish(job)
+        self._stats["submitted"] += 1
+        logger.info(f"Queued scaffold job {job.id} for project {project_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[ScaffoldJob]:
+        """Look up a job tracked by this process"""
+
+        return self._jobs.get(job_id)
+
+    async def lookup(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Public view of a job run by this or any other worker process"""
+
+        job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        return await self.state.get(f"job:{job_id}")
+
+    async def _mark_failed(self, job: ScaffoldJob) -> None:
+        """Record a failed job on its artifact; a failed write is logged so cleanup carries on"""
+
+        try:
+            await self.artifact_manager.update_artifact_status(job.id, "failed")
+        except Exception as e:
+            logger.error(f"Failed to mark artifact {job.id} as failed: {e}")
+
+    async def _publish(self, job: ScaffoldJob) -> None:
+        await self.state.set(f"job:{job.id}", job.to_dict(), ttl_seconds=self.job_ttl)
+
+    async def _claim_slot(self) -> None:
+        """Count a job against the cross-worker cap, rejecting it when the cap is reached"""
+
+        if not self.global_max_active:
+            return
+
+        try:
+            # The TTL is refreshed on every change, so a count leaked by a
+            # crashed worker clears once the queue has been idle that long
+            active = await self.state.incr(ACTIVE_JOBS_KEY, 1, self.job_ttl)
+        except Exception as e:
+            logger.warning(f"Shared job counter unavailable, admitting job: {e}")
+            return
+
+        if active > self.global_max_active:
+            await self._release_slot()
+            self._stats["rejected"] += 1
+            raise JobQueueFull("Scaffold queue is full")
+
+    async def _release_slot(self) -> None:
+        if not self.global_max_active:
+            return
+
+        try:
+            await self.state.incr(ACTIVE_JOBS_KEY, -1, self.job_ttl)
+        except Exception as e:
+            logger.warning(f"Failed to release shared job slot: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, worker utilisation and outcome counters"""
+
+        processing = sum(1 for job in self._jobs.values() if job.status == "processing")
+        return {
+            **self._stats,
+            "queued": self._queue.qsize(),
+            "max_queue_size": self.max_queue_size,
+            "processing": processing,
+            "workers": self.concurrency,
+            "tracked_jobs": len(self._jobs)
+        }
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            # Worker tasks have their own context, so this only tags this job's logs
+            request_id_var.set(job.request_id)
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"Worker {index} failed to record job {job.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: ScaffoldJob) -> None:
+        with tracer.start_as_current_span(
+            "scaffold.job",
+            context=job.trace_context,
+            attributes={"job.id": job.id, "project_id": job.project_id, "prompt.length": len(job.prompt)}
+        ) as span:
+            job.status = "processing"
+            job.started_at = time.time()
+            STAGE_SECONDS.labels("queue_wait").observe(job.started_at - job.created_at)
+            span.set_attribute("queue.wait_seconds", job.started_at - job.created_at)
+            JOB_QUEUE_DEPTH.set(self._queue.qsize())
+            JOB_QUEUE_PROCESSING.inc()
+            await self._publish(job)
+
+            try:
+                await self.artifact_manager.update_artifact_status(job.id, "processing")
+
+                generated_code = await self.code_generator.generate_from_prompt(
+                    prompt=job.prompt,
+                    image_url=job.image_url,
+                    preferences=job.preferences,
+                    use_cache=job.use_cache,
+                    image_bytes=job.image_bytes,
+                    image_mime_type=job.image_mime_type,
+                    image_path=job.image_path
+                )
+
+                await self.artifact_manager.complete_artifact(
+                    job.id,
+                    html_content=generated_code["html"],
+                    css_content=generated_code["css"],
+                    js_content=generated_code["js"]
+                )
+            except Exception as e:
+                logger.error(f"Scaffold job {job.id} failed: {e}")
+                span.record_exception(e)
+                span.set_status(Status(StatusCode.ERROR, str(e)))
+                job.status = "failed"
+                job.error = str(e)
+                self._stats["failed"] += 1
+                await self._mark_failed(job)
+            else:
+                job.status = "completed"
+                self._stats["completed"] += 1
+                logger.info(f"Scaffold job {job.id} completed")
+            finally:
+                job.finished_at = time.time()
+                # The image is only needed while generating
+                job.image_url = None
+                job.image_bytes = None
+                JOB_QUEUE_PROCESSING.dec()
+                try:
+                    await self._publish(job)
+                finally:
+                    # A lost slot would shrink the cross-worker cap for good
+                    await self._release_slot()
+
+    def _prune(self) -> None:
+        """Forget finished jobs older than the retention window"""
+
+        cutoff = time.time() - self.job_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
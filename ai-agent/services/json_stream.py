@@ -0,0 +1,248 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t'
+}
+
+# Next character that ends a run of plain string content
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+class IncrementalJSONParser:
+    """Streams string fields out of a top-level JSON object as chunks arrive
+
+    Model output is fed in arbitrary pieces; each call to ``feed`` returns the
+    newly decoded text of the requested fields as ``(field, delta)`` pairs, so
+    callers can forward partial html/css/js before the object is complete.
+    Anything before the opening brace (prose, a ```json fence) is skipped.
+    """
+
+    def __init__(self, fields: Iterable[str] = ("html", "css", "js")):
+        self.fields: Set[str] = set(fields)
+        self.values: Dict[str, List[str]] = {}
+        self.completed: Set[str] = set()
+        self.done = False
+
+        self._state = "start"
+        self._key: List[str] = []
+        self._current_key: Optional[str] = None
+        self._escape: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+        self._depth = 0
+        self._nested_in_string = False
+        self._nested_escape = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        """Consume a chunk of model output and return decoded field deltas"""
+
+        deltas: List[Tuple[str, str]] = []
+        i = 0
+        n = len(chunk)
+
+        while i < n and not self.done:
+            state = self._state
+
+            if state == "string":
+                i = self._feed_string(chunk, i, deltas)
+                continue
+
+            ch = chunk[i]
+            i += 1
+
+            if state == "start":
+                if ch == "{":
+                    self._state = "key_or_end"
+            elif state == "key_or_end":
+                if ch == '"':
+                    self._key = []
+                    self._state = "key"
+                elif ch == "}":
+                    self.done = True
+            elif state == "key":
+                if self._escape is not None:
+                    self._key.append(_SIMPLE_ESCAPES.get(ch, ch))
+                    self._escape = None
+                elif ch == "\\":
+                    self._escape = ch
+                elif ch == '"':
+                    self._current_key = "".join(self._key)
+                    self._state = "colon"
+                else:
+                    self._key.append(ch)
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value"
+            elif state == "value":
+                if ch == '"':
+                    self._state = "string"
+                elif ch in "{[":
+                    self._depth = 1
+                    self._state = "nested"
+                elif not ch.isspace():
+                    self._state = "scalar"
+            elif state == "nested":
+                self._feed_nested(ch)
+            elif state == "scalar":
+                if ch == ",":
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    self.done = True
+            elif state == "after_value":
+                if ch == ",":
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    self.done = True
+
+        return _merge(deltas)
+
+    def result(self) -> Dict[str, str]:
+        """Decoded text of every requested field seen so far, complete or not"""
+
+        return {key: "".join(parts) for key, parts in self.values.items()}
+
+    def _emit(self, text: str, deltas: List[Tuple[str, str]]) -> None:
+        key = self._current_key
+        if key in self.fields and text:
+            self.values.setdefault(key, []).append(text)
+            deltas.append((key, text))
+
+    def _feed_string(self, chunk: str, i: int, deltas: List[Tuple[str, str]]) -> int:
+        if self._escape is not None:
+            return self._feed_escape(chunk, i, deltas)
+
+        match = _STRING_SPECIAL.search(chunk, i)
+        end = match.start() if match else len(chunk)
+        if end > i:
+            self._flush_surrogate(deltas)
+            self._emit(chunk[i:end], deltas)
+        if not match:
+            return end
+
+        if chunk[end] == '"':
+            self._flush_surrogate(deltas)
+            if self._current_key in self.fields:
+                self.values.setdefault(self._current_key, [])
+                self.completed.add(self._current_key)
+            self._state = "after_value"
+        else:
+            self._escape = "\\"
+        return end + 1
+
+    def _feed_escape(self, chunk: str, i: int, deltas: List[Tuple[str, str]]) -> int:
+        # Escapes may be split across chunks, so buffer until one is complete
+        while i < len(chunk):
+            self._escape += chunk[i]
+            i += 1
+            kind = self._escape[1]
+
+            if kind != "u":
+                self._flush_surrogate(deltas)
+                self._emit(_SIMPLE_ESCAPES.get(kind, kind), deltas)
+                self._escape = None
+                return i
+
+            if len(self._escape) == 6:
+                try:
+                    code = int(self._escape[2:], 16)
+                except ValueError:
+                    code = 0xFFFD
+                self._escape = None
+                self._decode_codepoint(code, deltas)
+                return i
+
+        return i
+
+    def _decode_codepoint(self, code: int, deltas: List[Tuple[str, str]]) -> None:
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_surrogate(deltas)
+            self._high_surrogate = code
+            return
+
+        if 0xDC00 <= code <= 0xDFFF and self._high_surrogate is not None:
+            combined = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+            self._high_surrogate = None
+            self._emit(chr(combined), deltas)
+            return
+
+        self._flush_surrogate(deltas)
+        self._emit(chr(code) if not 0xD800 <= code <= 0xDFFF else "\ufffd", deltas)
+
+    def _flush_surrogate(self, deltas: List[Tuple[str, str]]) -> None:
+        if self._high_surrogate is not None:
+            self._high_surrogate = None
+            self._emit("\ufffd", deltas)
+
+    def _feed_nested(self, ch: str) -> None:
+        if self._nested_in_string:
+            if self._nested_escape:
+                self._nested_escape = False
+            elif ch == "\\":
+                self._nested_escape = True
+            elif ch == '"':
+                self._nested_in_string = False
+        elif ch == '"':
+            self._nested_in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._state = "after_value"
+
+
+def salvage_fields(content: str, fields: Iterable[str] = ("html", "css", "js")) -> Tuple[Dict[str, str], Set[str]]:
+    """Decode whatever string fields a cut-off or malformed JSON object still holds
+
+    Returns the decoded values (the last one may be partial) and the names of
+    the fields whose closing quote was reached.
+    """
+
+    parser = IncrementalJSONParser(fields)
+    parser.feed(content)
+    return parser.result(), parser.completed
+
+
+# Shortest repeated tail treated as the model re-sending text it was shown;
+# shorter matches are as likely to be legitimate content
+_MIN_OVERLAP = 16
+_MAX_OVERLAP = 400
+
+_LEADING_FENCE = re.compile(r"^\s*```(?:json)?[ \t]*\n?", re.IGNORECASE)
+
+
+def join_continuation(content: str, continuation: str) -> str:
+    """Append a continuation reply to cut-off output, dropping a code fence or repeated tail it starts with
+
+    The repeated tail is only dropped when exactly one overlap length matches;
+    repetitive markup (a list of identical rows) matches at several lengths,
+    and guessing would cut real content.
+    """
+
+    continuation = _LEADING_FENCE.sub("", continuation, count=1)
+    overlaps = [
+        size for size in range(_MIN_OVERLAP, min(len(content), len(continuation), _MAX_OVERLAP) + 1)
+        if content.endswith(continuation[:size])
+    ]
+    if len(overlaps) == 1:
+        return content + continuation[overlaps[0]:]
+    return content + continuation
+
+
+def _merge(deltas: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Join consecutive deltas for the same field"""
+
+    merged: List[Tuple[str, str]] = []
+    for key, text in deltas:
+        if merged and merged[-1][0] == key:
+            merged[-1] = (key, merged[-1][1] + text)
+        else:
+            merged.append((key, text))
+    return merged
@@ -0,0 +1,192 @@
+import os
+import sys
+import copy
+import json
+import uuid
+import zlib
+import queue
+import atexit
+import random
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Callable, Dict, List, Optional
+
+from opentelemetry import trace
+
+# Id of the HTTP request (or the request that submitted a job) being handled
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# LogRecord attributes that are not user-supplied extra= fields (uvicorn adds color_message)
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "request_id", "trace_id", "color_message"}
+
+
+def _truncate(text: str, limit: int) -> str:
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [truncated {len(text) - limit} chars]"
+
+
+class ContextFilter(logging.Filter):
+    """Runs on the calling thread: samples, tags records with request/trace ids and truncates payloads
+
+    Sampling keeps or drops all INFO/DEBUG records of a request together;
+    warnings and errors are always kept.
+    """
+
+    def __init__(self, sample_rate: float, max_chars: int):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        if record.levelno < logging.WARNING and self.sample_rate < 1.0:
+            if request_id:
+                keep = (zlib.crc32(request_id.encode()) % 10_000) < self.sample_rate * 10_000
+            else:
+                keep = random.random() < self.sample_rate
+            if not keep:
+                return False
+
+        record.request_id = request_id
+        span_context = trace.get_current_span().get_span_context()
+        record.trace_id = format(span_context.trace_id, "032x") if span_context.is_valid else None
+
+        # Format and truncate here, so large model outputs and response bodies
+        # are cut before they are copied onto the queue
+        try:
+            record.msg = _truncate(record.getMessage(), self.max_chars)
+            record.args = None
+        except Exception:
+            # Bad format arguments are reported by the handler, as without the pipeline
+            pass
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Keep the traceback as its own field instead of folding it into the message
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.message = record.getMessage()
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; extra= fields are included as top-level keys"""
+
+    def __init__(self, max_chars: int):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "trace_id": getattr(record, "trace_id", None),
+            "pid": record.process
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = _truncate(record.exc_text, self.max_chars)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The original plain-text layout, with the request id appended when there is one"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"{text} [request_id={request_id}]" if request_id else text
+
+
+def setup_logging() -> QueueListener:
+    """Route all logging through a queue to a background thread that writes stdout and a rotating file
+
+    Loggers only enqueue records; formatting and disk/console writes happen
+    on the listener thread, off the event loop. Settings:
+
+    LOG_LEVEL, LOG_FORMAT (json or text), LOG_FILE (may contain {pid} to
+    give each worker process its own file), LOG_MAX_BYTES, LOG_BACKUP_COUNT,
+    LOG_SAMPLE_RATE (share of INFO/DEBUG kept, 0-1) and LOG_MAX_MESSAGE_CHARS.
+    """
+
+    max_chars = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+    formatter: logging.Formatter = (
+        JSONFormatter(max_chars) if os.getenv("LOG_FORMAT", "json").lower() == "json" else TextFormatter()
+    )
+
+    handlers: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    log_file = os.getenv("LOG_FILE", "/app/logs/agent.log").format(pid=os.getpid())
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+        handlers.append(RotatingFileHandler(
+            log_file,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+            backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+            encoding="utf-8"
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(ContextFilter(float(os.getenv("LOG_SAMPLE_RATE", "1.0")), max_chars))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+
+class RequestIdMiddleware:
+    """Binds a request id to everything logged while handling a request
+
+    Uses the caller's X-Request-ID when present and echoes it back on the response.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
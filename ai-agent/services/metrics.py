@@ -0,0 +1,142 @@
+import os
+import json
+import logging
+from typing import Dict, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, multiprocess
+
+logger = logging.getLogger(__name__)
+
+# In multi-worker mode each process writes samples under this directory as
+# soon as the first metric below is created
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Seconds; generations take tens of seconds, DB writes and parsing milliseconds
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "mockcodes_stage_seconds",
+    "Time spent in each stage of a generation",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+
+PROVIDER_SECONDS = Histogram(
+    "mockcodes_provider_request_seconds",
+    "Provider call latency, from request to complete response",
+    ["provider", "model"],
+    buckets=STAGE_BUCKETS
+)
+
+PROVIDER_REQUESTS = Counter(
+    "mockcodes_provider_requests_total",
+    "Provider calls by outcome (success, error, rejected by an open circuit)",
+    ["provider", "model", "outcome"]
+)
+
+GENERATIONS = Counter(
+    "mockcodes_generations_total",
+    "Completed generations by the provider and model that served them",
+    ["provider", "model"]
+)
+
+TOKENS = Counter(
+    "mockcodes_tokens_total",
+    "Tokens billed per provider and model; kind is uncached, cache_read, cache_write or output",
+    ["provider", "model", "kind"]
+)
+
+COST_USD = Counter(
+    "mockcodes_cost_usd_total",
+    "Estimated spend from token usage and MODEL_PRICING",
+    ["provider", "model"]
+)
+
+PARSE_OUTCOMES = Counter(
+    "mockcodes_parse_outcomes_total",
+    "How model output was turned into code: json, fenced, repaired (salvaged from cut-off or malformed JSON), "
+    "code_blocks or failed",
+    ["provider", "outcome"]
+)
+
+CONTINUATIONS = Counter(
+    "mockcodes_continuations_total",
+    "Continuation requests sent after output hit the token limit; outcome is completed or truncated (still cut off)",
+    ["provider", "model", "outcome"]
+)
+
+EDITS = Counter(
+    "mockcodes_edits_total",
+    "Artifact edits by outcome: completed, invalid_patch (the model's patch did not apply) or failed",
+    ["outcome"]
+)
+
+# Summed over live worker processes when running under PROMETHEUS_MULTIPROC_DIR
+JOB_QUEUE_DEPTH = Gauge("mockcodes_job_queue_depth", "Jobs waiting for a worker", multiprocess_mode="livesum")
+JOB_QUEUE_PROCESSING = Gauge("mockcodes_job_queue_processing", "Jobs being generated", multiprocess_mode="livesum")
+
+
+def metrics_registry() -> CollectorRegistry:
+    """Registry to expose: this process, or every worker's files in multi-worker mode"""
+
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def mark_worker_dead() -> None:
+    """Drop this process's live gauges from the multi-worker totals"""
+
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+# USD per million tokens: (uncached input, cache read, cache write, output)
+DEFAULT_PRICING: Dict[str, Tuple[float, float, float, float]] = {
+    "gpt-4o": (2.50, 1.25, 2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.15, 0.60),
+    "claude-3-sonnet": (3.00, 0.30, 3.75, 15.00),
+    "claude-3-5-sonnet": (3.00, 0.30, 3.75, 15.00),
+    "claude-3-haiku": (0.25, 0.03, 0.30, 1.25)
+}
+
+
+def _load_pricing() -> Dict[str, Tuple[float, float, float, float]]:
+    """DEFAULT_PRICING, overridden per model by the MODEL_PRICING JSON object"""
+
+    pricing = dict(DEFAULT_PRICING)
+    raw = os.getenv("MODEL_PRICING")
+    if raw:
+        try:
+            pricing.update({model: tuple(prices) for model, prices in json.loads(raw).items()})
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Ignoring invalid MODEL_PRICING: {e}")
+    return pricing
+
+
+PRICING = _load_pricing()
+
+
+def _price(model: str) -> Tuple[float, float, float, float]:
+    # Longest matching prefix, so dated snapshots ("gpt-4o-2024-08-06") use their family price
+    matches = [name for name in PRICING if model.startswith(name)]
+    if not matches:
+        return (0.0, 0.0, 0.0, 0.0)
+    return PRICING[max(matches, key=len)]
+
+
+def record_tokens(provider: str, model: str, uncached: int, cache_read: int, cache_write: int, output: int) -> float:
+    """Count a request's tokens and add its estimated cost; returns the cost in USD"""
+
+    for kind, count in (("uncached", uncached), ("cache_read", cache_read), ("cache_write", cache_write), ("output", output)):
+        if count:
+            TOKENS.labels(provider, model, kind).inc(count)
+
+    prices = _price(model)
+    cost = sum(count * price for count, price in zip((uncached, cache_read, cache_write, output), prices)) / 1_000_000
+    COST_USD.labels(provider, model).inc(cost)
+    return cost
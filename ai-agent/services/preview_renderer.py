@@ -0,0 +1,415 @@
+import os
+import time
+import base64
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from string import Formatter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from services.metrics import STAGE_SECONDS
+from services.tracing import tracer
+from services.sanitizer import sanitize_css, sanitize_html_body, sanitize_javascript, splice_sanitized_body
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("queue_wait", "sanitize_html", "sanitize_css", "sanitize_js", "render", "encode")
+
+
+class PreviewTooLarge(ValueError):
+    """Raised when generated code exceeds the preview input size limit"""
+
+
+# Sanitized pieces of a preview, stored instead of the rendered document
+PREVIEW_FIELDS = ("preview_body", "preview_css", "preview_js")
+
+FRAME_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>MockCodes Preview</title>
+    <meta http-equiv="Content-Security-Policy" content="default-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com; script-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com; style-src 'self' 'unsafe-inline' https://cdn.tailwindcss.com;">
+    <script src="https://cdn.tailwindcss.com"></script>
+    <style>
+        /* Custom CSS */
+        {preview_css}
+        
+        /* Preview-specific styles */
+        body {{
+            margin: 0;
+            padding: 0;
+        }}
+        
+        /* Smooth animations */
+        * {{
+            transition: all 0.2s ease-in-out;
+        }}
+    </style>
+</head>
+<body>
+    {preview_body}
+    
+    <script>
+        // Custom JavaScript (sanitized)
+        {preview_js}
+        
+        // Preview enhancements
+        document.addEventListener('DOMContentLoaded', function() {{
+            console.log('MockCodes preview loaded');
+        }});
+    </script>
+</body>
+</html>"""
+
+WRAPPER_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>MockCodes Preview - Secure</title>
+    <meta http-equiv="Content-Security-Policy" content="default-src 'self'; frame-src {frame_source}; style-src 'self' 'unsafe-inline';">
+    <style>
+        body {{
+            margin: 0;
+            padding: 0;
+            font-family: system-ui, -apple-system, sans-serif;
+        }}
+        .preview-container {{
+            width: 100%;
+            height: 100vh;
+            border: none;
+        }}
+        .security-notice {{
+            background: #fef3c7;
+            color: #92400e;
+            padding: 8px 16px;
+            font-size: 12px;
+            text-align: center;
+            border-bottom: 1px solid #f59e0b;
+        }}
+    </style>
+</head>
+<body>
+    <div class="security-notice">
+        🔒 This preview is running in a secure sandboxed environment
+    </div>
+    <iframe 
+        class="preview-container"
+        src="{frame_src}"
+        sandbox="{sandbox}"
+        title="Secure Preview">
+    </iframe>
+</body>
+</html>"""
+
+
+def _compile_template(template: str) -> List[Tuple[str, Optional[str]]]:
+    """Split a template into (literal, field) pairs once, at import time"""
+
+    return [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+
+
+def _fill(compiled: List[Tuple[str, Optional[str]]], values: Dict[str, str]) -> str:
+    parts: List[str] = []
+    for literal, field in compiled:
+        parts.append(literal)
+        if field is not None:
+            parts.append(values[field])
+    return "".join(parts)
+
+
+_FRAME = _compile_template(FRAME_TEMPLATE)
+_WRAPPER = _compile_template(WRAPPER_TEMPLATE)
+
+
+def render_frame(parts: Dict[str, str]) -> str:
+    """The preview document itself, built from its sanitized parts"""
+
+    return _fill(_FRAME, {field: parts.get(field) or "" for field in PREVIEW_FIELDS})
+
+
+def render_wrapper(artifact_id: str) -> str:
+    """Secure wrapper page that loads the preview frame from /preview/{id}/frame"""
+
+    return _fill(_WRAPPER, {
+        "frame_source": "'self'",
+        "frame_src": f"/preview/{artifact_id}/frame",
+        # The frame is served from this origin, so it must not keep it
+        "sandbox": "allow-scripts allow-forms"
+    })
+
+
+def render_inline_wrapper(frame_html: str) -> str:
+    """Secure wrapper page with the preview frame inlined as a base64 data URL"""
+
+    # Encode the content as base64 for safe data URL
+    encoded_content = base64.b64encode(frame_html.encode('utf-8')).decode('utf-8')
+
+    return _fill(_WRAPPER, {
+        "frame_source": "data:",
+        "frame_src": f"data:text/html;base64,{encoded_content}",
+        "sandbox": "allow-scripts allow-same-origin allow-forms"
+    })
+
+
+def sanitize_preview(html: str, css: str, js: str) -> Dict[str, str]:
+    """Sanitized preview parts for compact storage"""
+
+    result, _ = _render_timed(html, css, js, time.time(), False)
+    return result
+
+
+def render_preview(html: str, css: str, js: str) -> str:
+    """Generate a secure sandboxed HTML preview"""
+
+    result, _ = _render_timed(html, css, js, time.time(), True)
+    return result["preview_html"]
+
+
+def _render_timed(
+    html: str,
+    css: str,
+    js: str,
+    submitted_at: float,
+    inline: bool
+) -> Tuple[Dict[str, str], Dict[str, float]]:
+    # Module-level so it can be pickled into a process pool; wall-clock time
+    # is used for the queue wait because it crosses the process boundary
+    timings = {"queue_wait": max(0.0, time.time() - submitted_at)}
+    result: Dict[str, str] = {}
+
+    # Sanitize all inputs first; the HTML pass also extracts the body content
+    started = time.perf_counter()
+    result["preview_body"] = sanitize_html_body(html)
+    timings["sanitize_html"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result["preview_css"] = sanitize_css(css)
+    timings["sanitize_css"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result["preview_js"] = sanitize_javascript(js)
+    timings["sanitize_js"] = time.perf_counter() - started
+
+    # Legacy storage keeps the whole rendered page with the frame inlined
+    if inline:
+        started = time.perf_counter()
+        frame_html = render_frame(result)
+        timings["render"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result["preview_html"] = render_inline_wrapper(frame_html)
+        timings["encode"] = time.perf_counter() - started
+
+    return result, timings
+
+
+def _patch_timed(
+    previous: Dict[str, Optional[str]],
+    source_html: str,
+    html: str,
+    css: str,
+    js: str,
+    html_edits: List[Tuple[int, str, str]],
+    changed: Sequence[str],
+    submitted_at: float
+) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, float]]:
+    # Starts from the previous version's sanitized parts: files the edit did
+    # not touch are reused, HTML edits are spliced in fragment by fragment
+    # when each can be sanitized on its own, and anything else is redone
+    timings = {"queue_wait": max(0.0, time.time() - submitted_at)}
+    result: Dict[str, str] = {}
+    modes: Dict[str, str] = {}
+
+    started = time.perf_counter()
+    body: Optional[str] = previous["preview_body"]
+    if "html" in changed:
+        current = source_html
+        for position, old, new in html_edits:
+            spliced = splice_sanitized_body(current, body, position, old, new)
+            if spliced is None:
+                body = None
+                break
+            current, body = spliced
+        modes["html"] = "fragment" if body is not None else "full"
+        if body is None:
+            body = sanitize_html_body(html)
+    else:
+        modes["html"] = "reused"
+    result["preview_body"] = body
+    timings["sanitize_html"] = time.perf_counter() - started
+
+    for field, content, sanitize in (("css", css, sanitize_css), ("js", js, sanitize_javascript)):
+        started = time.perf_counter()
+        if field in changed or previous.get(f"preview_{field}") is None:
+            result[f"preview_{field}"] = sanitize(content)
+            modes[field] = "full"
+        else:
+            result[f"preview_{field}"] = previous[f"preview_{field}"]
+            modes[field] = "reused"
+        timings[f"sanitize_{field}"] = time.perf_counter() - started
+
+    return result, modes, timings
+
+
+class PreviewRenderer:
+    """Sanitizes generated code and renders previews on a worker pool, off the event loop"""
+
+    def __init__(self):
+        self.max_input_bytes = int(os.getenv("PREVIEW_MAX_INPUT_BYTES", str(2 * 1024 * 1024)))
+        self.workers = int(os.getenv("PREVIEW_WORKERS", "2"))
+        self.executor_kind = os.getenv("PREVIEW_EXECUTOR", "process").lower()
+        self._executor: Executor = (
+            # Spawned, not forked: a fork of the running server would copy its event loop, threads and sockets
+            ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            if self.executor_kind == "process"
+            else ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="preview")
+        )
+
+        # "compact" stores the sanitized parts and renders at serve time;
+        # "inline" stores the whole page with a base64 data URL frame
+        self.storage = os.getenv("PREVIEW_STORAGE", "compact").lower()
+
+        self.in_flight = 0
+        self._stats = {"rendered": 0, "rejected": 0, "failed": 0}
+        self._timings = {stage: {"total": 0.0, "max": 0.0} for stage in STAGES + ("total",)}
+        # How each file of an edited artifact got its preview part
+        self._edit_modes = {"reused": 0, "fragment": 0, "full": 0}
+
+    async def warm_up(self) -> None:
+        """Start every pool process now, so the first previews do not pay for process start-up
+
+        The pool uses the spawn start method, which re-imports the preview
+        modules in each pool process.
+        """
+
+        if self.executor_kind != "process":
+            return
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, time.sleep, 0.1) for _ in range(self.workers)))
+        logger.info(f"Preview pool of {self.workers} processes ready in {time.perf_counter() - started:.2f}s")
+
+    def _check_size(self, html: str, css: str, js: str) -> int:
+        size = sum(len(part.encode("utf-8")) for part in (html or "", css or "", js or ""))
+        if size > self.max_input_bytes:
+            self._stats["rejected"] += 1
+            raise PreviewTooLarge(
+                f"Generated code is {size} bytes, above the {self.max_input_bytes} byte preview limit"
+            )
+        return size
+
+    def _record(self, timings: Dict[str, float]) -> None:
+        self._stats["rendered"] += 1
+        for stage, seconds in timings.items():
+            self._timings[stage]["total"] += seconds
+            self._timings[stage]["max"] = max(self._timings[stage]["max"], seconds)
+        STAGE_SECONDS.labels("sanitize").observe(
+            timings["sanitize_html"] + timings["sanitize_css"] + timings["sanitize_js"]
+        )
+
+    async def render(self, html: str, css: str, js: str) -> Dict[str, Optional[str]]:
+        """Sanitize generated code and return the preview columns to store for it"""
+
+        size = self._check_size(html, css, js)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            with tracer.start_as_current_span("preview.sanitize") as span:
+                span.set_attribute("input.bytes", size)
+                span.set_attribute("preview.storage", self.storage)
+                result, timings = await loop.run_in_executor(
+                    self._executor, _render_timed, html, css, js, time.time(), self.storage == "inline"
+                )
+                # Stages ran in a worker, so they are attached as timings rather than child spans
+                span.set_attributes({f"stage.{stage}_seconds": seconds for stage, seconds in timings.items()})
+        except Exception:
+            self._stats["failed"] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+        timings["total"] = time.perf_counter() - started
+        self._record(timings)
+
+        if self.storage == "inline":
+            return {"preview_html": result["preview_html"]}
+        return {**{field: result[field] for field in PREVIEW_FIELDS}, "preview_html": None}
+
+    async def render_edit(
+        self,
+        previous: Dict[str, Any],
+        source_html: str,
+        html: str,
+        css: str,
+        js: str,
+        html_edits: List[Tuple[int, str, str]],
+        changed: Sequence[str]
+    ) -> Tuple[Dict[str, Optional[str]], Dict[str, str]]:
+        """Preview columns for an edited copy of an artifact, re-sanitizing only what the edit changed
+
+        ``previous`` holds the stored preview columns of the edited version and
+        ``html_edits`` the (position, old, new) replacements made to its HTML,
+        ``source_html``. Also returns, per file, whether its preview part was
+        reused, patched fragment by fragment or sanitized in full.
+        """
+
+        if self.storage == "inline" or previous.get("preview_body") is None:
+            # Inline previews, and rows stored before compact previews, have no parts to patch
+            columns = await self.render(html, css, js)
+            modes = {"html": "full", "css": "full", "js": "full"}
+        else:
+            size = self._check_size(html, css, js)
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            self.in_flight += 1
+            try:
+                with tracer.start_as_current_span("preview.sanitize_edit") as span:
+                    span.set_attribute("input.bytes", size)
+                    result, modes, timings = await loop.run_in_executor(
+                        self._executor, _patch_timed, previous, source_html, html, css, js,
+                        html_edits, list(changed), time.time()
+                    )
+                    span.set_attributes({f"sanitize.{field}": mode for field, mode in modes.items()})
+                    span.set_attributes({f"stage.{stage}_seconds": seconds for stage, seconds in timings.items()})
+            except Exception:
+                self._stats["failed"] += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+            timings["total"] = time.perf_counter() - started
+            self._record(timings)
+            columns = {**{field: result[field] for field in PREVIEW_FIELDS}, "preview_html": None}
+
+        for mode in modes.values():
+            self._edit_modes[mode] += 1
+        return columns, modes
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and average/max seconds per stage"""
+
+        rendered = self._stats["rendered"]
+        return {
+            "storage": self.storage,
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": max(0, self.in_flight - self.workers),
+            "max_input_bytes": self.max_input_bytes,
+            **self._stats,
+            "edit_sanitize": dict(self._edit_modes),
+            "stages": {
+                stage: {
+                    "avg_seconds": timing["total"] / rendered if rendered else 0.0,
+                    "max_seconds": timing["max"]
+                }
+                for stage, timing in self._timings.items()
+            }
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
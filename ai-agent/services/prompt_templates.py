@@ -0,0 +1,116 @@
+import hashlib
+from dataclasses import dataclass
+from string import Template
+from typing import Dict, Iterable
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """A named, versioned prompt; ``$name`` placeholders are filled by render()"""
+
+    name: str
+    version: str
+    text: str
+
+    def render(self, **values: str) -> str:
+        if not values:
+            return self.text
+        return Template(self.text).substitute(values)
+
+
+class PromptRegistry:
+    """Prompt templates loaded once at import and shared by every request
+
+    Static system prompts are returned as the same string object on each
+    call, so the bytes sent ahead of the per-request content are identical
+    and provider-side prefix caches can match them. ``fingerprint`` changes
+    whenever any template version does, which invalidates cached
+    generations made with older prompts.
+    """
+
+    def __init__(self, templates: Iterable[PromptTemplate]):
+        self._templates: Dict[str, PromptTemplate] = {}
+        for template in templates:
+            self.register(template)
+
+    def register(self, template: PromptTemplate) -> None:
+        self._templates[template.name] = template
+        self.fingerprint = hashlib.sha256(
+            "\n".join(f"{name}@{t.version}" for name, t in sorted(self._templates.items())).encode("utf-8")
+        ).hexdigest()[:12]
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def render(self, name: str, **values: str) -> str:
+        return self._templates[name].render(**values)
+
+    def versions(self) -> Dict[str, str]:
+        return {name: template.version for name, template in self._templates.items()}
+
+
+OPENAI_SYSTEM = PromptTemplate("openai_system", "1", """You are an expert frontend developer specializing in creating pixel-perfect HTML, CSS, and JavaScript implementations from design prompts.
+
+Your task is to generate clean, modern, and responsive code using:
+- Semantic HTML5
+- Tailwind CSS for styling (CDN version)
+- Vanilla JavaScript for interactivity
+- Modern web standards and best practices
+
+Requirements:
+1. Create a complete, self-contained HTML page
+2. Use Tailwind CSS classes for all styling
+3. Ensure responsive design (mobile-first approach)
+4. Add smooth animations and hover effects
+5. Include proper accessibility attributes
+6. Use modern JavaScript (ES6+)
+7. Ensure cross-browser compatibility
+
+Return your response as a JSON object with this exact structure:
+{
+  "html": "complete HTML document",
+  "css": "additional custom CSS if needed (prefer Tailwind)",
+  "js": "JavaScript for interactivity"
+}
+
+Make the code production-ready and visually appealing.""")
+
+ANTHROPIC_SYSTEM = PromptTemplate("anthropic_system", "1", """You are an expert frontend developer. Generate clean, modern HTML, CSS, and JavaScript code based on the user's prompt.
+
+Use Tailwind CSS for styling and create responsive, accessible designs.
+
+Return your response as JSON with keys: html, css, js""")
+
+USER_PROMPT = PromptTemplate("user_prompt", "1", "Create a website based on this prompt: $prompt")
+
+USER_IMAGE_PROMPT = PromptTemplate("user_image_prompt", "1", "Create a website that matches this design: $prompt")
+
+# Sent after a reply that hit the output token limit, with the partial reply as the assistant turn
+CONTINUATION_PROMPT = PromptTemplate("continuation", "1", """Your previous reply was cut off by the output limit. Continue it from the exact character where it stopped.
+Do not repeat anything already written, do not start a new JSON object and do not add commentary or code fences.""")
+
+PROMPTS = PromptRegistry([OPENAI_SYSTEM, ANTHROPIC_SYSTEM, USER_PROMPT, USER_IMAGE_PROMPT, CONTINUATION_PROMPT])
+
+EDIT_SYSTEM = PromptTemplate("edit_system", "1", """You are an expert frontend developer editing an existing web page built with HTML, Tailwind CSS and vanilla JavaScript.
+
+You are given an instruction and excerpts of the page's files. Make only the change the instruction asks for, keeping the existing structure, Tailwind classes and behaviour everywhere else.
+
+Return your response as a JSON object with this exact structure:
+{
+  "edits": [
+    {"file": "html" | "css" | "js", "find": "exact text to replace", "replace": "new text"}
+  ]
+}
+
+Rules:
+1. "find" must be copied character for character from one excerpt and be long enough to occur only once in that file
+2. Keep each edit as small as possible; never return whole files
+3. Edits are applied in order, each to the result of the previous ones
+4. To add new CSS rules or JavaScript, use an empty "find" and they are appended to the end of that file""")
+
+EDIT_USER = PromptTemplate("edit_user", "1", """Instruction: $instruction
+
+$excerpts""")
+
+# Kept apart from PROMPTS so edit prompt changes do not invalidate cached generations
+EDIT_PROMPTS = PromptRegistry([EDIT_SYSTEM, EDIT_USER])
@@ -0,0 +1,339 @@
+import re
+import copy
+from html import escape
+from html.parser import HTMLParser
+from typing import Any, List, Optional, Tuple
+
+# Elements dropped together with everything inside them
+DANGEROUS_TAGS = frozenset(["script", "object", "embed", "applet", "meta", "link"])
+
+# Elements that never have content or an end tag
+VOID_TAGS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link",
+    "meta", "param", "source", "track", "wbr"
+])
+
+# Attributes holding URLs, with the schemes each may not use
+URL_ATTRS = {
+    "href": ("javascript:", "data:", "vbscript:"),
+    "xlink:href": ("javascript:", "data:", "vbscript:"),
+    "action": ("javascript:", "data:", "vbscript:"),
+    "formaction": ("javascript:", "data:", "vbscript:"),
+    "src": ("javascript:", "vbscript:")
+}
+
+# Browsers ignore whitespace and control characters inside a URL scheme
+_URL_IGNORED = re.compile(r"[\x00-\x20\x7f]+")
+
+CSS_BLOCKED_PATTERNS = (
+    "javascript:",
+    "expression(",
+    "behavior:",
+    "binding:",
+    "-moz-binding:",
+    "data:",
+    "vbscript:",
+    "@import"
+)
+
+JS_BLOCKED_PATTERNS = (
+    "eval(",
+    "Function(",
+    "setTimeout(",
+    "setInterval(",
+    "document.write(",
+    "document.writeln(",
+    "innerHTML",
+    "outerHTML",
+    "document.cookie",
+    "localStorage",
+    "sessionStorage",
+    "window.location",
+    "location.href",
+    "location.replace",
+    "location.assign"
+)
+
+
+def sanitize_css(css_content: str) -> str:
+    """Sanitize CSS content to prevent XSS"""
+    if not css_content:
+        return ""
+
+    # Escape the CSS content to prevent injection
+    sanitized = escape(css_content, quote=False)
+
+    # str.replace runs in C and outpaces a combined regex here; repeat until
+    # stable because a removal can join its neighbours into a new pattern
+    # ("javajavascript:script:")
+    previous = None
+    while previous != sanitized:
+        previous = sanitized
+        for pattern in CSS_BLOCKED_PATTERNS:
+            sanitized = sanitized.replace(pattern, '')
+
+    return sanitized
+
+
+def sanitize_javascript(js_content: str) -> str:
+    """Sanitize JavaScript content to prevent XSS"""
+    if not js_content:
+        return ""
+
+    # Basic sanitization - escape dangerous characters
+    sanitized = escape(js_content, quote=False)
+
+    # Note: This is basic sanitization. For production, consider using a proper JS sanitizer
+    # or running JS in a more restricted environment
+    for pattern in JS_BLOCKED_PATTERNS:
+        sanitized = sanitized.replace(pattern, f'/* BLOCKED: {pattern} */')
+
+    return sanitized
+
+
+class HTMLSanitizer(HTMLParser):
+    """Streaming HTML sanitizer
+
+    Tokenizes the input once, dropping dangerous elements with their
+    content, comments, event handler attributes and script URLs as it
+    goes. Unmatched end tags are ignored and elements left open are closed
+    at the end. The position of the first <body> element is recorded on the
+    way so its content can be returned without a second scan.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self._out: List[str] = []
+        self._open: List[str] = []
+        self._skip_tag: Optional[str] = None
+        self._skip_depth = 0
+        self._raw_text = 0
+        self._body_start: Optional[int] = None
+        self._body_end: Optional[int] = None
+
+    def sanitize(self, html_content: str) -> Tuple[str, str]:
+        """Return the sanitized document and the content of its body"""
+
+        self.feed(html_content)
+        self.close()
+
+        while self._open:
+            self._close_top()
+
+        document = "".join(self._out)
+        if self._body_start is not None and self._body_end is not None:
+            return document, "".join(self._out[self._body_start:self._body_end]).strip()
+        return document, document
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skipping(tag, opening=True):
+            return
+
+        self._out.append(self._format_tag(tag, attrs, ">"))
+        if tag in VOID_TAGS:
+            return
+
+        self._open.append(tag)
+        if tag == "style":
+            self._raw_text += 1
+        if tag == "body" and self._body_start is None:
+            self._body_start = len(self._out)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skip_tag is not None or tag in DANGEROUS_TAGS:
+            return
+        self._out.append(self._format_tag(tag, attrs, "/>"))
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skipping(tag, opening=False):
+            return
+
+        # Close anything left open inside this element; stray end tags are dropped
+        if tag not in self._open:
+            return
+        while self._open[-1] != tag:
+            self._close_top()
+        self._close_top()
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_tag is not None:
+            return
+        if self._raw_text:
+            self._out.append(data)
+        else:
+            self._out.append(data.replace("<", "&lt;").replace(">", "&gt;"))
+
+    def handle_entityref(self, name: str) -> None:
+        if self._skip_tag is None:
+            self._out.append(f"&{name};")
+
+    def handle_charref(self, name: str) -> None:
+        if self._skip_tag is None:
+            self._out.append(f"&#{name};")
+
+    def handle_decl(self, decl: str) -> None:
+        if self._skip_tag is None:
+            self._out.append(f"<!{decl}>")
+
+    def unknown_decl(self, data: str) -> None:
+        if self._skip_tag is None:
+            self._out.append(f"<![{data}]>")
+
+    def handle_comment(self, data: str) -> None:
+        # Comments might contain malicious code (conditional comments)
+        pass
+
+    def handle_pi(self, data: str) -> None:
+        pass
+
+    def _skipping(self, tag: str, opening: bool) -> bool:
+        """Track dangerous subtrees; True while the current token is inside one"""
+
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth += 1 if opening else -1
+                if self._skip_depth == 0:
+                    self._skip_tag = None
+            return True
+
+        if tag in DANGEROUS_TAGS:
+            if opening and tag not in VOID_TAGS:
+                self._skip_tag = tag
+                self._skip_depth = 1
+            return True
+
+        return False
+
+    def _close_top(self) -> None:
+        tag = self._open.pop()
+        if tag == "style":
+            self._raw_text -= 1
+        if tag == "body" and self._body_end is None and self._body_start is not None:
+            self._body_end = len(self._out)
+        self._out.append(f"</{tag}>")
+
+    def _format_tag(self, tag: str, attrs: List[Tuple[str, Optional[str]]], end: str) -> str:
+        parts = [f"<{tag}"]
+        for name, value in attrs:
+            # Event handlers (onclick, onload, ...) are never kept
+            if name.startswith("on"):
+                continue
+            if value is None:
+                parts.append(f" {name}")
+                continue
+            blocked = URL_ATTRS.get(name)
+            if blocked and _URL_IGNORED.sub("", value).lower().startswith(blocked):
+                continue
+            parts.append(f' {name}="{escape(value)}"')
+        parts.append(end)
+        return "".join(parts)
+
+
+def sanitize_html(html_content: str) -> str:
+    """Sanitize HTML content to prevent XSS"""
+    if not html_content:
+        return ""
+
+    document, _ = HTMLSanitizer().sanitize(html_content)
+    return document
+
+
+def sanitize_html_body(html_content: str) -> str:
+    """Sanitize HTML and return the content of its body, or the whole fragment if it has none"""
+    if not html_content:
+        return ""
+
+    _, body = HTMLSanitizer().sanitize(html_content)
+    return body
+
+
+def _fork(sanitizer: HTMLSanitizer) -> HTMLSanitizer:
+    """Copy of a sanitizer's parse state with an empty output, to continue it with different input"""
+
+    forked = copy.copy(sanitizer)
+    forked._out = []
+    forked._open = list(sanitizer._open)
+    return forked
+
+
+def _parse_state(sanitizer: HTMLSanitizer) -> Tuple[Any, ...]:
+    """Everything that decides how the sanitizer handles the input still to come"""
+
+    return (
+        tuple(sanitizer._open), sanitizer._skip_tag, sanitizer._skip_depth, sanitizer._raw_text,
+        sanitizer._body_start, sanitizer._body_end, sanitizer.cdata_elem, sanitizer.rawdata
+    )
+
+
+def splice_sanitized_body(html_content: str, body: str, pos: int, old: str, new: str) -> Optional[Tuple[str, str]]:
+    """Apply one find/replace edit to raw HTML and to its sanitized body, without re-sanitizing what follows it
+
+    ``old`` is the text at ``pos`` in ``html_content`` and ``body`` is
+    ``sanitize_html_body(html_content)``. The span is widened to whole tags
+    and words and the sanitizer is run up to it, then over the old and the
+    new span. If both leave the sanitizer in the same state, everything
+    after the span sanitizes the same either way, so the new span's output
+    is swapped in at the old one's offset. Returns the edited HTML and body,
+    equal to sanitizing the edited HTML in full, or None when the span
+    cannot be swapped and the caller must sanitize the whole page.
+    """
+
+    if not old:
+        return None
+    end = pos + len(old)
+
+    # Widen the span to whole tags (an attribute change) and whole words of text
+    left = pos
+    if html_content.rfind("<", 0, pos) > html_content.rfind(">", 0, pos):
+        left = html_content.rfind("<", 0, pos)
+    else:
+        while left > 0 and not html_content[left - 1].isspace() and html_content[left - 1] != ">":
+            left -= 1
+    right = end
+    if html_content.rfind("<", 0, end) > html_content.rfind(">", 0, end):
+        right = html_content.find(">", end) + 1
+        if right == 0:
+            return None
+    else:
+        while right < len(html_content) and not html_content[right].isspace() and html_content[right] != "<":
+            right += 1
+
+    old_fragment = html_content[left:right]
+    new_fragment = html_content[left:pos] + new + html_content[end:right]
+    # Where an entity reference ends depends on the text after it, which the
+    # fragment parse does not see
+    if "&" in old_fragment or "&" in new_fragment:
+        return None
+
+    before = HTMLSanitizer()
+    before.feed(html_content[:left])
+    # Stopped inside a comment, a script or style, or an unfinished tag
+    if before.rawdata:
+        return None
+
+    replaced, replacement = _fork(before), _fork(before)
+    replaced.feed(old_fragment)
+    replacement.feed(new_fragment)
+    if replaced.rawdata or _parse_state(replaced) != _parse_state(replacement):
+        return None
+    # The span must not open or close the body
+    if (replaced._body_start, replaced._body_end) != (before._body_start, before._body_end):
+        return None
+
+    # sanitize_html_body strips the body when the page has one and returns the
+    # whole document otherwise; a span before a <body> further down is refused
+    has_body = before._body_start is not None
+    if before._body_end is not None or (not has_body and re.search(r"<body", html_content, re.I)):
+        return None
+    prefix = "".join(before._out[before._body_start or 0:])
+    if has_body and not prefix.strip():
+        return None
+    offset = len(prefix.lstrip()) if has_body else len(prefix)
+    old_sanitized = "".join(replaced._out)
+    new_sanitized = "".join(replacement._out)
+    if offset + len(old_sanitized) > len(body) or body[offset:offset + len(old_sanitized)] != old_sanitized:
+        return None
+
+    edited_html = html_content[:pos] + new + html_content[end:]
+    edited_body = body[:offset] + new_sanitized + body[offset + len(old_sanitized):]
+    return edited_html, edited_body.strip() if has_body else edited_body
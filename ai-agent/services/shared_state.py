@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class MemoryStateBackend:
+    """Per-process backend; enough when the agent runs a single worker"""
+
+    # Called directly on the event loop, which also serialises access
+    blocking = False
+
+    def __init__(self, max_entries: int):
+        self._values = LRUCache(max_entries=max_entries)
+
+    def get(self, key: str) -> Optional[str]:
+        return self._values.get(key)
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float]) -> None:
+        self._values.set(key, value, ttl_seconds=ttl_seconds)
+
+    def delete(self, key: str) -> None:
+        self._values.invalidate(key)
+
+    def incr(self, key: str, delta: int, ttl_seconds: Optional[float]) -> int:
+        value = int(self._values.get(key) or 0) + delta
+        self._values.set(key, str(value), ttl_seconds=ttl_seconds)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self._values.stats()}
+
+
+class SQLiteStateBackend:
+    """Host-local backend in a WAL-mode SQLite file, shared by every worker process"""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float]) -> None:
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def incr(self, key: str, delta: int, ttl_seconds: Optional[float]) -> int:
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds else None
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so concurrent
+            # workers cannot read the same old value
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (key, now)
+                ).fetchone()
+                value = int(row[0] if row else 0) + delta
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, str(value), expires_at)
+                )
+                # Expired rows are swept as a side effect of writes
+                self._conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (now,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM shared_state").fetchone()[0]
+        return {"backend": "sqlite", "path": self.path, "entries": entries}
+
+
+class SharedState:
+    """Key/value state visible to every worker: job status, counters and small cached lookups
+
+    Values are JSON-encoded. Calls to a blocking backend run in a thread
+    so SQLite I/O stays off the event loop.
+    """
+
+    def __init__(self, backend: Any):
+        self.backend = backend
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls) -> "SharedState":
+        """Build the store selected by STATE_BACKEND (memory or sqlite)"""
+
+        kind = os.getenv("STATE_BACKEND", "memory").lower()
+        if kind == "sqlite":
+            backend: Any = SQLiteStateBackend(os.getenv("STATE_PATH", "/app/temp/shared_state.sqlite3"))
+        else:
+            backend = MemoryStateBackend(int(os.getenv("STATE_MAX_ENTRIES", "100000")))
+
+        logger.info(f"Shared state backend: {kind}")
+        return cls(backend)
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            value = await self._call(self.backend.get, key)
+        except Exception as e:
+            # Shared state is an optimisation; callers fall back to the database
+            self.errors += 1
+            logger.warning(f"Shared state read failed for {key}: {e}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        try:
+            await self._call(self.backend.set, key, json.dumps(value), ttl_seconds)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared state write failed for {key}: {e}")
+
+    async def delete(self, key: str) -> None:
+        try:
+            await self._call(self.backend.delete, key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Shared state delete failed for {key}: {e}")
+
+    async def incr(self, key: str, delta: int = 1, ttl_seconds: Optional[float] = None) -> int:
+        """Atomically add ``delta`` to a counter and return the new value"""
+
+        return await self._call(self.backend.incr, key, delta, ttl_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.backend.stats(), "errors": self.errors}
+
+    async def _call(self, method: Callable[..., T], *args: Any) -> T:
+        if self.backend.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
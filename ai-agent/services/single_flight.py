@@ -0,0 +1,52 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one in-flight task
+
+    The shared work runs in its own task, and each caller awaits it through
+    ``asyncio.shield``: a caller that disconnects is cancelled on its own
+    without cancelling the work the other callers are waiting for. Errors
+    raised by the work are re-raised to every caller.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """Run ``factory()`` once per key, sharing its outcome with concurrent callers"""
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            logger.info(f"Joining in-flight generation {key[:12]}")
+
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+        # Mark the error as retrieved even if every caller went away
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Shared generation {key[:12]} failed: {task.exception()}")
@@ -0,0 +1,97 @@
+import os
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from opentelemetry import trace
+from opentelemetry.propagate import extract
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# Spans are no-ops until setup_tracing() installs a provider
+tracer = trace.get_tracer("mockcodes.ai_agent")
+
+
+def setup_tracing() -> Optional[TracerProvider]:
+    """Install a tracer provider for TRACING_EXPORTER (none, console or file)
+
+    Both exporters work offline: "console" prints each span as JSON to
+    stdout, "file" appends one JSON span per line to TRACING_FILE.
+    Sampling follows the standard OTEL_TRACES_SAMPLER variables.
+    """
+
+    exporter_kind = os.getenv("TRACING_EXPORTER", "none").lower()
+    if exporter_kind == "none":
+        return None
+
+    if exporter_kind == "file":
+        path = os.getenv("TRACING_FILE", "/app/logs/traces.jsonl")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        exporter = ConsoleSpanExporter(
+            out=open(path, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n"
+        )
+    else:
+        exporter = ConsoleSpanExporter()
+
+    provider = TracerProvider(resource=Resource.create({"service.name": "mockcodes-ai-agent"}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+    logger.info(f"Tracing enabled ({exporter_kind})")
+    return provider
+
+
+def _route_path(scope: Dict[str, Any]) -> str:
+    """Route template ("/jobs/{job_id}") for span names, so ids do not explode cardinality"""
+
+    for route in getattr(scope.get("app"), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return scope["path"]
+
+
+class TracingMiddleware:
+    """Opens a server span per HTTP request, continuing the caller's W3C traceparent
+
+    Plain ASGI rather than BaseHTTPMiddleware so the span stays open until
+    a streamed (SSE) response has sent its last byte.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        method = scope["method"]
+        route = _route_path(scope)
+
+        with tracer.start_as_current_span(f"{method} {route}", context=extract(headers), kind=SpanKind.SERVER) as span:
+            span.set_attribute("http.method", method)
+            span.set_attribute("http.route", route)
+            if "content-length" in headers:
+                span.set_attribute("http.request_content_length", int(headers["content-length"]))
+            sent = {"bytes": 0}
+
+            async def send_with_span(message: Dict[str, Any]) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                elif message["type"] == "http.response.body":
+                    sent["bytes"] += len(message.get("body", b""))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_span)
+            finally:
+                span.set_attribute("http.response_content_length", sent["bytes"])
@@ -0,0 +1,81 @@
+import os
+import sys
+
+# Run against the services package the way main.py does, without a .env or external services
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("PREVIEW_EXECUTOR", "thread")
+os.environ.setdefault("LOG_FILE", "")
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+import json
+from typing import Any, Dict, List
+
+import httpx
+import pytest
+
+
+class FakeSupabase:
+    """In-memory /rest/v1/artifacts for an ArtifactManager, counting the requests it serves"""
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self.requests: List[httpx.Request] = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        params = dict(request.url.params)
+        matches = [
+            row for row in self.rows
+            if all(str(row.get(key)) == value[3:] for key, value in params.items() if value.startswith("eq."))
+        ]
+        if request.method == "GET":
+            select = params.get("select", "*")
+            if select != "*":
+                matches = [{column: row.get(column) for column in select.split(",")} for row in matches]
+            return httpx.Response(200, json=matches)
+        if request.method == "POST":
+            body = json.loads(request.content)
+            self.rows.extend(body if isinstance(body, list) else [body])
+            return httpx.Response(201)
+        # Like PostgREST, writes only answer with a body when asked to
+        representation = "return=representation" in request.headers.get("prefer", "")
+        if request.method == "PATCH":
+            for row in matches:
+                row.update(json.loads(request.content))
+            return httpx.Response(200, json=matches) if representation else httpx.Response(204)
+        if request.method == "DELETE":
+            self.rows = [row for row in self.rows if row not in matches]
+            return httpx.Response(200, json=matches) if representation else httpx.Response(204)
+        return httpx.Response(405)
+
+
+@pytest.fixture
+def supabase() -> FakeSupabase:
+    return FakeSupabase()
+
+
+@pytest.fixture
+def make_artifact_manager(supabase: FakeSupabase):
+    """ArtifactManagers backed by the same fake database, like workers of one deployment"""
+
+    from services.artifact_manager import ArtifactManager
+
+    managers = []
+
+    def make(state=None):
+        manager = ArtifactManager(state)
+        manager._client = httpx.AsyncClient(base_url="http://supabase.test", transport=httpx.MockTransport(supabase.handler))
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.preview_renderer.shutdown()
+
+
+@pytest.fixture
+def artifact_manager(make_artifact_manager):
+    return make_artifact_manager()
@@ -0,0 +1,98 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from services.code_generator import CodeGenerator
+
+CODE = {"html": "<h1>Hi</h1>", "css": "h1 { color: red; }", "js": ""}
+
+
+class FakeCompletions:
+    """chat.completions for scripted replies: (content, finish_reason) pairs, streamed or not"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    async def create(self, stream=False, **kwargs):
+        self.calls += 1
+        content, finish_reason = self.replies.pop(0)
+        if not stream:
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)],
+                usage=None
+            )
+
+        async def chunks():
+            yield SimpleNamespace(
+                usage=None,
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=content), finish_reason=finish_reason)]
+            )
+        return chunks()
+
+
+def make_generator(monkeypatch, replies, continuations=0):
+    monkeypatch.setenv("GENERATION_CACHE_BACKEND", "memory")
+    monkeypatch.setenv("GENERATION_MAX_CONTINUATIONS", str(continuations))
+    generator = CodeGenerator()
+    completions = FakeCompletions(replies)
+    generator._openai_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return generator, completions
+
+
+def generate_twice(generator, streamed):
+    async def run():
+        results = []
+        for _ in range(2):
+            if streamed:
+                events = [event async for event in generator.stream_from_prompt("a landing page")]
+                results.append(events[-1]["code"])
+            else:
+                results.append(await generator.generate_from_prompt("a landing page"))
+        return results
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_clean_generation_is_cached(monkeypatch, streamed):
+    generator, completions = make_generator(monkeypatch, [(json.dumps(CODE), "stop")])
+
+    first, second = generate_twice(generator, streamed)
+
+    assert first == second == CODE
+    assert completions.calls == 1
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_cut_off_generation_is_not_cached(monkeypatch, streamed):
+    cut_off = json.dumps(CODE)[:-20]
+    generator, completions = make_generator(monkeypatch, [(cut_off, "length"), (cut_off, "length")])
+
+    first, second = generate_twice(generator, streamed)
+
+    assert first["html"] == CODE["html"]
+    assert completions.calls == 2
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_repaired_generation_is_not_cached(monkeypatch, streamed):
+    malformed = json.dumps(CODE)[:-20] + "\n```"
+    generator, completions = make_generator(monkeypatch, [(malformed, "stop"), (malformed, "stop")])
+
+    first, _ = generate_twice(generator, streamed)
+
+    assert first["html"] == CODE["html"]
+    assert completions.calls == 2
+
+
+def test_generation_completed_by_continuation_is_cached(monkeypatch):
+    content = json.dumps(CODE)
+    generator, completions = make_generator(monkeypatch, [(content[:30], "length"), (content[30:], "stop")], continuations=1)
+
+    first, second = generate_twice(generator, streamed=False)
+
+    assert first == second == CODE
+    assert completions.calls == 2
@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.job_queue import JobQueue
+from services.shared_state import MemoryStateBackend, SharedState
+
+CODE = {"html": "<h1>Hi</h1>", "css": "", "js": ""}
+
+
+async def generate_from_prompt(prompt, **kwargs):
+    if prompt == "broken":
+        raise RuntimeError("provider failed")
+    return dict(CODE)
+
+
+def run_job(artifact_manager, prompt):
+    async def run():
+        queue = JobQueue(
+            SimpleNamespace(generate_from_prompt=generate_from_prompt),
+            artifact_manager,
+            SharedState(MemoryStateBackend(100))
+        )
+        await queue.start()
+        job = await queue.submit("p1", prompt, user_id="u1")
+        await asyncio.wait_for(queue._queue.join(), timeout=5)
+        await queue.stop()
+        return job
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("prompt, status", [("a landing page", "completed"), ("broken", "failed")])
+def test_job_outcome_is_stored_on_the_artifact(artifact_manager, supabase, prompt, status):
+    job = run_job(artifact_manager, prompt)
+
+    assert job.status == status
+    assert [row["status"] for row in supabase.rows if row["id"] == job.id] == [status]
+
+
+def make_queue(artifact_manager, monkeypatch):
+    monkeypatch.setenv("SCAFFOLD_GLOBAL_MAX_ACTIVE", "4")
+    return JobQueue(
+        SimpleNamespace(generate_from_prompt=generate_from_prompt),
+        artifact_manager,
+        SharedState(MemoryStateBackend(100))
+    )
+
+
+def test_failed_status_write_and_publish_do_not_leak_the_slot(artifact_manager, monkeypatch):
+    queue = make_queue(artifact_manager, monkeypatch)
+    update_artifact_status = artifact_manager.update_artifact_status
+
+    async def update_failing(artifact_id, status, fields=None):
+        if status == "failed":
+            raise RuntimeError("database unavailable")
+        await update_artifact_status(artifact_id, status, fields)
+
+    async def publish_failing(job):
+        if job.finished_at is not None:
+            raise RuntimeError("shared state unavailable")
+
+    monkeypatch.setattr(artifact_manager, "update_artifact_status", update_failing)
+    monkeypatch.setattr(queue, "_publish", publish_failing)
+
+    async def run():
+        await queue.start()
+        job = await queue.submit("p1", "broken", user_id="u1")
+        await asyncio.wait_for(queue._queue.join(), timeout=5)
+        await queue.stop()
+        return job, await queue.state.get("jobs:active")
+
+    job, active = asyncio.run(run())
+
+    assert job.status == "failed"
+    assert active == 0
+
+
+def test_stop_marks_every_leftover_job_failed(artifact_manager, supabase, monkeypatch):
+    queue = make_queue(artifact_manager, monkeypatch)
+    update_artifact_status = artifact_manager.update_artifact_status
+    unlucky = []
+
+    async def update_failing(artifact_id, status, fields=None):
+        if artifact_id == unlucky[0]:
+            raise RuntimeError("database unavailable")
+        await update_artifact_status(artifact_id, status, fields)
+
+    async def run():
+        # Never started, so every job is still queued at shutdown
+        jobs = [await queue.submit("p1", f"page {i}", user_id="u1") for i in range(3)]
+        unlucky.append(jobs[0].id)
+        monkeypatch.setattr(artifact_manager, "update_artifact_status", update_failing)
+        await queue.stop()
+        return jobs, await queue.state.get("jobs:active")
+
+    jobs, active = asyncio.run(run())
+
+    assert all(job.status == "failed" for job in jobs)
+    stored = {row["id"]: row["status"] for row in supabase.rows}
+    assert [stored[job.id] for job in jobs] == ["pending", "failed", "failed"]
+    assert active == 0
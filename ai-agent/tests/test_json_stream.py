@@ -0,0 +1,79 @@
+import json
+import random
+
+import pytest
+
+from services.json_stream import IncrementalJSONParser, join_continuation, salvage_fields
+
+CODE = {
+    "html": '<div class="hero">Caf\u00e9 \U0001f680 "quoted" \\ back\\slash</div>\n<p>line\ttab</p>',
+    "css": ".hero { content: \"\\2014\"; }",
+    "js": "console.log('}{', \"]\");"
+}
+
+
+def feed_in_chunks(parser, content, rng):
+    deltas = []
+    i = 0
+    while i < len(content):
+        size = rng.randint(1, 7)
+        deltas.extend(parser.feed(content[i:i + size]))
+        i += size
+    return deltas
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_parser_matches_json_loads_for_any_chunking(seed, ensure_ascii):
+    content = "```json\n" + json.dumps({"meta": {"nested": ["}", {"a": "\""}]}, **CODE}, ensure_ascii=ensure_ascii)
+    parser = IncrementalJSONParser()
+
+    deltas = feed_in_chunks(parser, content, random.Random(seed))
+
+    assert parser.done
+    assert parser.result() == CODE
+    assert parser.completed == set(CODE)
+    for field in CODE:
+        assert "".join(text for key, text in deltas if key == field) == CODE[field]
+
+
+def test_parser_ignores_other_fields_and_text_after_the_object():
+    parser = IncrementalJSONParser()
+
+    parser.feed('{"title": "x", "html": "<p>a</p>", "count": 3} trailing {"html": "no"}')
+
+    assert parser.done
+    assert parser.result() == {"html": "<p>a</p>"}
+
+
+def test_salvage_keeps_complete_fields_and_partial_last_one():
+    content = json.dumps(CODE)
+    cut = content.index('"js"') + len('"js": "console')
+
+    values, completed = salvage_fields(content[:cut])
+
+    assert values["html"] == CODE["html"]
+    assert values["css"] == CODE["css"]
+    assert values["js"] == "console"
+    assert completed == {"html", "css"}
+
+
+def test_salvage_of_cut_off_escape_drops_the_partial_sequence():
+    values, completed = salvage_fields('{"html": "caf\\u00')
+
+    assert values == {"html": "caf"}
+    assert completed == set()
+
+
+def test_join_continuation_drops_fence_and_repeated_tail():
+    content = '{"html": "<section class=\\"pricing\\">'
+    continuation = '```json\n<section class=\\"pricing\\"><h2>Plans</h2></section>", "css": "", "js": ""}'
+
+    joined = join_continuation(content, continuation)
+
+    assert json.loads(joined)["html"] == '<section class="pricing"><h2>Plans</h2></section>'
+
+
+def test_join_continuation_keeps_ambiguous_overlap():
+    row = "<li>item</li>" * 4
+    assert join_continuation(row, row) == row + row
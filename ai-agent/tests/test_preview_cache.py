@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services.artifact_manager import PreviewNotReady
+from services.preview_renderer import sanitize_preview
+from services.shared_state import MemoryStateBackend, SharedState
+
+
+def completed_row(artifact_id: str) -> dict:
+    return {
+        "id": artifact_id,
+        "status": "completed",
+        "preview_html": None,
+        **sanitize_preview("<html><body><h1>Hello</h1></body></html>", "h1 { color: red; }", "")
+    }
+
+
+def test_completed_preview_is_cached(artifact_manager, supabase):
+    supabase.rows.append(completed_row("a1"))
+
+    first = asyncio.run(artifact_manager.get_preview_frame("a1"))
+    second = asyncio.run(artifact_manager.get_preview_frame("a1"))
+
+    assert "<h1>Hello</h1>" in first[0]
+    assert first == second
+    assert len(supabase.requests) == 1
+
+
+@pytest.mark.parametrize("status", ["pending", "processing", "failed"])
+def test_unfinished_preview_is_not_cached(artifact_manager, supabase, status):
+    supabase.rows.append({"id": "a1", "status": status, "preview_html": None})
+
+    with pytest.raises(PreviewNotReady) as raised:
+        asyncio.run(artifact_manager.get_preview("a1"))
+    assert raised.value.status == status
+    assert "a1" not in artifact_manager.preview_cache
+
+    # Completed by another worker: the next request sees the real preview
+    supabase.rows[0].update(completed_row("a1"))
+    document, _ = asyncio.run(artifact_manager.get_preview_frame("a1"))
+    assert "<h1>Hello</h1>" in document
+
+
+@pytest.mark.parametrize("status, code", [("pending", 202), ("processing", 202), ("failed", 404)])
+def test_preview_route_does_not_cache_unfinished_artifacts(artifact_manager, supabase, monkeypatch, status, code):
+    import main
+
+    supabase.rows.append({"id": "a1", "status": status, "preview_html": None})
+    monkeypatch.setattr(main, "artifact_manager", artifact_manager)
+    client = TestClient(main.app)
+
+    for path in ("/preview/a1", "/preview/a1/frame"):
+        response = client.get(path)
+        assert response.status_code == code
+        assert response.headers["cache-control"] == "no-store"
+        assert "etag" not in response.headers
+
+
+@pytest.mark.parametrize("change", ["update", "delete"])
+def test_change_on_another_worker_invalidates_cached_preview(make_artifact_manager, supabase, change):
+    state = SharedState(MemoryStateBackend(100))
+    reader, writer = make_artifact_manager(state), make_artifact_manager(state)
+    supabase.rows.append(completed_row("a1"))
+    asyncio.run(reader.get_preview_frame("a1"))
+
+    if change == "update":
+        asyncio.run(writer.update_artifact_status("a1", "processing"))
+        with pytest.raises(PreviewNotReady):
+            asyncio.run(reader.get_preview_frame("a1"))
+    else:
+        asyncio.run(writer.delete_artifact("a1"))
+        with pytest.raises(RuntimeError, match="not found"):
+            asyncio.run(reader.get_preview_frame("a1"))
+    assert "a1" not in reader.preview_cache
+
+
+def test_cached_preview_is_served_while_its_version_is_current(make_artifact_manager, supabase):
+    state = SharedState(MemoryStateBackend(100))
+    reader = make_artifact_manager(state)
+    supabase.rows.append(completed_row("a1"))
+
+    asyncio.run(reader.get_preview_frame("a1"))
+    asyncio.run(reader.get_preview_frame("a1"))
+
+    assert len(supabase.requests) == 1
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from services import code_generator
+from services.code_generator import CircuitBreaker, CodeGenerator, RetryBudget
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(code_generator.time, "monotonic", clock)
+    return clock
+
+
+def make_breaker():
+    return CircuitBreaker("openai", "gpt", failure_threshold=2, cooldown_seconds=10, alpha=0.5, error_half_life=60)
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown(clock):
+    breaker = make_breaker()
+
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.now += 10
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one trial request at a time
+    assert not breaker.allow()
+
+    breaker.record_success(1.0)
+    assert breaker.state == "closed"
+    assert breaker.consecutive_failures == 0
+    assert breaker.ewma_latency == 1.0
+
+
+def test_failed_half_open_trial_reopens_the_breaker(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.opened_at == clock.now
+    assert not breaker.allow()
+
+
+def test_released_trial_lets_the_next_request_through(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+
+    breaker.release()
+
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_error_rate_decays_while_idle(clock):
+    breaker = make_breaker()
+    breaker.record_failure()
+    assert breaker.error_rate() == 0.5
+
+    clock.now += 60
+
+    assert breaker.error_rate() == 0.25
+
+
+def test_retry_budget_refills_by_ratio_up_to_its_cap():
+    budget = RetryBudget(ratio=0.5, min_reserve=1, max_reserve=2)
+
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    assert budget.exhausted == 1
+
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+    for _ in range(10):
+        budget.deposit()
+    assert budget.balance == 2
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    monkeypatch.setenv("ROUTER_MAX_RETRIES", "0")
+    monkeypatch.setenv("OPENAI_GPT_MODEL", "gpt-primary")
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    return CodeGenerator()
+
+
+def call_failing(generator, error):
+    calls = []
+
+    async def call(provider, model):
+        calls.append(model)
+        if model == "gpt-primary":
+            raise error
+        return "ok"
+
+    result = asyncio.run(generator._call_with_router(generator.router.order(), call))
+    return result, calls
+
+
+@pytest.mark.parametrize("error", [APIError(500), APIError(529), APIError(429), APIError(404), asyncio.TimeoutError()])
+def test_provider_failures_count_against_the_breaker(generator, error):
+    result, calls = call_failing(generator, error)
+
+    assert result == "ok"
+    assert calls == ["gpt-primary", "gpt-4o-mini"]
+    assert generator.router.breakers[("openai", "gpt-primary")].failures == 1
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 403, 413, 422])
+def test_request_errors_are_raised_without_touching_the_breaker(generator, status_code):
+    with pytest.raises(APIError):
+        call_failing(generator, APIError(status_code))
+
+    breaker = generator.router.breakers[("openai", "gpt-primary")]
+    assert breaker.failures == 0
+    assert breaker.ewma_error_rate == 0
+    assert breaker.allow()
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from services.sanitizer import sanitize_html_body, splice_sanitized_body
+
+PAGE = """<!DOCTYPE html><html><head><title>T</title><script src="https://cdn.tailwindcss.com"></script>
+<style>.hero{color:red}</style></head><body class="bg-white">
+<header class="bg-white shadow"><nav class="flex gap-4"><a href="#home" class="text-blue-600">Home</a><a href="#pricing">Pricing</a></nav></header>
+<main><section id="hero" class="p-8"><h1 class="text-4xl font-bold">Build faster &amp; better</h1><p>Ship in days, not weeks.</p>
+<button class="btn px-4 py-2" onclick="go()">Start</button><img src="a.png" alt="x"></section>
+<!-- comment <div> -->
+<section id="pricing" class="grid grid-cols-3"><div class="p-4"><h2>Basic</h2><p>$9</p></div><div class="p-4"><h2>Pro</h2><p>$29</p></div></section>
+<table class="t"><tr><td>A &nbsp B<td>C</tr></table><ul><li>one<li>two &lt;3 &#169 &#x41;</ul><p>para one<p>para two<br>line
+<textarea>raw <b>x</b></textarea><object data="x"><param name="a"></object><svg><use xlink:href="javascript:x"/></svg>
+<script>var x = "<div class='p-4'>";</script></main>
+<footer class="text-sm">&copy; 2025 Tom & Jerry</footer></body></html>"""
+
+REPLACEMENTS = [
+    '<div class="x">', "<p>", "</p>", "<style>", "<!--", "<td>", "<ul><li>a", "&amp", "&", "x&gt;y",
+    "<b>new</b>", "plain text", 'class="text-red-500"', "</div><div>", "<script>alert(1)</script>",
+    '" onmouseover="x', "javascript:alert(1)", '<a href="javascript:x">y</a>', "  ", ""
+]
+
+
+def assert_matches_full_sanitize(page, pos, old, new):
+    result = splice_sanitized_body(page, sanitize_html_body(page), pos, old, new)
+    if result is None:
+        return False
+    edited, body = result
+    assert edited == page[:pos] + new + page[pos + len(old):]
+    assert body == sanitize_html_body(edited)
+    return True
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_splice_matches_full_sanitize(seed):
+    rng = random.Random(seed)
+    spliced = 0
+    for _ in range(2000):
+        pos = rng.randrange(len(PAGE))
+        old = PAGE[pos:pos + rng.randrange(1, 40)]
+        spliced += assert_matches_full_sanitize(PAGE, pos, old, rng.choice(REPLACEMENTS))
+    # The fast path has to actually be taken for the comparison to mean anything
+    assert spliced > 50
+
+
+def test_splice_refuses_entity_edit():
+    page = "<body><p>a &amp; b</p></body>"
+    assert splice_sanitized_body(page, sanitize_html_body(page), page.index("&amp;"), "&amp;", "&amblue") is None
+
+
+def test_splice_patches_the_edited_copy():
+    page = '<body><img src="a.png"><img src="a.png"><img src="a.png"></body>'
+    pos = page.index("a.png", page.index("a.png") + 1)
+
+    edited, body = splice_sanitized_body(page, sanitize_html_body(page), pos, "a.png", "b.png")
+
+    assert body == '<img src="a.png"><img src="b.png"><img src="a.png">'
+    assert body == sanitize_html_body(edited)
+
+
+def test_splice_without_body_keeps_whitespace():
+    page = "\nhello\n"
+
+    assert assert_matches_full_sanitize(page, 1, "hello", "world")
+    assert splice_sanitized_body(page, sanitize_html_body(page), 1, "hello", "world")[1] == "\nworld\n"
+
+
+def test_splice_refuses_span_before_body():
+    page = "<html><head><title>T</title></head><body><p>x</p></body></html>"
+    assert splice_sanitized_body(page, sanitize_html_body(page), page.index("T<"), "T", "U") is None
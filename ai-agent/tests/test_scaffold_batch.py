@@ -0,0 +1,68 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+CODE = {"html": "<h1>Hi</h1>", "css": "", "js": ""}
+
+
+async def generate_from_prompt(prompt, **kwargs):
+    if prompt == "broken":
+        raise RuntimeError("provider failed")
+    return dict(CODE)
+
+
+def read_events(response):
+    events = []
+    for message in response.text.strip().split("\n\n"):
+        event, data = message.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@pytest.fixture
+def client(artifact_manager, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "artifact_manager", artifact_manager)
+    monkeypatch.setattr(main, "code_generator", SimpleNamespace(generate_from_prompt=generate_from_prompt))
+    return TestClient(main.app)
+
+
+def post_batch(client, prompts):
+    return client.post("/scaffold/batch", json={
+        "project_id": "p1",
+        "user_id": "u1",
+        "items": [{"prompt": prompt} for prompt in prompts]
+    })
+
+
+def test_batch_announces_ids_only_after_they_are_stored(client, supabase):
+    events = read_events(post_batch(client, ["one", "broken", "two"]))
+
+    items = [data for event, data in events if event == "item"]
+    stored = [data for data in items if data["status"] == "stored"]
+    assert all("artifact_id" not in data for data in items if data["status"] != "stored")
+    assert {data["index"] for data in stored} == {0, 2}
+    assert {data["artifact_id"] for data in stored} == {row["id"] for row in supabase.rows}
+    assert items.index(stored[0]) > max(items.index(data) for data in items if data["status"] == "generated")
+
+    event, complete = events[-1]
+    assert event == "complete"
+    assert complete["status"] == "partial"
+    assert complete["succeeded"] == 2
+
+
+def test_batch_reports_failed_insert_per_item(client, artifact_manager, supabase, monkeypatch):
+    async def insert_artifacts(rows):
+        raise RuntimeError("Failed to create artifact: 500")
+
+    monkeypatch.setattr(artifact_manager, "insert_artifacts", insert_artifacts)
+    events = read_events(post_batch(client, ["one", "two"]))
+
+    failed = [data for event, data in events if event == "item" and data["status"] == "failed"]
+    assert {data["index"] for data in failed} == {0, 1}
+    assert not any("artifact_id" in data for _, data in events)
+    assert events[-1][1]["succeeded"] == 0
+    assert events[-1][1]["artifact_ids"] == []
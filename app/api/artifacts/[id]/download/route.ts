@@ -38,11 +38,12 @@ export async function GET(
       return NextResponse.json({ error: 'Project not found' }, { status: 404 })
     }
 
-    // Fetch the latest artifact for this project
+    // Fetch the latest completed artifact for this project; pending and failed rows have no code yet
     const { data: artifact, error: artifactError } = await supabase
       .from('artifacts')
-      .select('*')
+      .select('html_content, css_content, js_content')
       .eq('project_id', projectId)
+      .eq('status', 'completed')
       .order('created_at', { ascending: false })
       .limit(1)
       .single()
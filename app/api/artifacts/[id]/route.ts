@@ -37,11 +37,12 @@ export async function GET(
       return NextResponse.json({ error: 'Project not found' }, { status: 404 })
     }
 
-    // Fetch the latest artifact for this project
+    // Fetch the latest completed artifact for this project; pending and failed rows have no code yet
     const { data: artifacts, error: artifactError } = await supabase
       .from('artifacts')
-      .select('*')
+      .select('id, html_content, css_content, js_content, preview_url, created_at')
       .eq('project_id', projectId)
+      .eq('status', 'completed')
       .order('created_at', { ascending: false })
       .limit(1)
 
@@ -3,6 +3,8 @@ import { auth } from '@clerk/nextjs/server'
 import { createClient } from '@supabase/supabase-js'
 
 const AI_AGENT_URL = process.env.AI_AGENT_URL || 'http://localhost:8000'
+const AGENT_JOB_TIMEOUT_MS = Number(process.env.AI_AGENT_JOB_TIMEOUT_MS || 300_000) // 5 min
+const AGENT_JOB_POLL_INTERVAL_MS = 1_500
 
 const SUPABASE_URL = process.env.NEXT_PUBLIC_SUPABASE_URL
 const SUPABASE_SERVICE_ROLE_KEY = process.env.SUPABASE_SERVICE_ROLE_KEY
@@ -14,6 +16,16 @@ if (!SUPABASE_SERVICE_ROLE_KEY) {
   throw new Error('Environment variable SUPABASE_SERVICE_ROLE_KEY is not defined')
 }
 
+// W3C trace context for calls to the agent: keep the caller's trace id when
+// one came in, with a fresh span id for this hop
+function agentTraceparent(request: NextRequest): string {
+  const incoming = request.headers.get('traceparent')
+  const match = incoming?.match(/^00-([0-9a-f]{32})-[0-9a-f]{16}-([0-9a-f]{2})$/)
+  const traceId = match ? match[1] : crypto.randomUUID().replace(/-/g, '')
+  const spanId = crypto.randomUUID().replace(/-/g, '').slice(0, 16)
+  return `00-${traceId}-${spanId}-${match ? match[2] : '01'}`
+}
+
 export async function POST(request: NextRequest) {
   // Initialize Supabase client once for the entire handler
   const supabase = createClient(
@@ -24,6 +36,7 @@ export async function POST(request: NextRequest) {
   let requestBody: any = null
   let projectId: string | null = null
   let projectValidated = false
+  const traceparent = agentTraceparent(request)
   
   try {
     // Check authentication
@@ -59,33 +72,18 @@ export async function POST(request: NextRequest) {
     // Project exists and belongs to user, mark as validated
     projectValidated = true
 
-    // Get the image as base64 instead of sending URL to AI agent
-    let imageBase64: string | null = null
+    // The agent fetches the screenshot from storage itself and caches it,
+    // so regenerations do not transfer the image again
+    let imagePath: string | null = null
     if (project.screenshot_url) {
-      try {
-        // screenshot_url now stores the relative path inside the bucket
-        // Use the exact storage object path as saved during upload
-        const normalizedPath = project.screenshot_url.replace(/^\/+/, '')
-
-        // Basic traversal safety check
-        if (normalizedPath.includes('..')) {
-          throw new Error('Unsafe screenshot path detected')
-        }
-
-        const { data: fileData, error: downloadError } = await supabase.storage
-          .from('screenshots')
-          .download(normalizedPath)
-
-        if (!downloadError && fileData) {
-          const arrayBuffer = await fileData.arrayBuffer()
-          const base64String = Buffer.from(arrayBuffer).toString('base64')
-
-          const fileExt = normalizedPath.toLowerCase().split('.').pop()
-          const mimeType = fileExt === 'jpg' || fileExt === 'jpeg' ? 'image/jpeg' : 'image/png'
-          imageBase64 = `data:${mimeType};base64,${base64String}`
-        }
-      } catch (error) {
-        console.warn('Failed to get image for AI agent:', error)
+      // screenshot_url stores the relative path inside the screenshots bucket
+      const normalizedPath = project.screenshot_url.replace(/^\/+/, '')
+
+      // Basic traversal safety check
+      if (normalizedPath.includes('..')) {
+        console.warn('Unsafe screenshot path detected, generating without image')
+      } else {
+        imagePath = normalizedPath
       }
     }
 
@@ -106,27 +104,35 @@ export async function POST(request: NextRequest) {
       )
     }
 
-    // Send request to AI agent with timeout
-    const controller = new AbortController()
-    const timeoutId = setTimeout(() => controller.abort(), 60_000) // 60s
-
-    let agentResponse: Response
-    try {
-      agentResponse = await fetch(`${AI_AGENT_URL}/scaffold`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          prompt,
-          project_id: projectId,
-          image_base64: imageBase64,
-          preferences: preferences || {}
-        }),
-        signal: controller.signal,
-      })
-    } finally {
-      clearTimeout(timeoutId)
+    // Queue the generation on the AI agent; it answers right away with a job id
+    const agentResponse = await fetch(`${AI_AGENT_URL}/jobs`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', traceparent },
+      body: JSON.stringify({
+        prompt,
+        project_id: projectId,
+        // Ownership was verified above; lets the agent skip its own project lookup
+        user_id: userId,
+        image_path: imagePath,
+        preferences: preferences || {},
+      }),
+      signal: AbortSignal.timeout(30_000),
+    })
+
+    if (agentResponse.status === 429) {
+      // Agent queue is full; nothing was generated
+      await supabase
+        .from('projects')
+        .update({ 
+          status: 'failed',
+          updated_at: new Date().toISOString()
+        })
+        .eq('id', projectId)
+
+      return NextResponse.json(
+        { success: false, error: 'AI service is busy. Please try again in a few seconds.' },
+        { status: 429, headers: { 'Retry-After': agentResponse.headers.get('Retry-After') || '5' } }
+      )
     }
 
     if (!agentResponse.ok) {
@@ -143,7 +149,8 @@ export async function POST(request: NextRequest) {
       throw new Error(`AI agent error: ${agentResponse.status} - ${errorText}`)
     }
 
-    const result = await agentResponse.json()
+    const job = await agentResponse.json()
+    const result = await waitForAgentJob(job.job_id, traceparent)
 
     // Update project status to completed
     const { error: completionError } = await supabase
@@ -191,7 +198,7 @@ export async function POST(request: NextRequest) {
     })
 
   } catch (error) {
-    console.error('Scaffold API error:', error)
+    console.error(`Scaffold API error (trace ${traceparent.split('-')[1]}):`, error)
     
     // Mark project as failed only if validation succeeded
     if (projectValidated && projectId) {
@@ -227,4 +234,34 @@ export async function POST(request: NextRequest) {
       { status: 500 }
     )
   }
-}
\ No newline at end of file
+}
+
+// Poll the agent until the queued generation finishes or the deadline passes
+async function waitForAgentJob(jobId: string, traceparent: string) {
+  const deadline = Date.now() + AGENT_JOB_TIMEOUT_MS
+
+  while (Date.now() < deadline) {
+    const response = await fetch(`${AI_AGENT_URL}/jobs/${jobId}`, {
+      cache: 'no-store',
+      headers: { traceparent },
+      signal: AbortSignal.timeout(10_000),
+    })
+
+    if (!response.ok) {
+      const errorText = await response.text()
+      throw new Error(`AI agent error: ${response.status} - ${errorText}`)
+    }
+
+    const job = await response.json()
+    if (job.status === 'completed') {
+      return job
+    }
+    if (job.status === 'failed') {
+      throw new Error(`AI agent error: generation failed - ${job.error || 'unknown error'}`)
+    }
+
+    await new Promise((resolve) => setTimeout(resolve, AGENT_JOB_POLL_INTERVAL_MS))
+  }
+
+  throw new Error('AI agent error: generation timed out')
+}
@@ -0,0 +1,23 @@
+-- Store the sanitized preview parts instead of a fully rendered preview document
+-- preview_html held the whole page base64-encoded inside a wrapper (~2.5x the generated code);
+-- the AI agent now renders the wrapper and the framed page at serve time from these columns
+
+ALTER TABLE "public"."artifacts" 
+ADD COLUMN "preview_body" TEXT,
+ADD COLUMN "preview_css" TEXT,
+ADD COLUMN "preview_js" TEXT;
+
+-- Generated code compresses well once it is no longer base64-encoded; use lz4 for TOASTed values
+ALTER TABLE "public"."artifacts" 
+ALTER COLUMN "html_content" SET COMPRESSION lz4,
+ALTER COLUMN "css_content" SET COMPRESSION lz4,
+ALTER COLUMN "js_content" SET COMPRESSION lz4,
+ALTER COLUMN "preview_body" SET COMPRESSION lz4,
+ALTER COLUMN "preview_css" SET COMPRESSION lz4,
+ALTER COLUMN "preview_js" SET COMPRESSION lz4;
+
+-- Existing rows keep preview_html until ai-agent/scripts/backfill_compact_previews.py rewrites them
+COMMENT ON COLUMN "public"."artifacts"."preview_body" IS 'Sanitized body markup of the preview; rendered into the preview frame at serve time';
+COMMENT ON COLUMN "public"."artifacts"."preview_css" IS 'Sanitized CSS of the preview';
+COMMENT ON COLUMN "public"."artifacts"."preview_js" IS 'Sanitized JavaScript of the preview';
+COMMENT ON COLUMN "public"."artifacts"."preview_html" IS 'Legacy fully rendered preview document; null for compact previews';
@@ -0,0 +1,11 @@
+-- Incremental edits store each refined version as a new artifact linked to the one it was edited from,
+-- so earlier versions stay previewable and an edit can be undone by going back to its parent
+
+ALTER TABLE "public"."artifacts" 
+ADD COLUMN "parent_artifact_id" UUID REFERENCES "public"."artifacts"("id") ON DELETE SET NULL,
+ADD COLUMN "edit_instruction" TEXT;
+
+CREATE INDEX idx_artifacts_parent_artifact_id ON artifacts(parent_artifact_id) WHERE parent_artifact_id IS NOT NULL;
+
+COMMENT ON COLUMN "public"."artifacts"."parent_artifact_id" IS 'Artifact this version was edited from; null for generated artifacts';
+COMMENT ON COLUMN "public"."artifacts"."edit_instruction" IS 'Instruction that produced this version from its parent';